@@ -0,0 +1,88 @@
+import io
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from typing import List
+
+# the columns of each shape of table, as mojap metadata types
+_shape_columns = {
+    "narrow": ["int64", "float64", "string", "bool", "int64", "string"],
+    "wide": ["int64", "float64", "string", "bool"] * 15,
+    "skewed": ["int64", "string", "float64"],
+}
+
+
+def make_table(shape: str, num_rows: int, seed: int = 0) -> pd.DataFrame:
+    """
+    Makes a table of num_rows random rows. narrow and wide tables have short
+    strings, a skewed table has one string column whose lengths follow a long tailed
+    (lognormal) distribution, so a few rows are much wider than the rest.
+    """
+    rng = np.random.default_rng(seed)
+    columns = {}
+    for n, col_type in enumerate(_shape_columns[shape]):
+        name = f"col_{n}"
+        if col_type == "int64":
+            columns[name] = rng.integers(0, 10**6, num_rows)
+        elif col_type == "float64":
+            columns[name] = rng.normal(size=num_rows).round(6)
+        elif col_type == "bool":
+            columns[name] = rng.integers(0, 2, num_rows).astype(bool)
+        elif shape == "skewed":
+            lengths = np.minimum(rng.lognormal(3, 1.5, num_rows).astype(int), 10**5)
+            columns[name] = ["x" * (length + 1) for length in lengths]
+        else:
+            columns[name] = [f"value_{i}" for i in rng.integers(0, 1000, num_rows)]
+    return pd.DataFrame(columns)
+
+
+def make_metadata(shape: str, table_name: str) -> dict:
+    return {
+        "name": table_name,
+        "columns": [
+            {"name": f"col_{n}", "type": col_type}
+            for n, col_type in enumerate(_shape_columns[shape])
+        ],
+    }
+
+
+def serialise(df: pd.DataFrame, file_format: str) -> bytes:
+    if file_format == "csv":
+        return df.to_csv(index=False).encode("utf-8")
+    if file_format == "jsonl":
+        return df.to_json(orient="records", lines=True).encode("utf-8")
+    buf = io.BytesIO()
+    pq.write_table(pa.Table.from_pandas(df, preserve_index=False), buf)
+    return buf.getvalue()
+
+
+def write_inputs(
+    directory: str,
+    table_name: str,
+    shape: str,
+    num_rows: int,
+    num_files: int,
+    file_format: str,
+) -> List[str]:
+    """
+    Writes num_rows rows of a table of the given shape, split evenly between
+    num_files files, to directory/table_name. Returns the paths written. The
+    table's metadata is written beside the table folder.
+    """
+    table_dir = os.path.join(directory, table_name)
+    os.makedirs(table_dir, exist_ok=True)
+    df = make_table(shape, num_rows)
+    paths = []
+    for n, rows in enumerate(np.array_split(np.arange(num_rows), num_files)):
+        path = os.path.join(table_dir, f"{table_name}_{n}.{file_format}")
+        with open(path, "wb") as f:
+            f.write(serialise(df.iloc[rows], file_format))
+        paths.append(path)
+    with open(os.path.join(directory, f"{table_name}.json"), "w") as f:
+        json.dump(make_metadata(shape, table_name), f)
+    return paths
@@ -0,0 +1,51 @@
+import resource
+import threading
+
+from botocore.client import BaseClient
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict
+
+
+class S3RequestCounter:
+    """
+    Counts the s3 requests made by every boto client (the package's, and those
+    used by arrow_pd_parser through awswrangler) by operation, and the bytes sent in
+    request bodies and received in GetObject responses.
+    """
+
+    def __init__(self):
+        self.requests: Dict[str, int] = Counter()
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def counting(self):
+        original = BaseClient._make_api_call
+        counter = self
+
+        def counted(client, operation_name, api_params):
+            response = original(client, operation_name, api_params)
+            body = api_params.get("Body")
+            with counter._lock:
+                counter.requests[operation_name] += 1
+                if isinstance(body, (bytes, bytearray, memoryview)):
+                    counter.bytes_sent += len(body)
+                elif hasattr(body, "getbuffer"):
+                    counter.bytes_sent += body.getbuffer().nbytes
+                if operation_name == "GetObject":
+                    counter.bytes_received += response.get("ContentLength", 0)
+            return response
+
+        BaseClient._make_api_call = counted
+        try:
+            yield self
+        finally:
+            BaseClient._make_api_call = original
+
+
+def get_peak_rss_bytes() -> int:
+    # the most memory the process has held since it started (ru_maxrss is in KiB
+    # on linux)
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
@@ -0,0 +1,329 @@
+"""
+Benchmarks S3DataPacker.pack_data on synthetic data, end to end and by phase.
+
+    python -m benchmarks.run --output results.json
+    python -m benchmarks.run --filter local-arrow --compare results.json
+
+Each case is run in a process of its own, so its peak memory isn't that of the
+cases before it. s3 cases run against moto's in-process mock, which only intercepts
+boto clients, so they're limited to what's read and written with boto: csv and
+jsonl inputs, the pandas engine, and single threaded uploads. The local cases cover
+every engine and format.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+from collections import Counter
+from benchmarks.data import write_inputs
+from benchmarks.measure import S3RequestCounter, get_peak_rss_bytes
+from typing import List, NamedTuple
+
+shapes = ["narrow", "wide", "skewed"]
+# the number of files the rows are split between
+layouts = {"many_small": 100, "few_large": 2}
+input_formats = ["csv", "jsonl", "parquet"]
+engines = ["pandas", "arrow"]
+targets = ["local", "s3"]
+# rows of each shape, so each table is a similar size
+default_rows = {"narrow": 200_000, "wide": 20_000, "skewed": 50_000}
+bucket = "s3-data-packer-benchmark"
+
+
+class BenchmarkCase(NamedTuple):
+    target: str
+    engine: str
+    shape: str
+    layout: str
+    input_format: str
+    num_rows: int
+    output_file_ext: str = "snappy.parquet"
+    read_chunksize: str = None
+    parse_workers: int = None
+
+    @property
+    def name(self) -> str:
+        name = "-".join(
+            [self.target, self.engine, self.shape, self.layout, self.input_format]
+        )
+        if self.read_chunksize is not None:
+            name = f"{name}-chunked"
+        return name if self.parse_workers is None else f"{name}-parallel"
+
+
+def get_cases(
+    scale: float = 1,
+    output_file_ext: str = "snappy.parquet",
+    read_chunksize=None,
+    parse_workers: int = None,
+) -> List[BenchmarkCase]:
+    cases = []
+    for target in targets:
+        for engine in engines:
+            for shape in shapes:
+                for layout in layouts:
+                    for input_format in input_formats:
+                        case = BenchmarkCase(
+                            target,
+                            engine,
+                            shape,
+                            layout,
+                            input_format,
+                            max(int(default_rows[shape] * scale), layouts[layout]),
+                            output_file_ext,
+                            read_chunksize,
+                            parse_workers,
+                        )
+                        if _can_run(case):
+                            cases.append(case)
+    return cases
+
+
+def _can_run(case: BenchmarkCase) -> bool:
+    # moto can't intercept arrow's own s3 filesystem
+    return case.target == "local" or (
+        case.engine == "pandas" and case.input_format != "parquet"
+    )
+
+
+def prepare_inputs(case: BenchmarkCase, work_dir: str) -> str:
+    """writes the case's input files to a folder of its own, returning the folder"""
+    input_dir = os.path.join(work_dir, case.name, "input")
+    shutil.rmtree(os.path.join(work_dir, case.name), ignore_errors=True)
+    write_inputs(
+        input_dir,
+        "table",
+        case.shape,
+        case.num_rows,
+        layouts[case.layout],
+        case.input_format,
+    )
+    return input_dir
+
+
+def run_case(case: BenchmarkCase, input_dir: str) -> dict:
+    """packs the case's inputs, returning its timings and counts"""
+    if case.target == "s3":
+        from moto import mock_s3
+
+        _set_mock_credentials()
+        with mock_s3():
+            input_basepath = _upload_inputs(input_dir)
+            return _pack(case, input_dir, input_basepath, f"s3://{bucket}/output")
+    output_basepath = os.path.join(os.path.dirname(input_dir), "output")
+    return _pack(case, input_dir, input_dir, output_basepath)
+
+
+def _set_mock_credentials():
+    from s3_data_packer.constants import aws_region
+    from s3_data_packer.s3_client import configure_s3_client
+
+    os.environ["AWS_ACCESS_KEY_ID"] = "testing"
+    os.environ["AWS_SECRET_ACCESS_KEY"] = "testing"
+    os.environ["AWS_DEFAULT_REGION"] = aws_region
+    # remade with the credentials above
+    configure_s3_client()
+
+
+def _upload_inputs(input_dir: str) -> str:
+    from s3_data_packer.constants import aws_region
+    from s3_data_packer.s3_client import get_s3_client
+
+    client = get_s3_client()
+    client.create_bucket(
+        Bucket=bucket, CreateBucketConfiguration={"LocationConstraint": aws_region}
+    )
+    table_dir = os.path.join(input_dir, "table")
+    for file_name in sorted(os.listdir(table_dir)):
+        with open(os.path.join(table_dir, file_name), "rb") as f:
+            client.put_object(Bucket=bucket, Key=f"input/table/{file_name}", Body=f)
+    return f"s3://{bucket}/input"
+
+
+def _pack(
+    case: BenchmarkCase, input_dir: str, input_basepath: str, output_basepath: str
+) -> dict:
+    from s3_data_packer.helpers import _clear_listing_cache
+    from s3_data_packer.instrumentation import PackRecorder, recording
+    from s3_data_packer.s3_data_packer import S3DataPacker
+
+    _clear_listing_cache()
+    with open(os.path.join(input_dir, "table.json")) as f:
+        metadata = json.load(f)
+    table_dir = os.path.join(input_dir, "table")
+    input_bytes = sum(
+        os.path.getsize(os.path.join(table_dir, f)) for f in os.listdir(table_dir)
+    )
+    rss_before_bytes = get_peak_rss_bytes()
+    counter = S3RequestCounter()
+    with counter.counting():
+        start = time.perf_counter()
+        # the listings are made making the packer, so are recorded here
+        with recording(PackRecorder()) as init_recorder:
+            packer = S3DataPacker(
+                input_basepath,
+                output_basepath,
+                "table",
+                metadata=metadata,
+                output_file_ext=case.output_file_ext,
+                input_file_ext=case.input_format,
+                engine=case.engine,
+                read_chunksize=case.read_chunksize,
+                upload_max_workers=1 if case.target == "s3" else None,
+                parse_workers=case.parse_workers,
+            )
+        pack_result = packer.pack_data()
+        seconds = time.perf_counter() - start
+    return {
+        "name": case.name,
+        "case": case._asdict(),
+        "seconds": seconds,
+        "phase_seconds": dict(
+            Counter(init_recorder.phase_seconds) + Counter(pack_result.phase_seconds)
+        ),
+        "phase_calls": dict(
+            Counter(init_recorder.phase_calls) + Counter(pack_result.phase_calls)
+        ),
+        "peak_rss_bytes": get_peak_rss_bytes(),
+        "rss_before_bytes": rss_before_bytes,
+        "input_bytes": input_bytes,
+        "rows_written": pack_result.rows_written,
+        "bytes_written": pack_result.bytes_written,
+        "files_written": len(pack_result.files_created)
+        + len(pack_result.files_overwritten),
+        # every boto client's, including those arrow_pd_parser reads with
+        "s3_requests": dict(counter.requests),
+        "s3_bytes_sent": counter.bytes_sent,
+        "s3_bytes_received": counter.bytes_received,
+    }
+
+
+def run_case_in_process(case: BenchmarkCase, input_dir: str) -> dict:
+    # spawned, so the process starts with none of the memory of this one
+    with multiprocessing.get_context("spawn").Pool(1) as pool:
+        return pool.apply(run_case, (case, input_dir))
+
+
+def run(
+    cases: List[BenchmarkCase], work_dir: str, in_process: bool = False
+) -> List[dict]:
+    results = []
+    for case in cases:
+        input_dir = prepare_inputs(case, work_dir)
+        result = (run_case if in_process else run_case_in_process)(case, input_dir)
+        print(
+            f"{case.name}: {result['seconds']:.3f}s, "
+            f"peak rss {result['peak_rss_bytes'] / 2**20:.0f}MiB",
+            file=sys.stderr,
+        )
+        results.append(result)
+    return results
+
+
+def get_environment() -> dict:
+    from s3_data_packer import __version__
+
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "version": __version__,
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+    }
+
+
+def compare(results: List[dict], baseline: List[dict], threshold: float) -> List[str]:
+    """
+    Lines comparing the seconds and peak memory of each case to the baseline's,
+    with those slower by more than threshold (a fraction) marked as regressions.
+    """
+    baseline_by_name = {r["name"]: r for r in baseline}
+    lines = []
+    for result in results:
+        old = baseline_by_name.get(result["name"])
+        if old is None:
+            lines.append(f"{result['name']}: no baseline")
+            continue
+        ratio = result["seconds"] / max(old["seconds"], 1e-9)
+        rss_ratio = result["peak_rss_bytes"] / max(old["peak_rss_bytes"], 1)
+        flag = " REGRESSION" if ratio > 1 + threshold else ""
+        lines.append(
+            f"{result['name']}: {old['seconds']:.3f}s -> {result['seconds']:.3f}s "
+            f"(x{ratio:.2f}), peak rss x{rss_ratio:.2f}{flag}"
+        )
+    return lines
+
+
+def main(args: List[str] = None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", help="json file the results are written to")
+    parser.add_argument("--compare", help="json results to compare against")
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.1,
+        help="slowdown, as a fraction, reported as a regression",
+    )
+    parser.add_argument(
+        "--filter",
+        action="append",
+        help="only run cases whose name contains this (repeatable, any must match)",
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1, help="multiplies the rows of each case"
+    )
+    parser.add_argument("--output-file-ext", default="snappy.parquet")
+    parser.add_argument("--read-chunksize", help="e.g. 100000 or 64MB")
+    parser.add_argument(
+        "--parse-workers", type=int, help="processes csv and jsonl inputs are parsed on"
+    )
+    parser.add_argument("--work-dir", help="where inputs and outputs are written")
+    parser.add_argument(
+        "--in-process",
+        action="store_true",
+        help="run cases in this process (peak rss then covers all cases so far)",
+    )
+    parsed = parser.parse_args(args)
+
+    read_chunksize = parsed.read_chunksize
+    if read_chunksize is not None and read_chunksize.isdigit():
+        read_chunksize = int(read_chunksize)
+    cases = [
+        c
+        for c in get_cases(
+            parsed.scale, parsed.output_file_ext, read_chunksize, parsed.parse_workers
+        )
+        if not parsed.filter or any(f in c.name for f in parsed.filter)
+    ]
+    if parsed.work_dir is None:
+        with tempfile.TemporaryDirectory() as work_dir:
+            results = run(cases, work_dir, parsed.in_process)
+    else:
+        results = run(cases, parsed.work_dir, parsed.in_process)
+
+    if parsed.output is not None:
+        with open(parsed.output, "w") as f:
+            json.dump({"environment": get_environment(), "results": results}, f)
+    if parsed.compare is not None:
+        with open(parsed.compare) as f:
+            baseline = json.load(f)["results"]
+        print("\n".join(compare(results, baseline, parsed.threshold)))
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+import multiprocessing
+import time
+
+from collections import deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Executor,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from s3_data_packer.constants import default_max_workers
+from s3_data_packer.helpers import (
+    _forget_cached_listings,
+    _get_file_entry,
+    _list_tables_in_path,
+)
+from s3_data_packer.instrumentation import PackResult
+from s3_data_packer.s3_data_packer import S3DataPacker
+from typing import Dict, List, NamedTuple, Union
+
+
+class TablePackResult(NamedTuple):
+    table_name: str
+    rows_written: int
+    bytes_written: int
+    files_written: List[str]
+    duration_seconds: float
+    # set, instead of it being raised, if packing the table failed
+    error: Union[Exception, None] = None
+    # the table's phase timings and s3 requests, as returned by pack_data
+    pack_result: Union[PackResult, None] = None
+
+
+class BatchPacker:
+    """
+    Packs many tables from input_basepath into output_basepath, each with an
+    S3DataPacker made with packer_kwargs. tables are table names or glob patterns
+    (every table in input_basepath if None), and every table's input files are found
+    from one listing of input_basepath.
+
+    Up to max_workers tables are packed at once, on threads or if use_processes on
+    spawned processes, largest first. Processes don't share the listing, or the s3
+    client, so each table's files are listed again in its own process. If
+    max_bytes_in_flight is given, a table isn't started while the input bytes of the
+    tables being packed, and its own, add up to more than it (unless no other table
+    is being packed).
+    """
+
+    def __init__(
+        self,
+        input_basepath: str,
+        output_basepath: str,
+        tables: List[str] = None,
+        max_workers: int = default_max_workers,
+        max_bytes_in_flight: int = None,
+        use_processes: bool = False,
+        **packer_kwargs,
+    ):
+        self.input_basepath = input_basepath
+        self.output_basepath = output_basepath
+        self.tables = tables
+        self.max_workers = max_workers
+        self.max_bytes_in_flight = max_bytes_in_flight
+        self.use_processes = use_processes
+        self.packer_kwargs = packer_kwargs
+
+    def get_table_input_bytes(self) -> Dict[str, int]:
+        """the input bytes of each table to pack, by table name"""
+        # listed afresh for each run, then shared by its packers
+        _forget_cached_listings(self.input_basepath)
+        _forget_cached_listings(self.output_basepath)
+        table_files = _list_tables_in_path(
+            self.input_basepath, self.tables, self.packer_kwargs.get("input_file_ext")
+        )
+        # the tables' existing outputs are listed in one go too, for the packers
+        _list_tables_in_path(self.output_basepath, list(table_files))
+        return {
+            t: sum(_get_file_entry(f).size for f in files)
+            for t, files in table_files.items()
+        }
+
+    def pack(self) -> Dict[str, TablePackResult]:
+        """packs every table, returning the result of each by table name"""
+        table_bytes = self.get_table_input_bytes()
+        waiting = deque(sorted(table_bytes, key=table_bytes.get, reverse=True))
+        running: Dict[Future, str] = {}
+        results = {}
+        with self._get_executor() as executor:
+            while waiting or running:
+                while waiting and self._has_room(
+                    [table_bytes[t] for t in running.values()],
+                    table_bytes[waiting[0]],
+                ):
+                    table_name = waiting.popleft()
+                    future = executor.submit(
+                        _pack_table,
+                        self.input_basepath,
+                        self.output_basepath,
+                        table_name,
+                        self.packer_kwargs,
+                    )
+                    running[future] = table_name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    results[running.pop(future)] = future.result()
+        return {t: results[t] for t in sorted(results)}
+
+    def _get_executor(self) -> Executor:
+        max_workers = max(self.max_workers, 1)
+        if not self.use_processes:
+            return ThreadPoolExecutor(max_workers)
+        # spawned, for the reason S3DataPacker._parsing's process pool is
+        context = multiprocessing.get_context("spawn")
+        return ProcessPoolExecutor(max_workers, mp_context=context)
+
+    def _has_room(self, running_bytes: List[int], table_bytes: int) -> bool:
+        if len(running_bytes) >= max(self.max_workers, 1):
+            return False
+        if self.max_bytes_in_flight is None or not running_bytes:
+            return True
+        return sum(running_bytes) + table_bytes <= self.max_bytes_in_flight
+
+
+def _pack_table(
+    input_basepath: str, output_basepath: str, table_name: str, packer_kwargs: dict
+) -> TablePackResult:
+    # module level, so it can be sent to a process
+    start = time.perf_counter()
+    try:
+        # the tables were just listed, for this run
+        packer = S3DataPacker(
+            input_basepath,
+            output_basepath,
+            table_name,
+            **{"refresh_listing": False, **packer_kwargs},
+        )
+        pack_result = packer.pack_data()
+    except Exception as e:
+        return TablePackResult(table_name, 0, 0, [], time.perf_counter() - start, e)
+    return TablePackResult(
+        table_name,
+        packer.rows_written,
+        packer.bytes_written,
+        packer.files_written,
+        time.perf_counter() - start,
+        pack_result=pack_result,
+    )
@@ -0,0 +1,126 @@
+import warnings
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from arrow_pd_parser._arrow_parsers import (
+    update_existing_schema,
+    validate_arrow_schema,
+)
+from arrow_pd_parser.caster import cast_pandas_column_to_schema
+from arrow_pd_parser.utils import validate_and_enrich_metadata
+from mojap_metadata.converters.arrow_converter import ArrowConverter
+from mojap_metadata.metadata.metadata import Metadata
+from pandas import BooleanDtype, DataFrame, Int64Dtype, StringDtype
+from typing import Dict
+
+# the dtype cast_pandas_column_to_schema gives each type category (with its default
+# pd_integer, pd_boolean and pd_string). Timestamps are cast to python datetime
+# objects, which can't be told apart from strings by dtype, so are always cast
+_pandas_dtypes = {
+    "integer": Int64Dtype(),
+    "float": np.dtype("float64"),
+    "boolean": BooleanDtype(),
+    "string": StringDtype(),
+}
+_complex_type_categories = ["struct", "list"]
+
+
+class CastPlan:
+    """
+    Metadata compiled once for casting many frames to it. DataFrames are cast as
+    arrow_pd_parser's cast_pandas_table_to_schema(df, meta, ignore_columns=
+    meta.partitions) would, but columns that already have the dtype they'd be cast to
+    are left alone, and arrow Tables as cast_arrow_table_to_schema(table, schema,
+    expect_full_schema=False) would, with the schema each source schema is cast to
+    worked out once. A frame that already matches is returned as it is.
+
+    read_schema is what csv and jsonl files are read into arrow with, so their types
+    aren't guessed. Dates and timestamps are read as strings, as arrow's json reader
+    can't parse them, and cast_table parses them, with their datetime_format if they
+    have one (as the pandas caster would).
+    """
+
+    def __init__(self, meta: Metadata):
+        self.meta = meta
+        enriched = validate_and_enrich_metadata(meta)
+        columns = enriched.to_dict()["columns"]
+        self.column_names = [c["name"] for c in columns]
+        # partition columns are left as they are, and complex types aren't cast
+        self._pandas_columns = []
+        for c in columns:
+            if c["name"] in (enriched.partitions or []):
+                continue
+            if c["type_category"] in _complex_type_categories:
+                warnings.warn(
+                    f"complex types ({_complex_type_categories}) are not cast "
+                    f"(column: {c['name']})"
+                )
+                continue
+            self._pandas_columns.append(c)
+        self.schema = ArrowConverter().generate_from_meta(enriched)
+        categories = {c["name"]: c["type_category"] for c in columns}
+        self.read_schema = pa.schema(
+            [
+                pa.field(f.name, pa.string())
+                if categories[f.name] == "timestamp"
+                else f
+                for f in self.schema
+                if categories[f.name] not in _complex_type_categories
+            ]
+        )
+        # the format and unit each timestamp column with a datetime_format is parsed
+        # with, from strings
+        self._datetime_formats = {
+            c["name"]: (
+                c["datetime_format"],
+                getattr(self.schema.field(c["name"]).type, "unit", "s"),
+            )
+            for c in columns
+            if c["type_category"] == "timestamp" and c.get("datetime_format")
+        }
+        # the schema each source schema is cast to
+        self._arrow_schemas: Dict[tuple, pa.Schema] = {}
+
+    def cast_df(self, df: DataFrame) -> DataFrame:
+        cast = {}
+        for c in self._pandas_columns:
+            name = c["name"]
+            if name not in df.columns:
+                raise ValueError(f"Column '{name}' not in df")
+            if df[name].dtype == _pandas_dtypes.get(c["type_category"]):
+                continue
+            cast[name] = cast_pandas_column_to_schema(
+                df[name], metacol=c, num_errors=c.get("num_errors") or "raise"
+            )
+        if not cast and list(df.columns) == self.column_names:
+            return df
+        # the columns in one go, rather than copying the whole df and then each one
+        return DataFrame(
+            {name: cast.get(name, df[name]) for name in self.column_names},
+            index=df.index,
+        )
+
+    def cast_table(self, table: pa.Table) -> pa.Table:
+        table = self._parse_datetimes(table)
+        # schemas with metadata aren't hashable, so keyed by their fields' types
+        key = (tuple(table.schema.names), tuple(table.schema.types))
+        schema = self._arrow_schemas.get(key)
+        if schema is None:
+            schema = validate_arrow_schema(
+                update_existing_schema(table.schema, self.schema), table
+            )
+            self._arrow_schemas[key] = schema
+        if table.schema.equals(schema):
+            return table
+        return table.cast(schema)
+
+    def _parse_datetimes(self, table: pa.Table) -> pa.Table:
+        for name, (datetime_format, unit) in self._datetime_formats.items():
+            i = table.schema.get_field_index(name)
+            if i == -1 or not pa.types.is_string(table.schema.field(i).type):
+                continue
+            parsed = pc.strptime(table[name], format=datetime_format, unit=unit)
+            table = table.set_column(i, name, parsed)
+        return table
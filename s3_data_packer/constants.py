@@ -2,3 +2,46 @@ import os
 
 default_file_limit_gigabytes = 256 * 10**-3  # 256MB, up for debate
 aws_region = os.getenv("AWS_REGION", os.getenv("AWS_DEFAULT_REGION", "eu-west-1"))
+# rows written to a new output file before its bytes-per-row estimate is checked
+default_initial_batch_rows = 10**4
+# output files are closed once within this fraction of file_limit_gigabytes
+default_size_tolerance = 0.05
+# arrow bytes of parquet rows a RollingFileWriter holds in memory for its next row
+# group, when max_memory_bytes isn't set
+default_max_buffer_bytes = 64 * 2**20
+# rows held in memory by sort_by and cluster_by before they're sorted and spilled to
+# disk, when max_memory_bytes isn't set
+default_sort_run_bytes = 256 * 2**20
+# strings in csv inputs read as null, pandas.read_csv's defaults so the arrow engine
+# reads the same nulls as pandas
+csv_null_values = [
+    "",
+    "#N/A",
+    "#N/A N/A",
+    "#NA",
+    "-1.#IND",
+    "-1.#QNAN",
+    "-NaN",
+    "-nan",
+    "1.#IND",
+    "1.#QNAN",
+    "<NA>",
+    "N/A",
+    "NA",
+    "NULL",
+    "NaN",
+    "None",
+    "n/a",
+    "nan",
+    "null",
+]
+# input files read at once, 1 reads them one after another
+default_max_workers = 1
+# size of each part of a concurrent multipart upload, s3's minimum is 5MiB
+default_upload_part_size_bytes = 16 * 2**20
+# table folders listed at once when listing many tables
+default_list_max_workers = 8
+# the s3 client shared by all s3 calls
+default_max_pool_connections = 32
+default_retry_mode = "standard"
+default_max_attempts = 5
@@ -0,0 +1,181 @@
+import os
+import tempfile
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+
+from pandas import DataFrame
+from typing import Dict, Iterable, Iterator, List, Union
+
+# column added to order rows with equal keys by their run while merging
+_run_column = "__external_sort_run"
+
+
+def external_sort(
+    frames: Iterable[Union[DataFrame, pa.Table]],
+    sort_by: List[str],
+    max_run_bytes: int,
+    spill_dir: str = None,
+) -> Iterator[pa.Table]:
+    """
+    Sorts the rows of frames by the sort_by columns (ascending, nulls last), yielding
+    them as arrow Tables in order. Rows are collected until they take up
+    max_run_bytes, then sorted and, if there's more to come, spilled to an arrow file
+    in spill_dir (a temporary directory if None). The spilled runs are then merged,
+    reading slices of about max_run_bytes / the number of runs from each, so only
+    about max_run_bytes of rows are ever in memory at once. Rows with equal keys keep
+    the order they came in.
+    """
+    with tempfile.TemporaryDirectory(dir=spill_dir) as run_dir:
+        run_paths = []
+        buffer = []
+        schema = None
+        for frame in frames:
+            table = _to_table(frame, schema)
+            schema = table.schema
+            buffer.append(table)
+            if sum(t.nbytes for t in buffer) >= max_run_bytes:
+                run_paths.append(_spill_run(_sort(buffer, sort_by), run_dir))
+                buffer = []
+        if not run_paths:
+            # it all fitted in memory, so there's nothing to merge
+            if buffer:
+                yield _sort(buffer, sort_by)
+            return
+        if buffer:
+            run_paths.append(_spill_run(_sort(buffer, sort_by), run_dir))
+        yield from _merge_runs(run_paths, sort_by, max_run_bytes / len(run_paths))
+
+
+def _to_table(frame: Union[DataFrame, pa.Table], schema: pa.Schema = None) -> pa.Table:
+    if not isinstance(frame, pa.Table):
+        frame = pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+    if schema is not None and not frame.schema.equals(schema):
+        frame = frame.select(schema.names).cast(schema)
+    return frame
+
+
+def _get_sort_keys(sort_by: List[str]) -> list:
+    return [(c, "ascending") for c in sort_by]
+
+
+def _sort(tables: List[pa.Table], sort_by: List[str]) -> pa.Table:
+    table = pa.concat_tables(tables)
+    return table.take(pc.sort_indices(table, sort_keys=_get_sort_keys(sort_by)))
+
+
+def _spill_run(table: pa.Table, run_dir: str) -> str:
+    path = os.path.join(run_dir, f"run_{len(os.listdir(run_dir))}.arrow")
+    with pa.OSFile(path, "wb") as f:
+        with pa.ipc.new_file(f, table.schema) as run_writer:
+            run_writer.write_table(table)
+    return path
+
+
+def _read_run(path: str, slice_bytes: float) -> Iterator[pa.Table]:
+    # memory mapped, so only the slice being merged is read in
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        for i in range(reader.num_record_batches):
+            batch = reader.get_batch(i)
+            rows = int(slice_bytes * batch.num_rows / max(batch.nbytes, 1))
+            rows = max(rows, 1)
+            for start in range(0, batch.num_rows, rows):
+                yield pa.Table.from_batches([batch.slice(start, rows)])
+
+
+def _next_batch(run: Iterator[pa.Table]) -> Union[pa.Table, None]:
+    for batch in run:
+        if batch.num_rows:
+            return batch
+    return None
+
+
+def _merge_runs(
+    run_paths: List[str], sort_by: List[str], slice_bytes: float
+) -> Iterator[pa.Table]:
+    runs = [_read_run(p, slice_bytes) for p in run_paths]
+    current = {i: _next_batch(run) for i, run in enumerate(runs)}
+    current = {i: b for i, b in current.items() if b is not None}
+    sort_keys = _get_sort_keys(sort_by) + [(_run_column, "ascending")]
+    while current:
+        # every row up to the lowest of the batches' last rows can be yielded, as
+        # nothing still to be read from any run can sort before it. Each batch is
+        # sorted, so only the rows before that bound are merged
+        last_rows = _tag_rows({r: b.slice(b.num_rows - 1) for r, b in current.items()})
+        bound = last_rows.slice(pc.sort_indices(last_rows, sort_keys)[0].as_py(), 1)
+        used = _count_before(current, bound, sort_keys)
+        merged = pa.concat_tables(
+            _tag(current[run_id].slice(0, rows), run_id)
+            for run_id, rows in used.items()
+            if rows
+        )
+        merged = merged.take(pc.sort_indices(merged, sort_keys=sort_keys))
+        yield merged.drop([_run_column])
+
+        # what's left of each batch, reading the next batch of any run used up
+        for run_id, rows in used.items():
+            rest = current[run_id].slice(rows)
+            if not rest.num_rows:
+                rest = _next_batch(runs[run_id])
+            if rest is None:
+                del current[run_id]
+            else:
+                current[run_id] = rest
+
+
+def _count_before(
+    current: Dict[int, pa.Table], bound: pa.Table, sort_keys: list
+) -> Dict[int, int]:
+    # how many of each sorted batch's rows sort before the bound row (all of its own
+    # run's). Binary searched, for every run at once, so each step is one small sort,
+    # after first ruling out the runs whose first row is past the bound
+    bound_run = bound[_run_column][0].as_py()
+    runs = [run_id for run_id in current if run_id != bound_run]
+    first_rows = dict.fromkeys(runs, 0)
+    low = dict.fromkeys(_get_runs_before(current, first_rows, bound, sort_keys), 1)
+    high = {run_id: current[run_id].num_rows for run_id in low}
+    while any(low[run_id] < high[run_id] for run_id in low):
+        middle = {
+            run_id: (low[run_id] + high[run_id]) // 2
+            for run_id in low
+            if low[run_id] < high[run_id]
+        }
+        before = _get_runs_before(current, middle, bound, sort_keys)
+        for run_id, row in middle.items():
+            if run_id in before:
+                low[run_id] = row + 1
+            else:
+                high[run_id] = row
+    counts = {run_id: low.get(run_id, 0) for run_id in runs}
+    counts[bound_run] = current[bound_run].num_rows
+    return counts
+
+
+def _get_runs_before(
+    current: Dict[int, pa.Table], rows: Dict[int, int], bound: pa.Table, sort_keys: list
+) -> set:
+    # the runs whose row (by position in their batch) sorts before the bound row
+    if not rows:
+        return set()
+    run_ids = list(rows)
+    table = pa.concat_tables(
+        [_tag_rows({r: current[r].slice(rows[r], 1) for r in run_ids}), bound]
+    )
+    order = pc.sort_indices(table, sort_keys=sort_keys).to_numpy()
+    before = order[: int(np.flatnonzero(order == len(run_ids))[0])]
+    return {run_ids[i] for i in before}
+
+
+def _tag(batch: pa.Table, run_id: int) -> pa.Table:
+    return batch.append_column(
+        _run_column, pa.array(np.full(batch.num_rows, run_id, dtype=np.int64))
+    )
+
+
+def _tag_rows(rows: Dict[int, pa.Table]) -> pa.Table:
+    # a row of each run, with its run's id
+    return pa.concat_tables(rows.values()).append_column(
+        _run_column, pa.array(list(rows), pa.int64())
+    )
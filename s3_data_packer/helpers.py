@@ -1,19 +1,64 @@
 import os
-import boto3
+import shutil
+import threading
 
-from collections import Counter
+import pyarrow as pa
+
+from collections import Counter, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
 from dataengineeringutils3 import s3
+from fnmatch import fnmatch
 from glob import glob
+from pyarrow import fs
+from s3_data_packer.constants import (
+    default_list_max_workers,
+    default_upload_part_size_bytes,
+)
+from s3_data_packer.instrumentation import span, submit_in_context
+from s3_data_packer.s3_client import get_arrow_s3_filesystem, get_s3_client
+from s3_data_packer.s3_multipart import S3MultipartWriter
+from typing import (
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Tuple,
+    Union,
+)
+
+
+class FileEntry(NamedTuple):
+    """a listed file, with the details list_objects_v2 gives for it"""
+
+    path: str
+    size: int
+    etag: str = None
+    last_modified: datetime = None
+
+
+# file listings by prefix, shared by every table store in the process. No cached
+# prefix is ever inside another, a listing of a prefix covers all paths under it.
+# Each listing is a dictionary of path to FileEntry, ordered by path
+_listing_cache: Dict[str, Dict[str, FileEntry]] = {}
+_listing_cache_lock = threading.RLock()
+# s3 objects at least this big are copied in parts, as boto's managed copy would
+_multipart_copy_bytes = 8 * 2**20
 
 
 def _get_s3_file_head(f: str):
-    s3_client = boto3.client("s3")
     bk, ky = s3.s3_path_to_bucket_key(f)
-    return s3_client.head_object(Bucket=bk, Key=ky)
+    return get_s3_client().head_object(Bucket=bk, Key=ky)
 
 
 def _get_file_size(f: str):
-    if f.startswith("s3://"):
+    # the listing has the size already, if f has been listed
+    entry = _get_file_entry(f)
+    if entry is not None:
+        file_size_bytes = entry.size
+    elif f.startswith("s3://"):
         resp = _get_s3_file_head(f)
         file_size_bytes = resp.get("ContentLength", 0)
     else:
@@ -21,15 +66,276 @@ def _get_file_size(f: str):
     return file_size_bytes
 
 
-def _list_files_in_path(f: str, ext: str = None):
+def _get_arrow_filesystem(f: str) -> Tuple[fs.FileSystem, str]:
     if f.startswith("s3://"):
-        files = s3.get_filepaths_from_s3_folder(f, file_extension=ext)
+        return get_arrow_s3_filesystem(), f.replace("s3://", "", 1)
+    return fs.LocalFileSystem(), os.path.abspath(f)
+
+
+def _open_output_stream(
+    f: str,
+    upload_max_workers: int = None,
+    upload_part_size_bytes: int = default_upload_part_size_bytes,
+    append: bool = False,
+) -> Union[pa.NativeFile, S3MultipartWriter]:
+    """
+    Opens f to write to, either locally or on s3. If append is True, f must exist
+    and is written to the end of. s3 paths are written with S3MultipartWriter if
+    appending or if upload_max_workers is set.
+    """
+    if f.startswith("s3://") and (upload_max_workers or append):
+        return S3MultipartWriter(
+            f,
+            max_workers=upload_max_workers or 1,
+            part_size_bytes=upload_part_size_bytes,
+            existing_size=_get_file_size(f) if append else 0,
+        )
+    if not f.startswith("s3://"):
+        dirs = os.path.dirname(f)
+        if dirs:
+            os.makedirs(dirs, exist_ok=True)
+    arrow_fs, pth = _get_arrow_filesystem(f)
+    if append:
+        return arrow_fs.open_append_stream(pth)
+    return arrow_fs.open_output_stream(pth)
+
+
+def _copy_file(src: str, dst: str):
+    """
+    Copies src to dst, which must both be local or both be on s3. s3 objects are
+    copied on s3's side (in parts on boto's transfer threads, if large), without
+    being downloaded.
+    """
+    size = _get_file_size(src)
+    if src.startswith("s3://"):
+        src_bucket, src_key = s3.s3_path_to_bucket_key(src)
+        dst_bucket, dst_key = s3.s3_path_to_bucket_key(dst)
+        copy_source = {"Bucket": src_bucket, "Key": src_key}
+        if size < _multipart_copy_bytes:
+            # one request, on this thread
+            get_s3_client().copy_object(
+                CopySource=copy_source, Bucket=dst_bucket, Key=dst_key
+            )
+        else:
+            get_s3_client().copy(copy_source, dst_bucket, dst_key)
+    else:
+        dirs = os.path.dirname(dst)
+        if dirs:
+            os.makedirs(dirs, exist_ok=True)
+        shutil.copyfile(src, dst)
+    _add_file_to_listing_cache(dst, size)
+
+
+def _move_file(src: str, dst: str):
+    """moves src to dst, local files are renamed and s3 objects copied then deleted"""
+    if src.startswith("s3://"):
+        _copy_file(src, dst)
     else:
-        glob_path = os.path.join(f, "**")
-        glob_path = os.path.join(glob_path, f"*.{ext}") if ext else glob_path
-        files = [f for f in glob(glob_path, recursive=True) if os.path.isfile(f)]
+        size = _get_file_size(src)
+        dirs = os.path.dirname(dst)
+        if dirs:
+            os.makedirs(dirs, exist_ok=True)
+        os.replace(src, dst)
+        _add_file_to_listing_cache(dst, size)
+    _delete_file(src)
+
+
+def _delete_file(f: str):
+    """deletes f, if it exists"""
+    if f.startswith("s3://"):
+        bucket, key = s3.s3_path_to_bucket_key(f)
+        get_s3_client().delete_object(Bucket=bucket, Key=key)
+    elif os.path.isfile(f):
+        os.remove(f)
+    _remove_file_from_listing_cache(f)
+
+
+def _list_s3_files(prefix: str) -> List[FileEntry]:
+    bucket, key = s3.s3_path_to_bucket_key(prefix)
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    entries = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=key):
+        entries += [
+            FileEntry(
+                s3.bucket_key_to_s3_path(bucket, obj["Key"]),
+                obj["Size"],
+                obj["ETag"],
+                obj["LastModified"],
+            )
+            for obj in page.get("Contents", [])
+            if obj["Size"]
+        ]
+    return entries
+
+
+def _list_local_files(prefix: str) -> List[FileEntry]:
+    glob_path = os.path.join(prefix, "**")
+    entries = []
+    for f in glob(glob_path, recursive=True):
+        if os.path.isfile(f):
+            stat = os.stat(f)
+            modified = datetime.fromtimestamp(stat.st_mtime, tz=timezone.utc)
+            entries.append(FileEntry(f, stat.st_size, last_modified=modified))
+    return entries
+
+
+def _get_cached_prefix(f: str) -> Union[str, None]:
+    # the cached prefix whose listing covers f, if there is one
+    for prefix in _listing_cache:
+        if f.startswith(prefix):
+            return prefix
+    return None
+
+
+def _sort_entries(entries: Iterable[FileEntry]) -> Dict[str, FileEntry]:
+    return {e.path: e for e in sorted(entries, key=lambda e: e.path)}
+
+
+def _set_cached_listing(prefix: str, entries: List[FileEntry]):
+    with _listing_cache_lock:
+        cached_prefix = _get_cached_prefix(prefix)
+        if cached_prefix is None:
+            # anything cached under the new prefix is now covered by it
+            for covered in [p for p in _listing_cache if p.startswith(prefix)]:
+                del _listing_cache[covered]
+            _listing_cache[prefix] = _sort_entries(entries)
+        else:
+            cached_entries = _listing_cache[cached_prefix].values()
+            kept = [e for e in cached_entries if not e.path.startswith(prefix)]
+            _listing_cache[cached_prefix] = _sort_entries(kept + entries)
 
-    return files
+
+def _add_file_to_listing_cache(
+    f: str, size: int, etag: str = None, last_modified: datetime = None
+):
+    last_modified = last_modified or datetime.now(timezone.utc)
+    entry = FileEntry(f, size, etag, last_modified)
+    with _listing_cache_lock:
+        cached_prefix = _get_cached_prefix(f)
+        if cached_prefix is None:
+            return
+        listing = _listing_cache[cached_prefix]
+        if f in listing:
+            listing[f] = entry
+        else:
+            _listing_cache[cached_prefix] = _sort_entries([*listing.values(), entry])
+
+
+def _remove_file_from_listing_cache(f: str):
+    with _listing_cache_lock:
+        cached_prefix = _get_cached_prefix(f)
+        if cached_prefix is not None:
+            _listing_cache[cached_prefix].pop(f, None)
+
+
+def _clear_listing_cache():
+    with _listing_cache_lock:
+        _listing_cache.clear()
+
+
+def _forget_cached_listings(f: str):
+    # drops the cached listings under f, and any covering it, so that anything
+    # added since they were listed is found by listing f again
+    prefix = s3._add_slash(f)
+    with _listing_cache_lock:
+        for cached in [p for p in _listing_cache if p.startswith(prefix)]:
+            del _listing_cache[cached]
+        cached_prefix = _get_cached_prefix(prefix)
+        if cached_prefix is not None:
+            del _listing_cache[cached_prefix]
+
+
+def _get_file_entry(f: str) -> Union[FileEntry, None]:
+    with _listing_cache_lock:
+        cached_prefix = _get_cached_prefix(f)
+        if cached_prefix is None:
+            return None
+        return _listing_cache[cached_prefix].get(f)
+
+
+def _list_file_entries_in_path(
+    f: str, ext: str = None, refresh: bool = False
+) -> List[FileEntry]:
+    """
+    Lists the files under f, from the listing cache if f is covered by it. Otherwise,
+    or if refresh is True, f is listed (with paginated list_objects_v2 for s3) and
+    the listing cached.
+    """
+    prefix = s3._add_slash(f)
+    entries = None
+    with _listing_cache_lock:
+        cached_prefix = _get_cached_prefix(prefix)
+        if not refresh and cached_prefix is not None:
+            cached_entries = _listing_cache[cached_prefix].values()
+            entries = [e for e in cached_entries if e.path.startswith(prefix)]
+    # listed without holding the lock, so that many paths can be listed at once
+    if entries is None:
+        with span("listing", path=prefix):
+            if prefix.startswith("s3://"):
+                entries = _list_s3_files(prefix)
+            else:
+                entries = _list_local_files(prefix)
+        _set_cached_listing(prefix, entries)
+        entries = list(_sort_entries(entries).values())
+
+    if ext:
+        entries = [e for e in entries if e.path.endswith(f".{ext}")]
+    return entries
+
+
+def _list_files_in_path(f: str, ext: str = None, refresh: bool = False) -> List[str]:
+    return [e.path for e in _list_file_entries_in_path(f, ext, refresh)]
+
+
+def _list_table_names(basepath: str) -> List[str]:
+    # the folders directly under basepath, found without listing their contents.
+    # Hidden ones, starting with _ or ., aren't tables (e.g. _staging)
+    basepath = s3._add_slash(basepath)
+    if not basepath.startswith("s3://"):
+        if not os.path.isdir(basepath):
+            return []
+        return sorted(
+            d
+            for d in os.listdir(basepath)
+            if os.path.isdir(os.path.join(basepath, d)) and not _is_hidden(d)
+        )
+    bucket, key = s3.s3_path_to_bucket_key(basepath)
+    paginator = get_s3_client().get_paginator("list_objects_v2")
+    table_names = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=key, Delimiter="/"):
+        table_names += [
+            p["Prefix"][len(key) :].rstrip("/") for p in page.get("CommonPrefixes", [])
+        ]
+    return [t for t in table_names if not _is_hidden(t)]
+
+
+def _is_hidden(name: str) -> bool:
+    return name.startswith(("_", "."))
+
+
+def _list_tables_in_path(
+    basepath: str,
+    table_names: List[str] = None,
+    ext: str = None,
+    max_workers: int = default_list_max_workers,
+) -> Dict[str, List[str]]:
+    """
+    Lists the files of many tables in basepath at once. The table folders are found
+    with a delimited listing and filtered by table_names, which may contain glob
+    patterns (all tables if None). Each table's folder is then listed, on up to
+    max_workers threads. Returns a dictionary of table name to its files.
+    """
+    found_tables = _list_table_names(basepath)
+    if table_names is not None:
+        found_tables = [
+            t for t in found_tables if any(fnmatch(t, p) for p in table_names)
+        ]
+    table_files = _map_in_order(
+        lambda t: _list_files_in_path(os.path.join(basepath, t), ext),
+        found_tables,
+        max_workers=max_workers,
+    )
+    return dict(zip(found_tables, table_files))
 
 
 def get_file_format(pth: str):  # pth has "s3://"" infront
@@ -48,3 +354,49 @@ def get_file_format(pth: str):  # pth has "s3://"" infront
         )
 
     return found_ffs[0]
+
+
+def _map_in_order(
+    func: Callable,
+    items: Iterable,
+    max_workers: int = 1,
+    max_bytes_in_flight: int = None,
+    get_bytes: Callable = None,
+    get_item_bytes: Callable = None,
+) -> Iterator:
+    """
+    Like map, but func is applied to up to max_workers items at a time on a thread
+    pool. Results are yielded in the order of items. If max_bytes_in_flight is given,
+    an item isn't started while the bytes of those started but not yet yielded, and
+    its own, add up to more than it (unless nothing else is in flight). Each is
+    counted by get_item_bytes (e.g. its file's listed size) until it's done, then by
+    get_bytes of its result.
+    """
+    if max_workers <= 1:
+        yield from map(func, items)
+        return
+
+    # the futures of the items started but not yet yielded, with their item bytes
+    pending = deque()
+
+    def in_flight_bytes(future: Future, item_bytes: int) -> int:
+        if get_bytes is not None and future.done():
+            return get_bytes(future.result())
+        return item_bytes
+
+    def has_room(item_bytes: int) -> bool:
+        if len(pending) >= max_workers:
+            return False
+        if max_bytes_in_flight is None or not pending:
+            return True
+        in_flight = sum(in_flight_bytes(*p) for p in pending)
+        return in_flight + item_bytes <= max_bytes_in_flight
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for item in items:
+            item_bytes = get_item_bytes(item) if get_item_bytes is not None else 0
+            while pending and not has_room(item_bytes):
+                yield pending.popleft()[0].result()
+            pending.append((submit_in_context(executor, func, item), item_bytes))
+        while pending:
+            yield pending.popleft()[0].result()
@@ -0,0 +1,124 @@
+import contextvars
+import threading
+import time
+
+from collections import Counter, defaultdict
+from concurrent.futures import Executor, Future
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, List, NamedTuple
+
+
+class PackSpan(NamedTuple):
+    # the phase: pack, listing, read, cast, concat, sort, size_probe, write,
+    # manifest or commit
+    name: str
+    # when it started, as a unix timestamp
+    start: float
+    # how long it took, including any spans inside it
+    seconds: float
+    # e.g. the path being read
+    attributes: dict
+
+
+class PackResult(NamedTuple):
+    table_name: str
+    rows_written: int
+    bytes_written: int
+    # files written that weren't in the output table before, and those that were
+    files_created: List[str]
+    files_overwritten: List[str]
+    duration_seconds: float
+    # seconds spent in each phase, not counting phases inside it (so pack is the
+    # time spent in none of the others). Phases run on many threads at once add up
+    # to more than the time they took
+    phase_seconds: Dict[str, float]
+    phase_calls: Dict[str, int]
+    # s3 requests made with the package's s3 client, by operation
+    s3_requests: Dict[str, int]
+
+
+class PackRecorder:
+    """
+    Records the spans of a pack: the seconds spent in, and number of, each phase,
+    and the s3 requests made. on_span, if given, is called with each PackSpan as it
+    ends, on the thread it ran on.
+    """
+
+    def __init__(self, on_span: Callable[[PackSpan], None] = None):
+        self.on_span = on_span
+        self.phase_seconds: Dict[str, float] = defaultdict(float)
+        self.phase_calls: Dict[str, int] = Counter()
+        self.s3_requests: Dict[str, int] = Counter()
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        stack = self._local.stack
+        # [start, seconds spent in the spans inside it]
+        stack.append([time.perf_counter(), 0.0])
+        start_time = time.time()
+        try:
+            yield
+        finally:
+            start, inner = stack.pop()
+            seconds = time.perf_counter() - start
+            if stack:
+                stack[-1][1] += seconds
+            with self._lock:
+                self.phase_seconds[name] += seconds - inner
+                self.phase_calls[name] += 1
+            if self.on_span is not None:
+                self.on_span(PackSpan(name, start_time, seconds, attributes))
+
+    def count_request(self, operation: str):
+        with self._lock:
+            self.s3_requests[operation] += 1
+
+
+_recorder: contextvars.ContextVar = contextvars.ContextVar("recorder", default=None)
+
+
+@contextmanager
+def recording(recorder: PackRecorder):
+    """spans and requests, on this thread or any submitted in context, go to recorder"""
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        _recorder.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    recorder = _recorder.get()
+    if recorder is None:
+        yield
+        return
+    with recorder.span(name, **attributes):
+        yield
+
+
+def span_iter(name: str, iterable: Iterable, **attributes) -> Iterator:
+    """yields from iterable, with each item's production a span"""
+    iterator = iter(iterable)
+    while True:
+        with span(name, **attributes):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
+
+
+def count_request(operation: str):
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.count_request(operation)
+
+
+def submit_in_context(executor: Executor, func: Callable, *args) -> Future:
+    # so the recorder follows work onto the executor's threads
+    return executor.submit(contextvars.copy_context().run, func, *args)
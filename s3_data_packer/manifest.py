@@ -0,0 +1,100 @@
+import json
+import os
+
+from dataengineeringutils3 import s3
+from s3_data_packer.helpers import FileEntry, _add_file_to_listing_cache
+from s3_data_packer.s3_client import get_s3_client
+from typing import Dict, List, Union
+
+
+class PackManifest:
+    """
+    A record, kept as json beside an output table, of the input files that have been
+    packed into it. Each input is stored under its path with the size and etag (or
+    for local files, the last modified time) it had when it was packed, and the
+    output files written by that pack. The table's output bytes per row, as last
+    measured, is kept with them.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.inputs: Dict[str, dict] = {}
+        self.bytes_per_row: Union[float, None] = None
+
+    @classmethod
+    def read(cls, path: str) -> "PackManifest":
+        """reads the manifest at path, or starts an empty one if there isn't one"""
+        manifest = cls(path)
+        body = _read_bytes(path)
+        if body is not None:
+            contents = json.loads(body)
+            manifest.inputs = contents["inputs"]
+            manifest.bytes_per_row = contents.get("bytes_per_row")
+        return manifest
+
+    def write(self, path: str = None):
+        """writes the manifest to its path, or to path if given (e.g. to stage it)"""
+        path = self.path if path is None else path
+        contents = {"bytes_per_row": self.bytes_per_row, "inputs": self.inputs}
+        body = json.dumps(contents, indent=2).encode("utf-8")
+        etag = _write_bytes(path, body)
+        _add_file_to_listing_cache(path, len(body), etag=etag)
+
+    def is_packed(self, entry: FileEntry) -> bool:
+        """whether the input has been packed, and hasn't changed since"""
+        packed = self.inputs.get(entry.path)
+        if packed is None:
+            return False
+        return all(packed[k] == v for k, v in _get_version(entry).items())
+
+    def add(self, entries: List[FileEntry], output_files: List[str]):
+        for entry in entries:
+            self.inputs[entry.path] = {
+                **_get_version(entry),
+                "output_files": list(output_files),
+            }
+
+    def replace_output_files(self, replaced_files: List[str], new_files: List[str]):
+        # after compaction, inputs that were in any of the replaced files are in the
+        # new files instead
+        for packed in self.inputs.values():
+            kept = [f for f in packed["output_files"] if f not in replaced_files]
+            if len(kept) < len(packed["output_files"]):
+                packed["output_files"] = kept + [f for f in new_files if f not in kept]
+
+
+def _get_version(entry: FileEntry) -> dict:
+    # what identifies this version of the file. s3 objects have an etag, local files
+    # only their modified time
+    last_modified = (
+        entry.last_modified.isoformat()
+        if entry.etag is None and entry.last_modified is not None
+        else None
+    )
+    return {"size": entry.size, "etag": entry.etag, "last_modified": last_modified}
+
+
+def _read_bytes(path: str) -> Union[bytes, None]:
+    if not path.startswith("s3://"):
+        if not os.path.isfile(path):
+            return None
+        with open(path, "rb") as f:
+            return f.read()
+    bucket, key = s3.s3_path_to_bucket_key(path)
+    client = get_s3_client()
+    try:
+        return client.get_object(Bucket=bucket, Key=key)["Body"].read()
+    except client.exceptions.NoSuchKey:
+        return None
+
+
+def _write_bytes(path: str, body: bytes) -> Union[str, None]:
+    if not path.startswith("s3://"):
+        dirs = os.path.dirname(path)
+        if dirs:
+            os.makedirs(dirs, exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(body)
+        return None
+    bucket, key = s3.s3_path_to_bucket_key(path)
+    return get_s3_client().put_object(Bucket=bucket, Key=key, Body=body)["ETag"]
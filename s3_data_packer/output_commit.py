@@ -0,0 +1,85 @@
+import json
+import os
+
+from s3_data_packer.helpers import _delete_file, _list_files_in_path, _move_file
+from s3_data_packer.instrumentation import span
+from s3_data_packer.manifest import _read_bytes, _write_bytes
+from typing import Dict, List, Union
+
+
+class OutputCommit:
+    """
+    A record, kept as json beside an output table, of files written to a staging
+    folder that are to be moved into the table, and of the table's files they
+    replace. Once everything has been staged it's written as complete, then applied:
+    each staged file is moved to its place in the table, the replaced files deleted,
+    and the record itself deleted. Every step can be done again, so if applying is
+    interrupted it's finished by applying the record again.
+
+    While a pack is staging its files, the record is written as each one is
+    finished, with the pack's inputs (as [path, size]) and the rows and bytes in the
+    staged files so far, so a rerun of the same inputs can carry on from them.
+    source_rows, the rows read so far from each source of the pack, are a checkpoint
+    of where in its inputs the staged rows end.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        staged_files: Dict[str, str] = None,
+        replaced_files: List[str] = None,
+        complete: bool = True,
+        inputs: List[list] = None,
+        rows_staged: int = 0,
+        bytes_staged: int = 0,
+        source_rows: List[int] = None,
+    ):
+        self.path = path
+        # staged path to the path in the table it's moved to
+        self.staged_files = {} if staged_files is None else staged_files
+        self.replaced_files = [] if replaced_files is None else replaced_files
+        self.complete = complete
+        self.inputs = inputs
+        self.rows_staged = rows_staged
+        self.bytes_staged = bytes_staged
+        self.source_rows = [] if source_rows is None else source_rows
+
+    @classmethod
+    def read(cls, path: str) -> Union["OutputCommit", None]:
+        """reads the commit at path, None if there isn't one"""
+        body = _read_bytes(path)
+        if body is None:
+            return None
+        return cls(path, **json.loads(body))
+
+    def write(self):
+        contents = {
+            "staged_files": self.staged_files,
+            "replaced_files": self.replaced_files,
+            "complete": self.complete,
+            "inputs": self.inputs,
+            "rows_staged": self.rows_staged,
+            "bytes_staged": self.bytes_staged,
+            "source_rows": self.source_rows,
+        }
+        _write_bytes(self.path, json.dumps(contents, indent=2).encode("utf-8"))
+
+    def apply(self):
+        if not self.complete:
+            raise ValueError("an incomplete commit can't be applied")
+        with span("commit", path=self.path):
+            self._apply()
+
+    def _apply(self):
+        # anything not still staged was moved by an earlier, interrupted, apply
+        staging_dirs = {os.path.dirname(f) for f in self.staged_files}
+        still_staged = {
+            f for d in staging_dirs for f in _list_files_in_path(d, refresh=True)
+        }
+        for staged_file, table_file in self.staged_files.items():
+            if staged_file in still_staged:
+                _move_file(staged_file, table_file)
+        for replaced_file in self.replaced_files:
+            if replaced_file not in self.staged_files.values():
+                _delete_file(replaced_file)
+        _delete_file(self.path)
@@ -0,0 +1,118 @@
+from arrow_pd_parser import reader
+from arrow_pd_parser.utils import FileFormat
+from concurrent.futures import Executor
+from dataengineeringutils3 import s3
+from io import BytesIO
+from pandas import DataFrame, concat
+from s3_data_packer.cast_plan import CastPlan
+from s3_data_packer.s3_client import get_s3_client
+from typing import List, Tuple, Union
+
+# files are split into parts of at least this many bytes, so each is worth sending
+# to a process of its own
+_min_split_bytes = 16 * 2**20
+# how much is read at a time looking for the end of a line
+_line_probe_bytes = 64 * 2**10
+
+
+def get_num_splits(size: int, max_splits: int) -> int:
+    """the parts a file of size bytes is parsed in, 1 if it isn't worth splitting"""
+    return max(1, min(max_splits, size // _min_split_bytes))
+
+
+def parse_in_splits(
+    f: str,
+    size: int,
+    file_format: FileFormat,
+    executor: Executor,
+    num_splits: int,
+    cast_plan: CastPlan,
+    columns: List[str] = None,
+) -> DataFrame:
+    """
+    Parses the csv or jsonl file f (local or on s3), of size bytes, in num_splits
+    parts on executor's workers, returning them cast by cast_plan as one DataFrame in
+    the file's order. The parts are split at line ends, so csv fields can't have line
+    breaks in them. Each part is read by the worker parsing it (with a ranged GET on
+    s3), csv parts after the first are given the header line, and each is cast there
+    too, so they all have the same dtypes whatever their rows.
+    """
+    ranges = get_split_ranges(f, size, num_splits)
+    header = b""
+    if file_format == FileFormat.CSV and len(ranges) > 1:
+        header = _read_range(f, 0, _get_line_end(f, size, 1))
+    futures = [
+        executor.submit(
+            _parse_split,
+            f,
+            start,
+            end,
+            header if i else b"",
+            file_format,
+            cast_plan,
+            columns,
+        )
+        for i, (start, end) in enumerate(ranges)
+    ]
+    return concat([future.result() for future in futures], ignore_index=True)
+
+
+def get_split_ranges(f: str, size: int, num_splits: int) -> List[Tuple[int, int]]:
+    """the (start, end) byte ranges of about size / num_splits each, ending at lines"""
+    ranges = []
+    start = 0
+    for i in range(1, num_splits):
+        if start >= size:
+            break
+        end = _get_line_end(f, size, max(size * i // num_splits, start + 1))
+        if end > start:
+            ranges.append((start, end))
+            start = end
+    if start < size:
+        ranges.append((start, size))
+    return ranges
+
+
+def _get_line_end(f: str, size: int, position: int) -> int:
+    # the position just after the first line end at or after position - 1, so a
+    # position already at the start of a line is kept
+    start = position - 1
+    probe_bytes = _line_probe_bytes
+    while start < size:
+        data = _read_range(f, start, min(start + probe_bytes, size))
+        if b"\n" in data:
+            return start + data.index(b"\n") + 1
+        start += len(data)
+        # long lines are looked through in larger reads
+        probe_bytes *= 2
+    return size
+
+
+def _read_range(f: str, start: int, end: int) -> bytes:
+    if f.startswith("s3://"):
+        bucket, key = s3.s3_path_to_bucket_key(f)
+        response = get_s3_client().get_object(
+            Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}"
+        )
+        return response["Body"].read()
+    with open(f, "rb") as fp:
+        fp.seek(start)
+        return fp.read(end - start)
+
+
+def _parse_split(
+    f: str,
+    start: int,
+    end: int,
+    header: bytes,
+    file_format: FileFormat,
+    cast_plan: CastPlan,
+    columns: Union[List[str], None],
+) -> DataFrame:
+    # run on the executor's workers, so only the part's cast rows go back
+    data = BytesIO(header + _read_range(f, start, end))
+    if file_format == FileFormat.CSV:
+        df = reader.csv.read(data, **({} if columns is None else {"usecols": columns}))
+    else:
+        df = reader.json.read(data)
+    return cast_plan.cast_df(df)
@@ -0,0 +1,559 @@
+import io
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from arrow_pd_parser import writer
+from arrow_pd_parser.pa_pd import arrow_to_pandas
+from arrow_pd_parser.utils import FileFormat, validate_and_enrich_metadata
+from mojap_metadata.converters.arrow_converter import ArrowConverter
+from mojap_metadata.metadata.metadata import Metadata
+from pandas import DataFrame
+from s3_data_packer.constants import (
+    default_initial_batch_rows,
+    default_max_buffer_bytes,
+    default_size_tolerance,
+    default_upload_part_size_bytes,
+)
+from s3_data_packer.helpers import _add_file_to_listing_cache, _open_output_stream
+from s3_data_packer.instrumentation import span
+from s3_data_packer.s3_output_store import S3OutputStore
+from typing import Callable, List, NamedTuple, Optional, Tuple, Union
+
+# the bytes per row of new data is first estimated by serialising this many slices,
+# spread through it, of up to this many rows each
+_num_samples = 3
+_sample_rows = 100
+# a parquet batch is sized from samples of its own if its rows are this many times
+# wider in arrow than those written before
+_skew_factor = 2
+# the most rows in each parquet row group if neither row group option is set,
+# pyarrow's own default for a table written in one go
+_default_row_group_rows = 1024 * 1024
+
+
+class ParquetWriteOptions(NamedTuple):
+    """
+    How parquet output files are written. Rows are held back until there are enough
+    for a row group of row_group_rows, or of about row_group_bytes once written (by
+    the estimated bytes per row), otherwise of up to pyarrow's default 1,048,576
+    rows, however the rows are split across writes. Whichever it is, a row group is
+    written once the rows held take up the writer's max_buffer_bytes in memory. If
+    sort_row_groups_by is given,
+    each row group is sorted by those columns before it's written, so its min/max
+    statistics are narrower. The rest are passed to pyarrow's ParquetWriter, with
+    compression defaulting to arrow_pd_parser's.
+    """
+
+    row_group_rows: int = None
+    row_group_bytes: int = None
+    compression: str = None
+    compression_level: int = None
+    use_dictionary: Union[bool, List[str]] = True
+    data_page_size: int = None
+    write_statistics: Union[bool, List[str]] = True
+    sort_row_groups_by: List[str] = None
+
+
+class RollingFileWriter:
+    """
+    Writes DataFrames or arrow Tables to the files of an S3OutputStore, serialising
+    each row once.
+    The bytes written to the current file are tracked and once it is within
+    size_tolerance of the store's file_limit_gigabytes the file is closed and the
+    next filenum is started.
+
+    How many rows fit in a file is worked out from a bytes per row estimate. It
+    starts from bytes_per_row if given (e.g. from an earlier run), otherwise from
+    serialising a few slices of the first data written, and is corrected from the
+    bytes actually written as writing goes on. Each batch's own size is checked
+    against the space left before it's written (exactly for csv and jsonl, from its
+    arrow size for parquet), and fewer rows taken if they're wider than the estimate,
+    so rows of very different widths still fill files to within size_tolerance.
+    Parquet rows held back for a row group are only estimated, so they're written,
+    and measured, once they're estimated to fill half the space left, and before a
+    file is taken to be full. The footer a file's closed with is counted too, from
+    that of a file of no rows and what each row group adds to it.
+
+    If upload_max_workers is set, files written to s3 are uploaded as they are
+    written, in parts of upload_part_size_bytes on that many threads, so that the
+    next slice is serialised while the last is uploading.
+
+    If append is True, the first file written to is the store's current file, which
+    must already exist, and rows are added to the end of it rather than it being
+    replaced. Only csv and jsonl files can be appended to.
+
+    parquet_options sets how parquet files are written, see ParquetWriteOptions.
+    Parquet rows held back for a row group take up at most about max_buffer_bytes in
+    memory (as arrow), before a row group is written.
+
+    If cluster_by columns are given, for data written in order of them, a file isn't
+    closed until the rows with the same values of them as its last row are all in
+    it, so no value is split between files. Files can go over the limit by that
+    many rows.
+
+    on_close, if given, is called with the path, rows and bytes of each file as it's
+    closed.
+    """
+
+    def __init__(
+        self,
+        output_store: S3OutputStore,
+        metadata: Union[Metadata, None] = None,
+        initial_batch_rows: int = default_initial_batch_rows,
+        upload_max_workers: int = None,
+        upload_part_size_bytes: int = default_upload_part_size_bytes,
+        append: bool = False,
+        bytes_per_row: float = None,
+        size_tolerance: float = default_size_tolerance,
+        parquet_options: ParquetWriteOptions = None,
+        cluster_by: List[str] = None,
+        on_close: Callable[[str, int, int], None] = None,
+        max_buffer_bytes: int = default_max_buffer_bytes,
+    ):
+        self.output_store = output_store
+        self.metadata = metadata
+        self.initial_batch_rows = initial_batch_rows
+        self.upload_max_workers = upload_max_workers
+        self.upload_part_size_bytes = upload_part_size_bytes
+        self.file_format = FileFormat.from_string(output_store.table_extension)
+        if append and self.file_format == FileFormat.PARQUET:
+            raise ValueError("parquet files can't be appended to")
+        self.append = append
+        self.size_tolerance = size_tolerance
+        self.parquet_options = (
+            ParquetWriteOptions() if parquet_options is None else parquet_options
+        )
+
+        self.cluster_by = cluster_by
+        self.on_close = on_close
+        self.max_buffer_bytes = max_buffer_bytes
+
+        self.files_written: List[str] = []
+        self.bytes_written = 0
+        self.rows_written = 0
+
+        self._stream = None
+        self._parquet_writer = None
+        self._arrow_schema = None
+        self._file_bytes = 0
+        self._file_rows = 0
+        self._file_is_new = True
+        self._estimated_bytes_per_row = bytes_per_row
+        # parquet rows waiting for a full row group, and the bytes they're estimated
+        # to take up once written
+        self._row_group_buffer: List[pa.Table] = []
+        self._buffered_rows = 0
+        self._buffered_bytes = 0.0
+        self._buffered_arrow_bytes = 0
+        # the bytes a parquet file's footer adds when it's closed: those of a file of
+        # no rows, and those each row group adds, from serialising the first rows
+        self._empty_footer_bytes = 0
+        self._row_group_footer_bytes = None
+        self._file_row_groups = 0
+        # the arrow bytes of the parquet rows written, to tell when a batch's rows are
+        # wider than those before
+        self._arrow_bytes_written = 0
+        # the cluster_by values of the last row written, and of a full file's last row
+        # while rows with the same values are still being added to it
+        self._last_key: Union[tuple, None] = None
+        self._closing_key: Union[tuple, None] = None
+
+    @property
+    def file_limit_bytes(self) -> float:
+        return self.output_store.file_limit_gigabytes * 10**9
+
+    @property
+    def bytes_per_row(self) -> Union[float, None]:
+        # measured from what's been written once there is some
+        rows_in_files = self.rows_written - self._buffered_rows
+        if rows_in_files and self.bytes_written:
+            return self.bytes_written / rows_in_files
+        return self._estimated_bytes_per_row
+
+    def write(self, data: Union[DataFrame, pa.Table]):
+        if self.file_format == FileFormat.PARQUET:
+            data = self._prepare_parquet(data)
+        nrows = data.shape[0]
+        if self.bytes_per_row is None and nrows:
+            with span("size_probe"):
+                self._estimated_bytes_per_row = self._sample_bytes_per_row(data)
+        start = 0
+        while start < nrows:
+            if self._closing_key is not None:
+                key_rows = self._get_key_rows(data, start)
+                if key_rows:
+                    self._write_batch(_slice(data, start, key_rows))
+                    start += key_rows
+                if start < nrows:
+                    self.close()
+                continue
+            batch = self._fit_batch(data, start, self._get_batch_rows(nrows - start))
+            if batch is None:
+                self._end_file()
+                continue
+            self._write_batch(*batch)
+            start += batch[0].shape[0]
+            if self._file_is_full():
+                self._end_file()
+
+    def _prepare_parquet(self, data: Union[DataFrame, pa.Table]) -> pa.Table:
+        if self._arrow_schema is None:
+            self._arrow_schema = self._get_arrow_schema(data)
+        # converted once, so each batch's size can be estimated from its arrow size
+        data = self._to_arrow(data)
+        if self._row_group_footer_bytes is None:
+            with span("size_probe"):
+                self._row_group_footer_bytes = self._get_row_group_footer_bytes(data)
+        return data
+
+    def close(self):
+        if self._stream is None:
+            return
+        with span("write", path=self.files_written[-1]):
+            self._close_stream()
+        _add_file_to_listing_cache(
+            self.files_written[-1],
+            self._file_bytes,
+            etag=getattr(self._stream, "etag", None),
+        )
+        closed = (self.files_written[-1], self._file_rows, self._file_bytes)
+        self._stream = None
+        self._file_bytes = 0
+        self._file_rows = 0
+        self._closing_key = None
+        self.output_store.filenum += 1
+        if self.on_close is not None:
+            self.on_close(*closed)
+
+    def _close_stream(self):
+        if self._parquet_writer is not None:
+            self._write_row_groups(final=True)
+            self._parquet_writer.close()
+            self._parquet_writer = None
+            self._file_row_groups = 0
+        self._update_bytes_written()
+        self._stream.close()
+
+    def _end_file(self):
+        # a full file is closed, unless rows with the same cluster_by values as its
+        # last row might still be to come
+        if self.cluster_by and self._last_key is not None:
+            self._closing_key = self._last_key
+        else:
+            self.close()
+
+    def _get_key_columns(self, data: Union[DataFrame, pa.Table]) -> List[pa.Array]:
+        if isinstance(data, pa.Table):
+            return [data[c].combine_chunks() for c in self.cluster_by]
+        return [pa.Array.from_pandas(data[c]) for c in self.cluster_by]
+
+    def _get_key_rows(self, data: Union[DataFrame, pa.Table], start: int) -> int:
+        # how many rows from start have the same cluster_by values as the full file's
+        # last row
+        rows = _slice(data, start, data.shape[0] - start)
+        same = np.ones(rows.shape[0], dtype=bool)
+        for column, value in zip(self._get_key_columns(rows), self._closing_key):
+            if value is None:
+                is_value = pc.is_null(column)
+            else:
+                is_value = pc.fill_null(
+                    pc.equal(column, pa.scalar(value, column.type)), False
+                )
+            same &= is_value.to_numpy(zero_copy_only=False)
+        return len(same) if same.all() else int(np.argmin(same))
+
+    def _get_file_bytes(self) -> float:
+        # the current file's size, counting the rows held back for its next row group
+        # and a parquet footer
+        return self._file_bytes + self._buffered_bytes + self._get_footer_bytes()
+
+    def _get_footer_bytes(self) -> float:
+        if self.file_format != FileFormat.PARQUET:
+            return 0
+        row_groups = self._file_row_groups + (1 if self._buffered_rows else 0)
+        row_group_bytes = self._row_group_footer_bytes or 0
+        return self._empty_footer_bytes + row_groups * row_group_bytes
+
+    def _get_row_group_footer_bytes(self, data: pa.Table) -> Optional[int]:
+        # what a row group adds to a file, from its first rows written as two row
+        # groups rather than one
+        if data.num_rows < 2:
+            return None
+        rows = data.slice(0, 2)
+        one = len(self._serialise(rows))
+        return max(len(self._serialise(rows, row_group_size=1)) - one, 0)
+
+    def _file_is_full(self) -> bool:
+        limit = self.file_limit_bytes * (1 - self.size_tolerance)
+        if self._get_file_bytes() >= limit and self._buffered_rows:
+            # measured, rather than estimated, before the file is given up on
+            self._flush_row_groups()
+        return self._get_file_bytes() >= limit
+
+    def _get_batch_rows(self, remaining_rows: int) -> int:
+        # how many of the remaining rows fit in the current file?
+        if not self.bytes_per_row:
+            return min(remaining_rows, self.initial_batch_rows)
+        space = self.file_limit_bytes - self._get_file_bytes()
+        fitting_rows = int(np.floor(space / self.bytes_per_row))
+        # always get at least one row into an empty file
+        if not self._file_rows:
+            fitting_rows = max(fitting_rows, 1)
+        # check an estimate that hasn't been measured yet on a small batch first
+        if not self.rows_written:
+            fitting_rows = min(fitting_rows, self.initial_batch_rows)
+        return min(remaining_rows, fitting_rows)
+
+    def _fit_batch(
+        self, data: Union[DataFrame, pa.Table], start: int, rows: int
+    ) -> Union[Tuple[Union[DataFrame, pa.Table], Union[bytes, None], float], None]:
+        # the batch of up to rows from start that fits in the space left, with its
+        # serialised text (for csv and jsonl) and its size. Its rows may be wider than
+        # those the estimate was made from, so if it doesn't fit, it's cut down in
+        # proportion. None if not even a row fits in a file that has rows already
+        if rows and self._stream is None:
+            self._open()
+        while rows:
+            batch = _slice(data, start, rows)
+            payload = None
+            if self.file_format == FileFormat.PARQUET:
+                batch_bytes = self._estimate_parquet_bytes(batch)
+            else:
+                payload = self._to_text_bytes(batch, header=self._needs_header())
+                batch_bytes = len(payload)
+            space = self.file_limit_bytes - self._get_file_bytes()
+            if batch_bytes <= space or (rows == 1 and not self._file_rows):
+                return batch, payload, batch_bytes
+            if self._buffered_rows:
+                # the rows held back are only estimated, so measure them and look
+                # again
+                self._flush_row_groups()
+                continue
+            rows = int(rows * max(space, 0) / batch_bytes)
+            if not rows and not self._file_rows:
+                rows = 1
+        return None
+
+    def _estimate_parquet_bytes(self, batch: pa.Table) -> float:
+        # from the bytes per row, unless the batch's rows are much wider in arrow than
+        # those written before. Then they may compress quite differently too, so its
+        # arrow bytes are scaled by how a few slices of it serialise
+        estimate = batch.num_rows * (self.bytes_per_row or 0)
+        if not self._arrow_bytes_written:
+            return estimate
+        arrow_bytes_per_row = self._arrow_bytes_written / self.rows_written
+        if batch.nbytes <= _skew_factor * arrow_bytes_per_row * batch.num_rows:
+            return estimate
+        sampled = batch.nbytes * self._sample_bytes_per_row(batch, per_arrow_byte=True)
+        return max(estimate, sampled)
+
+    def _needs_header(self) -> bool:
+        return self._file_is_new and not self._file_rows
+
+    def _sample_bytes_per_row(
+        self, data: Union[DataFrame, pa.Table], per_arrow_byte: bool = False
+    ) -> float:
+        # serialise a few slices spread through the data, rather than all of it. The
+        # bytes are per row, or per byte of an arrow table's slices if per_arrow_byte
+        nrows = data.shape[0]
+        sample_rows = min(_sample_rows, max(nrows // _num_samples, 1))
+        starts = np.unique(np.linspace(0, nrows - sample_rows, _num_samples, dtype=int))
+        samples = [_slice(data, start, sample_rows) for start in starts]
+        # what every file has regardless of its rows, e.g. a parquet footer
+        empty_bytes = len(self._serialise(_slice(data, 0, 0)))
+        sample_bytes = sum(len(self._serialise(s)) - empty_bytes for s in samples)
+        if per_arrow_byte:
+            return max(sample_bytes, 0) / max(sum(s.nbytes for s in samples), 1)
+        return sample_bytes / (len(starts) * sample_rows)
+
+    def _serialise(
+        self, data: Union[DataFrame, pa.Table], row_group_size: int = None
+    ) -> bytes:
+        # the bytes the data would take up, written on its own
+        if self.file_format != FileFormat.PARQUET:
+            return self._to_text_bytes(data, header=False)
+        buf = pa.BufferOutputStream()
+        pq.write_table(
+            self._to_arrow(data),
+            buf,
+            row_group_size=row_group_size,
+            **self._get_parquet_kwargs(),
+        )
+        return buf.getvalue().to_pybytes()
+
+    def _get_parquet_kwargs(self) -> dict:
+        options = self.parquet_options
+        kwargs = {
+            "compression": options.compression or writer.parquet.compression,
+            "compression_level": options.compression_level,
+            "use_dictionary": options.use_dictionary,
+            "write_statistics": options.write_statistics,
+            "version": writer.parquet.version,
+        }
+        if options.data_page_size is not None:
+            kwargs["data_page_size"] = options.data_page_size
+        return kwargs
+
+    def _get_row_group_rows(self) -> int:
+        options = self.parquet_options
+        if options.row_group_rows is not None:
+            row_group_rows = options.row_group_rows
+        elif options.row_group_bytes is not None and self.bytes_per_row:
+            row_group_rows = max(int(options.row_group_bytes / self.bytes_per_row), 1)
+        else:
+            row_group_rows = _default_row_group_rows
+        # and no more than fit in the buffer's bytes
+        arrow_bytes_per_row = self._buffered_arrow_bytes / self._buffered_rows
+        buffer_rows = int(self.max_buffer_bytes / max(arrow_bytes_per_row, 1))
+        return max(min(row_group_rows, buffer_rows), 1)
+
+    def _write_row_groups(self, final: bool = False):
+        # write out as many full row groups as are held, or all of them if final
+        if not self._buffered_rows:
+            return
+        row_group_rows = self._get_row_group_rows()
+        if final:
+            rows_to_write = self._buffered_rows
+        else:
+            rows_to_write = self._buffered_rows // row_group_rows * row_group_rows
+        if not rows_to_write:
+            return
+        table = pa.concat_tables(self._row_group_buffer)
+        for start in range(0, rows_to_write, row_group_rows):
+            row_group = table.slice(start, min(row_group_rows, rows_to_write - start))
+            self._parquet_writer.write_table(
+                self._sort_row_group(row_group), row_group_size=row_group.num_rows
+            )
+            self._file_row_groups += 1
+        remaining = table.slice(rows_to_write)
+        self._row_group_buffer = [remaining] if remaining.num_rows else []
+        self._buffered_bytes *= remaining.num_rows / self._buffered_rows
+        self._buffered_rows -= rows_to_write
+        self._buffered_arrow_bytes = remaining.nbytes
+
+    def _flush_row_groups(self):
+        # write out every row held back, so the file's size is known
+        self._write_row_groups(final=True)
+        self._update_bytes_written()
+
+    def _sort_row_group(self, row_group: pa.Table) -> pa.Table:
+        sort_by = self.parquet_options.sort_row_groups_by
+        if not sort_by:
+            return row_group
+        return row_group.sort_by([(c, "ascending") for c in sort_by])
+
+    def _open(self):
+        out_path = self.output_store._get_filename(full_path=True)
+        # only the file the writer starts on is appended to
+        append = self.append and not self.files_written
+        self._stream = _open_output_stream(
+            out_path,
+            self.upload_max_workers,
+            self.upload_part_size_bytes,
+            append=append,
+        )
+        self._file_bytes = self._stream.tell()
+        self._file_is_new = not append
+        self.files_written.append(out_path)
+        if self.file_format == FileFormat.PARQUET:
+            self._parquet_writer = pq.ParquetWriter(
+                self._stream, schema=self._arrow_schema, **self._get_parquet_kwargs()
+            )
+            if not self._empty_footer_bytes:
+                empty_table = self._arrow_schema.empty_table()
+                self._empty_footer_bytes = len(self._serialise(empty_table))
+
+    def _get_arrow_schema(self, data: Union[DataFrame, pa.Table]) -> pa.Schema:
+        if isinstance(data, pa.Table):
+            schema = data.schema
+        else:
+            schema = pa.Schema.from_pandas(data, preserve_index=False)
+        if self.metadata is None:
+            return schema
+        meta = validate_and_enrich_metadata(self.metadata)
+        meta_schema = ArrowConverter().generate_from_meta(meta)
+        # with the data's pandas dtypes, so they're read back as they were written
+        pandas_metadata = (schema.metadata or {}).get(b"pandas")
+        if pandas_metadata is None:
+            return meta_schema
+        return meta_schema.with_metadata({b"pandas": pandas_metadata})
+
+    def _write_batch(
+        self,
+        data: Union[DataFrame, pa.Table],
+        payload: bytes = None,
+        batch_bytes: float = None,
+    ):
+        with span("write"):
+            self._write_rows(data, payload, batch_bytes)
+
+    def _write_rows(
+        self,
+        data: Union[DataFrame, pa.Table],
+        payload: bytes = None,
+        batch_bytes: float = None,
+    ):
+        if self._stream is None:
+            self._open()
+        if self.file_format == FileFormat.PARQUET:
+            table = self._to_arrow(data)
+            if batch_bytes is None:
+                batch_bytes = self._estimate_parquet_bytes(table)
+            self._row_group_buffer.append(table)
+            self._buffered_rows += data.shape[0]
+            self._buffered_bytes += batch_bytes
+            self._buffered_arrow_bytes += table.nbytes
+            self._arrow_bytes_written += table.nbytes
+        else:
+            if payload is None:
+                payload = self._to_text_bytes(data, header=self._needs_header())
+            self._stream.write(payload)
+        self._file_rows += data.shape[0]
+        if self.cluster_by and data.shape[0]:
+            self._last_key = tuple(
+                c[len(c) - 1].as_py() for c in self._get_key_columns(data)
+            )
+        self.rows_written += data.shape[0]
+        if self.file_format == FileFormat.PARQUET:
+            # the rows held back are measured before they could fill the file
+            space = self.file_limit_bytes - self._file_bytes - self._get_footer_bytes()
+            self._write_row_groups(final=self._buffered_bytes >= space / 2)
+        self._update_bytes_written()
+
+    def _to_text_bytes(self, data: Union[DataFrame, pa.Table], header: bool) -> bytes:
+        text_writer = writer.csv if self.file_format == FileFormat.CSV else writer.json
+        df = arrow_to_pandas(data) if isinstance(data, pa.Table) else data
+        buf = io.StringIO()
+        text_writer._write(df, buf, self.metadata, first_chunk=header)
+        return buf.getvalue().encode("utf-8")
+
+    def _to_arrow(self, data: Union[DataFrame, pa.Table]) -> pa.Table:
+        if not isinstance(data, pa.Table):
+            return pa.Table.from_pandas(
+                data, schema=self._arrow_schema, preserve_index=False
+            )
+        if not data.schema.equals(self._arrow_schema):
+            data = data.select(self._arrow_schema.names).cast(self._arrow_schema)
+        return data
+
+    def _update_bytes_written(self):
+        file_bytes = self._stream.tell()
+        self.bytes_written += file_bytes - self._file_bytes
+        self._file_bytes = file_bytes
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def _slice(
+    data: Union[DataFrame, pa.Table], start: int, length: int
+) -> Union[DataFrame, pa.Table]:
+    if isinstance(data, pa.Table):
+        return data.slice(start, length)
+    return data.iloc[start : start + length]
@@ -0,0 +1,96 @@
+import threading
+
+import boto3
+
+from botocore.config import Config
+from pyarrow import fs
+from s3_data_packer.constants import (
+    aws_region,
+    default_max_attempts,
+    default_max_pool_connections,
+    default_retry_mode,
+)
+from s3_data_packer.instrumentation import count_request
+from typing import Callable
+
+_client_lock = threading.Lock()
+_client = None
+_arrow_filesystem = None
+_client_factory = None
+_client_config = {
+    "max_pool_connections": default_max_pool_connections,
+    "retry_mode": default_retry_mode,
+    "max_attempts": default_max_attempts,
+}
+
+
+def configure_s3_client(
+    max_pool_connections: int = default_max_pool_connections,
+    retry_mode: str = default_retry_mode,
+    max_attempts: int = default_max_attempts,
+    client_factory: Callable = None,
+):
+    """
+    Sets up the s3 client shared by every s3 call the package makes. The current
+    client is dropped, and the next call makes a new one. If client_factory is given
+    it is called, with no arguments, to make the boto3 s3 client instead of the
+    default one built from the other arguments.
+    """
+    global _client, _arrow_filesystem, _client_factory
+    with _client_lock:
+        _client_config.update(
+            max_pool_connections=max_pool_connections,
+            retry_mode=retry_mode,
+            max_attempts=max_attempts,
+        )
+        _client_factory = client_factory
+        _client = None
+        _arrow_filesystem = None
+
+
+def get_s3_client():
+    """returns the shared boto3 s3 client, making it on first use"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = _client_factory() if _client_factory else _make_s3_client()
+            _register_request_counter(_client)
+        return _client
+
+
+def get_arrow_s3_filesystem() -> fs.S3FileSystem:
+    """returns the shared pyarrow s3 filesystem, making it on first use"""
+    global _arrow_filesystem
+    with _client_lock:
+        if _arrow_filesystem is None:
+            _arrow_filesystem = fs.S3FileSystem(
+                region=aws_region,
+                retry_strategy=fs.AwsStandardS3RetryStrategy(
+                    max_attempts=_client_config["max_attempts"]
+                ),
+            )
+        return _arrow_filesystem
+
+
+def _register_request_counter(client):
+    # a client_factory's client needn't be a botocore one, e.g. a mock
+    events = getattr(getattr(client, "meta", None), "events", None)
+    if events is not None:
+        events.register("before-call.s3", _count_request)
+
+
+def _count_request(model, **kwargs):
+    count_request(model.name)
+
+
+def _make_s3_client():
+    config = Config(
+        region_name=aws_region,
+        max_pool_connections=_client_config["max_pool_connections"],
+        retries={
+            "mode": _client_config["retry_mode"],
+            "total_max_attempts": _client_config["max_attempts"],
+        },
+    )
+    # clients are thread safe but the default session isn't, so use a new one
+    return boto3.session.Session().client("s3", config=config)
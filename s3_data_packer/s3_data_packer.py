@@ -1,19 +1,75 @@
 # import arrow_pd_parser
 
+import multiprocessing
 import os
-import tempfile
+import re
+import threading
+import time
 
 import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 
-from arrow_pd_parser import reader, writer
-from arrow_pd_parser.caster import cast_pandas_table_to_schema
+from arrow_pd_parser import reader
+from arrow_pd_parser.pa_pd import arrow_to_pandas
+from arrow_pd_parser.utils import (
+    FileFormat,
+    human_to_bytes,
+    infer_file_format,
+)
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import contextmanager
+from itertools import chain
 from mojap_metadata.metadata.metadata import Metadata
-from pandas import DataFrame, concat
-from s3_data_packer.constants import default_file_limit_gigabytes
-from s3_data_packer.helpers import get_file_format
+from pandas import DataFrame, concat, isna
+from pyarrow import csv as pa_csv
+from pyarrow import json as pa_json
+from s3_data_packer.cast_plan import CastPlan
+from s3_data_packer.constants import (
+    csv_null_values,
+    default_file_limit_gigabytes,
+    default_max_buffer_bytes,
+    default_max_workers,
+    default_size_tolerance,
+    default_sort_run_bytes,
+    default_upload_part_size_bytes,
+)
+from s3_data_packer.external_sort import external_sort
+from s3_data_packer.helpers import (
+    FileEntry,
+    _copy_file,
+    _delete_file,
+    _forget_cached_listings,
+    _get_arrow_filesystem,
+    _get_file_size,
+    _list_files_in_path,
+    _map_in_order,
+    get_file_format,
+)
+from s3_data_packer.instrumentation import (
+    PackRecorder,
+    PackResult,
+    PackSpan,
+    recording,
+    span,
+    span_iter,
+)
+from s3_data_packer.manifest import PackManifest
+from s3_data_packer.output_commit import OutputCommit
+from s3_data_packer.parallel_parse import get_num_splits, parse_in_splits
+from s3_data_packer.rolling_writer import ParquetWriteOptions, RollingFileWriter
 from s3_data_packer.s3_output_store import S3OutputStore
 from s3_data_packer.s3_table_store import S3TableStore
-from typing import List, Tuple, Union, Iterable
+from typing import Callable, Dict, List, Tuple, Union, Iterable
+
+# the partition value rows with a null partition column are written under
+_hive_null_value = "__HIVE_DEFAULT_PARTITION__"
+# with max_memory_bytes, each chunk read is at most this fraction of it in memory, to
+# leave room for the copies made casting, converting and serialising it
+_memory_chunk_fraction = 8
+# and each sorted run held before it's spilled to disk is at most this fraction of it
+_memory_sort_fraction = 4
 
 
 class S3DataPacker:
@@ -31,13 +87,62 @@ class S3DataPacker:
         input_partition_name: str = None,
         file_limit_gigabytes: int = default_file_limit_gigabytes,
         read_chunksize: Union[int, str] = None,
+        engine: str = "pandas",
+        max_workers: int = default_max_workers,
+        max_bytes_in_flight: int = None,
+        upload_max_workers: int = None,
+        upload_part_size_bytes: int = default_upload_part_size_bytes,
+        append_strategy: str = None,
+        use_manifest: bool = False,
+        size_tolerance: float = default_size_tolerance,
+        partition_by: str = None,
+        max_memory_bytes: int = None,
+        parquet_options: ParquetWriteOptions = None,
+        sort_by: List[str] = None,
+        cluster_by: List[str] = None,
+        sort_spill_dir: str = None,
+        use_staging: bool = False,
+        on_span: Callable[[PackSpan], None] = None,
+        columns: List[str] = None,
+        filter: pc.Expression = None,
+        parse_workers: int = None,
+        refresh_listing: bool = True,
     ):
+        if engine not in ["pandas", "arrow"]:
+            raise ValueError(f"engine must be 'pandas' or 'arrow', got: '{engine}'")
+        self.engine = engine
+        if append_strategy not in [None, "append", "rewrite"]:
+            raise ValueError(
+                "append_strategy must be None, 'append' or 'rewrite', "
+                f"got: '{append_strategy}'"
+            )
+        self.append_strategy = append_strategy
+        if partition_by is not None and output_partition is not None:
+            raise ValueError("only one of partition_by and output_partition can be set")
+        self.partition_by = partition_by
+        if sort_by and cluster_by:
+            raise ValueError("only one of sort_by and cluster_by can be set")
+        self.sort_by = sort_by
+        self.cluster_by = cluster_by
+        self.sort_spill_dir = sort_spill_dir
+        _check_columns(columns, [partition_by] + (sort_by or []) + (cluster_by or []))
+        # what's read from the inputs
+        self.columns = columns
+        self.filter = filter
+        # whether the data being packed is added to the end of the latest file
+        self._append_to_latest = False
 
         # set the blank table_name property. Has to be the _ one as it depends on itself
         self._table_name = None
 
         self.cast_parquet = cast_parquet
 
+        if refresh_listing:
+            # listings cached by an earlier packer in the process would be missing
+            # anything that's landed since, so the tables are listed afresh (once)
+            _forget_cached_listings(os.path.join(input_basepath, table_name))
+            _forget_cached_listings(output_basepath)
+
         # build the input store
         self.input_store = S3TableStore(
             input_basepath, table_name, partition_name=input_partition_name
@@ -57,15 +162,9 @@ class S3DataPacker:
             partition=output_partition,
             file_limit_gigabytes=file_limit_gigabytes,
         )
-        found_output_file_ext = get_file_format(self.output_store._get_table_basepath())
-
-        # if the output source contains files already, they must be of the same format
-        if found_output_file_ext and output_file_ext:
-            if not found_output_file_ext.endswith(output_file_ext):
-                raise TypeError(
-                    "output table path cotains files with different file extensions. "
-                    f"found: '{found_output_file_ext}' specified: '{output_file_ext}'"
-                )
+        _check_output_file_ext(
+            get_file_format(self.output_store._get_table_basepath()), output_file_ext
+        )
 
         self.output_store.table_extension = output_file_ext
         # reset to rediscover files of the given extension
@@ -76,11 +175,46 @@ class S3DataPacker:
 
         # read the metadata
         self.metadata = Metadata.from_infer(metadata) if metadata else metadata
+        # all the columns, which csv and jsonl inputs are cast to if they're filtered
+        self._input_metadata = self.metadata
 
         if self.metadata is not None:
+            if columns is not None:
+                self.metadata = _select_metadata_columns(self.metadata, columns)
+                self._input_metadata.set_col_type_category_from_types()
             self.metadata.set_col_type_category_from_types()
+        # the cast plan of each metadata cast to, by its id
+        self._cast_plans: Dict[int, CastPlan] = {}
+        self._output_meta: Union[Tuple[Metadata, Metadata], None] = None
 
         self.read_chunksize = read_chunksize
+        self.max_memory_bytes = max_memory_bytes
+        self.parquet_options = parquet_options
+        self.max_workers = max_workers
+        self.max_bytes_in_flight = max_bytes_in_flight
+        self.upload_max_workers = upload_max_workers
+        self.upload_part_size_bytes = upload_part_size_bytes
+        self.size_tolerance = size_tolerance
+        self.use_staging = use_staging
+        self.on_span = on_span
+        self.parse_workers = parse_workers
+        # the processes large inputs are parsed on, while packing with parse_workers
+        self._parse_pool: Union[Executor, None] = None
+        # the commit the files being staged are recorded in
+        self._commit: Union[OutputCommit, None] = None
+        self._commit_lock = threading.Lock()
+
+        # what the last pack_data wrote
+        self.files_written: List[str] = []
+        self.rows_written = 0
+        self.bytes_written = 0
+
+        # the record of inputs already packed into the output table, if used
+        self.manifest = (
+            PackManifest.read(self.output_store._get_manifest_path())
+            if use_manifest
+            else None
+        )
 
     def _get_meta(self, ext: str = None) -> Union[Metadata, None]:
         meta = (
@@ -90,126 +224,840 @@ class S3DataPacker:
         )
         return meta
 
-    def _set_file_size_on_disk(self, df: DataFrame):
-        # write the data and get it's size on disk
-        with tempfile.NamedTemporaryFile(
-            suffix="." + self.output_store.table_extension
-        ) as t:
-            self.table_nrows = df.shape[0]
-            writer.write(df, t.name)
-            self.file_size_on_disk = os.path.getsize(t.name) / (10**9)
-
-    def _get_chunk_increments(self) -> Tuple[List[int], List[int]]:
-        increment_size = max(
-            int(
-                np.floor(
-                    (self.output_store.file_limit_gigabytes / self.file_size_on_disk)
-                    * self.table_nrows
-                )
+    def _get_input_entries(self) -> List[FileEntry]:
+        # the input files to pack, leaving out any the manifest has as already packed
+        entries = self.input_store.get_file_entries_from_table_log()
+        if self.manifest is not None:
+            entries = [e for e in entries if not self.manifest.is_packed(e)]
+        return entries
+
+    def _get_input_files(self) -> List[Union[DataFrame, pa.Table]]:
+        # get a list of input files as Dataframes, in table log order
+        raw_tables = _map_in_order(
+            lambda entry: self._read_file(
+                entry.path, self.input_store.table_extension, pushdown=True
             ),
-            1,
-        )
-        increment_start = np.arange(
-            0, max(self.table_nrows, 1), increment_size
-        ).tolist()
-        increment_end = np.arange(
-            increment_size, self.table_nrows, increment_size
-        ).tolist()
-        increment_end.append(self.table_nrows)
-
-        return (increment_start, increment_end)
-
-    def _get_input_files(self) -> List[DataFrame]:
-        # get a list of input files as Dataframes
-        raw_tables = [
-            self._read_file(fp, self.input_store.table_extension)
-            for fp in self.input_store.get_files_from_table_log(full_path=True)
-        ]
-        return raw_tables
+            self._get_input_entries(),
+            max_workers=self.max_workers,
+            max_bytes_in_flight=self.max_bytes_in_flight,
+            get_bytes=_get_frame_bytes,
+            # a file's listed size is held for it until it's read
+            get_item_bytes=lambda entry: entry.size,
+        )
+        return list(raw_tables)
 
-    def _append_files(self) -> DataFrame:
-        # concat all new and the most recent file
+    def _append_files(self) -> Union[DataFrame, pa.Table]:
+        # concat all new files, and the most recent file if it's to be rewritten
         raw_tables = self._get_input_files()
+        self._append_to_latest = False
         if self.output_store._should_append_data():
-            existing_df = self._get_latest_file()
-            total_df = concat([existing_df, *raw_tables])
-        else:
-            total_df = concat(raw_tables)
+            raw_tables, self._append_to_latest = self._add_latest_file(raw_tables)
+        return self._concat(list(raw_tables))
 
-        return total_df
+    def _add_latest_file(
+        self,
+        frames: Iterable[Union[DataFrame, pa.Table]],
+        output_store: S3OutputStore = None,
+    ) -> Tuple[Iterable[Union[DataFrame, pa.Table]], bool]:
+        # the latest file has room, so either the frames are written to the end of
+        # it, or it's read back in and rewritten with them
+        output_store = self.output_store if output_store is None else output_store
+        if self._get_sort_keys():
+            # sorted data starts a file of its own, so the files written cover
+            # separate ranges of the keys
+            output_store.filenum += 1
+            return frames, False
+        is_parquet = infer_file_format(output_store.latest_file) == FileFormat.PARQUET
+        append_strategy = self.append_strategy
+        if append_strategy is None:
+            append_strategy = "rewrite" if is_parquet else "append"
+        if append_strategy == "rewrite":
+            return chain(self._get_latest_frames(output_store), frames), False
+        if is_parquet:
+            # a parquet file can't be added to without rewriting its footer, so
+            # leave it as it is and start the next one
+            output_store.filenum += 1
+            return frames, False
+        return frames, True
+
+    def _concat(
+        self, frames: List[Union[DataFrame, pa.Table]]
+    ) -> Union[DataFrame, pa.Table]:
+        with span("concat"):
+            if self.engine == "arrow":
+                # zero-copy, the tables' chunks are kept as they are, unless the files'
+                # types differ (e.g. a column that's all null in one), when they're
+                # promoted to a type that fits them all
+                return pa.concat_tables(frames, promote_options="permissive")
+            return concat(frames)
 
-    def _get_latest_file(self) -> DataFrame:
-        # read the latest file into a pandas df
-        path = self.output_store._get_latest_file_by_suffix(
-            self.output_store.get_files_from_table_log(full_path=True)
+    def _get_latest_frames(
+        self, output_store: S3OutputStore
+    ) -> Iterable[Union[DataFrame, pa.Table]]:
+        path = output_store._get_latest_file_by_suffix(
+            output_store.get_files_from_table_log(full_path=True)
         )
-        df = self._read_file(path, self.output_store.table_extension)
-        return df
+        return self._read_frames(path, output_store.table_extension)
+
+    def _read_frames(
+        self, fp: str, ext: str = None
+    ) -> Iterable[Union[DataFrame, pa.Table]]:
+        # when streaming, output files are read back in chunks like the inputs
+        if self._is_streaming():
+            return self._read_chunked_file(fp, ext)
+        return [self._read_file(fp, ext)]
+
+    def _read_file(
+        self, fp: str, ext: str = None, pushdown: bool = False
+    ) -> Union[DataFrame, pa.Table]:
+        # with pushdown (for inputs), only the columns and rows asked for are kept
+        if self.engine == "arrow":
+            return self._read_table(fp, ext, pushdown)
+        meta = self._get_read_meta(fp, ext, pushdown)
+        columns = self._get_read_columns(fp, meta) if pushdown else None
+        num_splits = self._get_num_splits(fp, meta, pushdown)
+        if num_splits > 1:
+            # the parts are cast on the process pool, so the cast is in the read
+            with span("read", path=fp, splits=num_splits):
+                df = parse_in_splits(
+                    fp,
+                    _get_file_size(fp),
+                    infer_file_format(fp),
+                    self._parse_pool,
+                    num_splits,
+                    self._get_cast_plan(meta),
+                    columns,
+                )
+            return self._filter_df(df, fp, pushdown)
+        with span("read", path=fp):
+            df = reader.read(fp, **self._get_reader_kwargs(fp, columns, pushdown))
+        df = self._cast_df(_select_columns(df, columns), meta)
+        return self._filter_df(df, fp, pushdown)
+
+    def _get_num_splits(self, fp: str, meta: Union[Metadata, None], pushdown: bool):
+        # large csv and jsonl inputs are parsed in parts on the process pool, if
+        # they're cast to metadata, so all the parts have the same dtypes
+        if not pushdown or self._parse_pool is None or meta is None:
+            return 1
+        if infer_file_format(fp) not in [FileFormat.CSV, FileFormat.JSON]:
+            return 1
+        return get_num_splits(_get_file_size(fp), self.parse_workers)
+
+    @contextmanager
+    def _parsing(self):
+        # spawned, as forking a process with threads running isn't safe
+        if self.parse_workers is None:
+            yield
+            return
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(self.parse_workers, mp_context=context) as pool:
+            self._parse_pool = pool
+            try:
+                yield
+            finally:
+                self._parse_pool = None
+
+    def _filters_other_columns(self, fp: str) -> bool:
+        # csv and jsonl are filtered once read and cast, by columns that may not be
+        # kept, so they're all read and the rest only dropped once it's applied
+        if self.columns is None or self.filter is None:
+            return False
+        return infer_file_format(fp) != FileFormat.PARQUET
+
+    def _get_read_meta(
+        self, fp: str, ext: str, pushdown: bool
+    ) -> Union[Metadata, None]:
+        meta = self._get_meta(ext)
+        if meta is None or not pushdown or not self._filters_other_columns(fp):
+            return meta
+        return self._input_metadata
+
+    def _get_read_columns(
+        self, fp: str, meta: Metadata = None
+    ) -> Union[List[str], None]:
+        # the columns read from the inputs. A DataFrame cast to metadata only keeps
+        # its columns, so if there is some (given to say it's cast) only they're read
+        if self.columns is not None and not self._filters_other_columns(fp):
+            return self.columns
+        return None if meta is None else meta.column_names
+
+    def _get_reader_kwargs(
+        self, fp: str, columns: Union[List[str], None], pushdown: bool
+    ) -> dict:
+        # what arrow_pd_parser's reader is given to read only what's wanted: parquet
+        # is read with pyarrow.parquet.read_table, and csv with pandas.read_csv
+        file_format = infer_file_format(fp)
+        if file_format == FileFormat.PARQUET and pushdown:
+            kwargs = {"columns": columns, "filters": self.filter}
+            return {k: v for k, v in kwargs.items() if v is not None}
+        if file_format == FileFormat.CSV and columns is not None:
+            return {"usecols": columns}
+        return {}
+
+    def _filter_df(self, df: DataFrame, fp: str, pushdown: bool) -> DataFrame:
+        # parquet is filtered as it's read, csv and jsonl once cast, and then only
+        # the columns asked for are kept
+        if not pushdown or self.filter is None:
+            return df
+        if infer_file_format(fp) == FileFormat.PARQUET:
+            return df
+        return _select_columns(_filter_frame(df, self.filter), self.columns)
+
+    def _get_scan_kwargs(self, pushdown: bool) -> dict:
+        # for arrow dataset scans, which read only the row groups of parquet files
+        # whose statistics say they may have rows the filter keeps
+        if not pushdown:
+            return {}
+        return {"columns": self.columns, "filter": self.filter}
+
+    def _cast_df(self, df: DataFrame, meta: Union[Metadata, None]) -> DataFrame:
+        if meta is None:
+            return df
+        # output files partitioned by a column don't have it, it's in their path
+        if self.partition_by is not None and self.partition_by not in df.columns:
+            meta = self._get_output_meta()
+        with span("cast"):
+            return self._get_cast_plan(meta).cast_df(df)
+
+    def _get_cast_plan(self, meta: Metadata) -> CastPlan:
+        # compiled the first time each metadata is cast to
+        plan = self._cast_plans.get(id(meta))
+        if plan is None or plan.meta is not meta:
+            plan = CastPlan(meta)
+            self._cast_plans[id(meta)] = plan
+        return plan
+
+    def _get_dataset(self, fp: str, meta: Metadata = None) -> ds.Dataset:
+        # csv and jsonl files cast to metadata are read with its types, rather than
+        # the types guessed from their first block
+        file_format = infer_file_format(fp)
+        read_schema = None if meta is None else self._get_cast_plan(meta).read_schema
+        if file_format == FileFormat.CSV:
+            dataset_format = ds.CsvFileFormat(
+                convert_options=pa_csv.ConvertOptions(
+                    null_values=csv_null_values,
+                    strings_can_be_null=True,
+                    column_types=read_schema,
+                )
+            )
+        elif file_format == FileFormat.JSON:
+            dataset_format = ds.JsonFileFormat(
+                parse_options=pa_json.ParseOptions(explicit_schema=read_schema)
+            )
+        else:
+            dataset_format = "parquet"
+        arrow_fs, pth = _get_arrow_filesystem(fp)
+        return ds.dataset(pth, format=dataset_format, filesystem=arrow_fs)
 
-    def _read_file(self, fp: str, ext: str = None) -> DataFrame:
+    def _cast_table(self, table: pa.Table, meta: Union[Metadata, None]) -> pa.Table:
+        if meta is None:
+            return table
+        with span("cast"):
+            return self._get_cast_plan(meta).cast_table(table)
+
+    def _read_table(self, fp: str, ext: str = None, pushdown: bool = False) -> pa.Table:
+        with span("read", path=fp):
+            meta = self._get_meta(ext)
+            dataset = self._get_dataset(fp, meta)
+            table = dataset.to_table(**self._get_scan_kwargs(pushdown))
+        return self._cast_table(table, meta)
+
+    def _read_chunked_table(
+        self, fp: str, ext: str = None, pushdown: bool = False
+    ) -> Iterable[pa.Table]:
         meta = self._get_meta(ext)
-        df = reader.read(fp)
-        df = (
-            cast_pandas_table_to_schema(df, meta, ignore_columns=meta.partitions)
-            if meta
-            else df
+        dataset = self._get_dataset(fp, meta)
+        batches = self._scan_batches(dataset, **self._get_scan_kwargs(pushdown))
+        for batch in span_iter("read", batches, path=fp):
+            yield self._cast_table(pa.Table.from_batches([batch]), meta)
+
+    def _scan_batches(
+        self, dataset: ds.Dataset, as_pandas: bool = False, **scan_kwargs
+    ) -> Iterable[pa.RecordBatch]:
+        batch_size = self._get_chunk_rows(
+            dataset, scan_kwargs.get("columns"), as_pandas
         )
-        return df
+        if self.max_memory_bytes is not None:
+            # only one batch is read ahead, so no more are held than asked for
+            scan_kwargs.update(batch_readahead=1, fragment_readahead=1)
+        return dataset.to_batches(batch_size=batch_size, **scan_kwargs)
+
+    def _get_read_chunksize(self) -> Union[int, str]:
+        # pandas reads csv and jsonl in chunks of rows, so a memory limit is turned
+        # into rows from the first 1000, as arrow_pd_parser does for a size in bytes
+        if self.max_memory_bytes is None:
+            return self.read_chunksize
+        return f"{int(self.max_memory_bytes / _memory_chunk_fraction)}B"
 
-    def pack_data(self):
+    def _get_chunk_rows(
+        self, dataset: ds.Dataset, columns: List[str] = None, as_pandas: bool = False
+    ) -> int:
+        if self.max_memory_bytes is not None:
+            chunk_bytes = self.max_memory_bytes / _memory_chunk_fraction
+        elif isinstance(self.read_chunksize, str):
+            chunk_bytes = human_to_bytes(self.read_chunksize)
+        else:
+            return self.read_chunksize
+        # as arrow_pd_parser does, size the chunks from the first 1000 rows (by the
+        # memory they take up once converted to pandas, if they will be)
+        sample = dataset.head(1000, columns=columns)
+        if as_pandas:
+            sample = arrow_to_pandas(sample)
+        bytes_per_row = _get_frame_bytes(sample) / max(len(sample), 1)
+        return max(int(chunk_bytes / max(bytes_per_row, 1)), 1)
+
+    def _is_streaming(self) -> bool:
+        return self.read_chunksize is not None or self.max_memory_bytes is not None
+
+    def pack_data(self) -> PackResult:
+        """
+        Packs the new input data into the output table, returning a PackResult of
+        what was written, the time spent in each phase, and the s3 requests made.
+        """
+        recorder = PackRecorder(self.on_span)
+        start = time.perf_counter()
+        with recording(recorder), recorder.span("pack", table=self.table_name):
+            existing_files = set(
+                _list_files_in_path(self.output_store._get_table_basepath())
+            )
+            with self._parsing():
+                self._pack_data()
+        return PackResult(
+            table_name=self.table_name,
+            rows_written=self.rows_written,
+            bytes_written=self.bytes_written,
+            files_created=[f for f in self.files_written if f not in existing_files],
+            files_overwritten=[f for f in self.files_written if f in existing_files],
+            duration_seconds=time.perf_counter() - start,
+            phase_seconds=dict(recorder.phase_seconds),
+            phase_calls=dict(recorder.phase_calls),
+            s3_requests=dict(recorder.s3_requests),
+        )
+
+    def _pack_data(self):
+        self.files_written = []
+        self.rows_written = 0
+        self.bytes_written = 0
+        pending_commit = self._finish_commit() if self.use_staging else None
         # any data to even add?
-        if not self.input_store.get_files_from_table_log():
+        input_entries = self._get_input_entries()
+        if not input_entries:
+            self._discard_commit(pending_commit)
             return
-        # Will the data be read in chunks?
-        if self.read_chunksize is not None:
-            return self._pack_chunked_data()
-        # collate all the data from s3
-        total_df = self._append_files()
-        self._write_df(total_df)
-
-    def _write_df(self, df):
-        # get the size on disk
-        self._set_file_size_on_disk(df)
-        # get the indexes to write to
-        start_vals, end_vals = self._get_chunk_increments()
-        for i in range(len(start_vals)):
-            # break up the df
-            df_part = df[start_vals[i] : end_vals[i]]
-            out_path = self.output_store._get_filename(full_path=True)
-            # output the pandas df
-            writer.write(df_part, out_path, metadata=self.metadata)
-            # increment the filenumber
-            self.output_store.filenum += 1
-
-    def _read_chunked_file(self, fp: str, ext: str = None) -> Iterable[DataFrame]:
-        file_format = self.input_store.table_extension if ext is None else ext
-        meta = self._get_meta(ext)
+        if self.use_staging:
+            self._commit = self._get_commit(input_entries, pending_commit)
+        if self.partition_by is not None:
+            rolling_writers = self._pack_partitioned_data()
+        # Will the data be read in chunks, or sorted or staged as it's read?
+        elif self._is_streaming() or self._get_sort_keys() or self.use_staging:
+            rolling_writers = [self._pack_chunked_data()]
+        else:
+            # collate all the data from s3
+            total_df = self._append_files()
+            rolling_writers = [
+                self._write_df(total_df, append=self._append_to_latest)
+            ]
+        self._set_written(rolling_writers)
+        if self.use_staging:
+            # every file staged, including any by the run being carried on from
+            self.files_written = list(self._commit.staged_files.values())
+            self.rows_written = self._commit.rows_staged
+            self.bytes_written = self._commit.bytes_staged
+        # only recorded once the outputs are written
+        if self.manifest is not None:
+            self._update_manifest(input_entries)
+        if self.use_staging:
+            self._commit.complete = True
+            self._commit.write()
+            self._commit.apply()
+            self._commit = None
+            self.output_store._reset()
+
+    def _set_written(self, rolling_writers: List[RollingFileWriter]):
+        self.files_written = [f for w in rolling_writers for f in w.files_written]
+        self.rows_written = sum(w.rows_written for w in rolling_writers)
+        self.bytes_written = sum(w.bytes_written for w in rolling_writers)
+
+    def compact(self, resort: bool = False):
+        """
+        Rewrites the output table's files that are smaller than file_limit_gigabytes
+        (less size_tolerance) into as few files as they fit in, or if resort, every
+        file sorted by sort_by or cluster_by. With partition_by, each partition is
+        compacted. The new files are staged and only moved into the table, and the
+        old ones deleted, once all are written.
+        """
+        if resort and not self._get_sort_keys():
+            raise ValueError("resort needs sort_by or cluster_by to be set")
+        self._discard_commit(self._finish_commit())
+        self.files_written = []
+        self.rows_written = 0
+        self.bytes_written = 0
+        if self.partition_by is not None:
+            output_stores = [
+                self._get_partition_store(v) for v in self._get_output_partitions()
+            ]
+        else:
+            output_stores = [self.output_store]
+
+        commit = OutputCommit(self.output_store._get_commit_path())
+        rolling_writers = []
+        for output_store in output_stores:
+            entries = self._get_files_to_compact(output_store, resort)
+            if not entries:
+                continue
+            rolling_writer = self._compact_files(entries, output_store, resort)
+            rolling_writers.append(rolling_writer)
+            commit.replaced_files += [e.path for e in entries]
+            commit.staged_files.update(
+                {f: self._get_unstaged_path(f) for f in rolling_writer.files_written}
+            )
+        if not rolling_writers:
+            return
+        self._set_written(rolling_writers)
+        self.files_written = [commit.staged_files[f] for f in self.files_written]
+        if self.manifest is not None:
+            self.manifest.replace_output_files(
+                commit.replaced_files, self.files_written
+            )
+            self._write_manifest(commit)
+        commit.write()
+        commit.apply()
+        self.output_store._reset()
+
+    def _finish_commit(self) -> Union[OutputCommit, None]:
+        # a commit interrupted while it was being applied is finished. One
+        # interrupted while its files were being staged is returned, as the pack it
+        # was for can be carried on. Any other staged files are thrown away
+        commit = OutputCommit.read(self.output_store._get_commit_path())
+        if commit is not None and commit.complete:
+            commit.apply()
+            if self.manifest is not None:
+                self.manifest = PackManifest.read(self.manifest.path)
+            commit = None
+        self._discard_staged_files([] if commit is None else commit.staged_files)
+        self.output_store._reset()
+        return commit
+
+    def _discard_commit(self, commit: Union[OutputCommit, None]):
+        if commit is not None:
+            _delete_file(commit.path)
+            self._discard_staged_files()
+
+    def _discard_staged_files(self, keep: Iterable[str] = ()):
+        keep = set(keep)
+        staged_name = re.compile(
+            f"^{re.escape(self.output_store._get_suffixed_name())}_[0-9]+\\."
+        )
+        staging_path = os.path.join(
+            self.output_store._get_staging_basepath(), self.table_name
+        )
+        for f in _list_files_in_path(staging_path, refresh=True):
+            if staged_name.search(os.path.basename(f)) and f not in keep:
+                _delete_file(f)
 
-        for df in reader.read(
-            fp, file_format=file_format, chunksize=self.read_chunksize
+    def _get_commit(
+        self, input_entries: List[FileEntry], pending_commit: OutputCommit = None
+    ) -> OutputCommit:
+        # an interrupted pack of the same inputs is carried on from what it staged.
+        # Partitions are written all at once, so a partitioned pack starts again
+        inputs = [[e.path, e.size] for e in input_entries]
+        if (
+            pending_commit is not None
+            and pending_commit.inputs == inputs
+            and self.partition_by is None
         ):
-            df = (
-                cast_pandas_table_to_schema(df, meta, ignore_columns=meta.partitions)
-                if meta
-                else df
+            return pending_commit
+        self._discard_commit(pending_commit)
+        return OutputCommit(
+            self.output_store._get_commit_path(), complete=False, inputs=inputs
+        )
+
+    def _stage_file(self, path: str, rows: int, size: int):
+        # called as each staged file is closed, the commit is written each time so
+        # that an interrupted pack can carry on from the files already staged
+        with self._commit_lock:
+            self._commit.staged_files[path] = self._get_unstaged_path(path)
+            self._commit.rows_staged += rows
+            self._commit.bytes_staged += size
+            if self.partition_by is None:
+                self._commit.write()
+
+    def _get_write_store(
+        self, output_store: S3OutputStore, append: bool = False
+    ) -> Tuple[S3OutputStore, bool]:
+        # with use_staging, files are written to the staging folder under the names
+        # they'll have in the table. A file being appended to is copied there first
+        if not self.use_staging:
+            return output_store, append
+        staging_store = self._get_staging_store(output_store)
+        staged_files = [
+            f
+            for f in self._commit.staged_files
+            if f.startswith(staging_store._get_table_basepath())
+        ]
+        if self.partition_by is None and staged_files:
+            # carrying on, after the files already staged
+            staging_store.filenum = (
+                max(staging_store._get_filenum_from_filename(f) for f in staged_files)
+                + 1
+            )
+            return staging_store, False
+        staging_store.filenum = output_store.filenum
+        if append:
+            _copy_file(
+                output_store._get_filename(full_path=True),
+                staging_store._get_filename(full_path=True),
             )
-            yield df
+        return staging_store, append
+
+    def _get_output_partitions(self) -> List[str]:
+        # the values of partition_by that the output table has folders for
+        reg_expr = re.compile(f"{re.escape(self.partition_by)}=([^/]+)/")
+        found = [
+            reg_expr.search(f)
+            for f in self.output_store.get_files_from_table_log(full_path=True)
+        ]
+        return sorted({m.groups()[0] for m in found if m})
+
+    def _get_files_to_compact(
+        self, output_store: S3OutputStore, resort: bool = False
+    ) -> List[FileEntry]:
+        entries = sorted(
+            output_store.get_file_entries_from_table_log(),
+            key=lambda e: output_store._get_filenum_from_filename(e.path),
+        )
+        if resort:
+            return entries
+        limit = output_store.file_limit_gigabytes * 10**9 * (1 - self.size_tolerance)
+        small_entries = [e for e in entries if e.size < limit]
+        # a single small file has nothing to be packed with
+        return small_entries if len(small_entries) > 1 else []
 
-    def _get_dataframes(self) -> Iterable[DataFrame]:
+    def _compact_files(
+        self, entries: List[FileEntry], output_store: S3OutputStore, resort: bool
+    ) -> RollingFileWriter:
+        # the files are written through a rolling writer, so they're packed into
+        # files as near file_limit_gigabytes as they fill. They're numbered on from
+        # the table's latest file, so none clash with the files still in it
+        staging_store = self._get_staging_store(output_store)
+        staging_store.filenum = output_store.filenum + 1
+        frames = (
+            frame
+            for e in entries
+            for frame in self._read_frames(e.path, output_store.table_extension)
+        )
+        if resort:
+            frames = self._sort_frames(frames)
+        with self._get_rolling_writer(output_store=staging_store) as w:
+            for frame in frames:
+                w.write(frame)
+        return w
+
+    def _get_staging_store(self, output_store: S3OutputStore) -> S3OutputStore:
+        staging_store = S3OutputStore(
+            output_store._get_staging_basepath(),
+            table_name=output_store.table_name,
+            table_suffix=output_store.table_suffix,
+            partition=output_store.partition,
+            file_limit_gigabytes=output_store.file_limit_gigabytes,
+        )
+        staging_store.table_extension = output_store.table_extension
+        return staging_store
+
+    def _get_unstaged_path(self, staged_path: str) -> str:
+        # where a staged file goes in the output table
+        staging_basepath = self.output_store._get_staging_basepath()
+        return os.path.join(
+            self.output_store.basepath, staged_path[len(staging_basepath) :]
+        )
+
+    def _update_manifest(self, input_entries: List[FileEntry]):
+        self.manifest.add(input_entries, self.files_written)
+        # kept for the next run's first estimate
+        if self.rows_written:
+            self.manifest.bytes_per_row = self.bytes_written / self.rows_written
+        with span("manifest", path=self.manifest.path):
+            if self.use_staging:
+                self._write_manifest(self._commit)
+            else:
+                self.manifest.write()
+
+    def _write_manifest(self, commit: OutputCommit):
+        # staged and committed with the files it records
+        staged_path = os.path.join(
+            self.output_store._get_staging_basepath(),
+            os.path.basename(self.manifest.path),
+        )
+        self.manifest.write(staged_path)
+        commit.staged_files[staged_path] = self.manifest.path
+
+    def _write_df(self, df, append: bool = False) -> RollingFileWriter:
+        # stream the df into files of at most file_limit_gigabytes each
+        with self._get_rolling_writer(append) as w:
+            w.write(df)
+        return w
+
+    def _get_rolling_writer(
+        self,
+        append: bool = False,
+        output_store: S3OutputStore = None,
+        on_close: Callable[[str, int, int], None] = None,
+    ) -> RollingFileWriter:
+        return RollingFileWriter(
+            self.output_store if output_store is None else output_store,
+            metadata=self._get_output_meta(),
+            upload_max_workers=self.upload_max_workers,
+            upload_part_size_bytes=self.upload_part_size_bytes,
+            append=append,
+            bytes_per_row=(
+                self.manifest.bytes_per_row if self.manifest is not None else None
+            ),
+            size_tolerance=self.size_tolerance,
+            parquet_options=self.parquet_options,
+            cluster_by=(
+                [c for c in self.cluster_by if c != self.partition_by]
+                if self.cluster_by
+                else None
+            ),
+            on_close=on_close,
+            max_buffer_bytes=self._get_max_buffer_bytes(),
+        )
+
+    def _get_max_buffer_bytes(self) -> int:
+        # the parquet rows held for a row group get the same share of the memory
+        # budget as a chunk read
+        if self.max_memory_bytes is None:
+            return default_max_buffer_bytes
+        return int(self.max_memory_bytes / _memory_chunk_fraction)
+
+    def _read_chunked_file(
+        self, fp: str, ext: str = None, pushdown: bool = False
+    ) -> Iterable[Union[DataFrame, pa.Table]]:
+        if self.engine == "arrow":
+            yield from self._read_chunked_table(fp, ext, pushdown)
+            return
+        # read and cast as pandas, whether the chunks are sized by rows or memory
+        file_format = self.input_store.table_extension if ext is None else ext
+        meta = self._get_read_meta(fp, ext, pushdown)
+        columns = self._get_read_columns(fp, meta) if pushdown else None
+        reader_kwargs = self._get_reader_kwargs(fp, columns, pushdown)
+
+        parquet = infer_file_format(fp) == FileFormat.PARQUET
+        if parquet and (reader_kwargs or self.max_memory_bytes is not None):
+            # arrow_pd_parser's chunked parquet reader can't be given columns, a
+            # filter, or a limit on the batches read ahead, so the batches are read
+            # as it would read them, but with them
+            chunks = self._read_parquet_chunks(fp, reader_kwargs)
+        else:
+            chunks = reader.read(
+                fp,
+                file_format=file_format,
+                chunksize=self._get_read_chunksize(),
+                **reader_kwargs,
+            )
+        for df in span_iter("read", chunks, path=fp):
+            df = self._cast_df(_select_columns(df, columns), meta)
+            yield self._filter_df(df, fp, pushdown)
+
+    def _read_parquet_chunks(self, fp: str, reader_kwargs: dict) -> Iterable[DataFrame]:
+        batches = self._scan_batches(
+            self._get_dataset(fp),
+            as_pandas=True,
+            columns=reader_kwargs.get("columns"),
+            filter=reader_kwargs.get("filters"),
+        )
+        for batch in batches:
+            yield arrow_to_pandas(pa.Table.from_batches([batch]))
+
+    def _get_dataframes(self) -> Iterable[Union[DataFrame, pa.Table]]:
         # from a list of input files get chunked Dataframes
-        for f in self.input_store.get_files_from_table_log(full_path=True):
-            yield from self._read_chunked_file(f)
-
-    def _pack_chunked_data(self):
-        for df in self._get_dataframes():
-            if self.output_store._should_append_data():
-                existing_df = self._get_latest_file()
-                df = concat([existing_df, df])
+        for entry in self._get_input_entries():
+            yield from self._read_chunked_file(entry.path, pushdown=True)
+
+    def _get_frames(self) -> Iterable[Union[DataFrame, pa.Table]]:
+        # the input a chunk at a time if streaming, otherwise a file at a time
+        for entry in self._get_input_entries():
+            yield from self._read_input(entry.path)
+
+    def _read_input(
+        self, fp: str, skip_rows: int = 0
+    ) -> Iterable[Union[DataFrame, pa.Table]]:
+        # the input file's rows after the first skip_rows. Parquet row groups that are
+        # all skipped aren't read at all, unless filtered, as skip_rows then counts
+        # the rows kept rather than those in the row groups
+        parquet = infer_file_format(fp) == FileFormat.PARQUET
+        if skip_rows and parquet and self.filter is None:
+            frames, skipped_rows = self._read_row_groups_after(fp, skip_rows)
+            return _skip_rows(frames, skip_rows - skipped_rows)
+        if self._is_streaming():
+            frames = self._read_chunked_file(fp, pushdown=True)
+        else:
+            frames = [
+                self._read_file(fp, self.input_store.table_extension, pushdown=True)
+            ]
+        return _skip_rows(frames, skip_rows)
+
+    def _read_row_groups_after(
+        self, fp: str, skip_rows: int
+    ) -> Tuple[Iterable[pa.Table], int]:
+        dataset = self._get_dataset(fp)
+        fragment = next(dataset.get_fragments())
+        row_group_ids = []
+        skipped_rows = 0
+        for row_group in fragment.row_groups:
+            if not row_group_ids and skipped_rows + row_group.num_rows <= skip_rows:
+                skipped_rows += row_group.num_rows
             else:
-                self.output_store.filenum += 1
-            self._write_df(df)
-            # Reset the output store for the next chunked dataframe
-            self.output_store._reset()
+                row_group_ids.append(row_group.id)
+        fragment = fragment.subset(row_group_ids=row_group_ids)
+        ext = None if self._is_streaming() else self.input_store.table_extension
+        meta = self._get_meta(ext)
+        columns = self.columns
+        if self._is_streaming():
+            batches = fragment.to_batches(
+                batch_size=self._get_chunk_rows(dataset, columns), columns=columns
+            )
+            tables = (
+                pa.Table.from_batches([b]) for b in span_iter("read", batches, path=fp)
+            )
+        else:
+            with span("read", path=fp):
+                tables = [fragment.to_table(columns=columns)]
+        return (self._cast_table(t, meta) for t in tables), skipped_rows
+
+    def _get_sort_keys(self) -> Union[List[str], None]:
+        return self.sort_by or self.cluster_by
+
+    def _sort_frames(
+        self, frames: Iterable[Union[DataFrame, pa.Table]]
+    ) -> Iterable[pa.Table]:
+        if self.max_memory_bytes is not None:
+            max_run_bytes = self.max_memory_bytes / _memory_sort_fraction
+        else:
+            max_run_bytes = default_sort_run_bytes
+        return span_iter(
+            "sort",
+            external_sort(
+                frames, self._get_sort_keys(), max_run_bytes, self.sort_spill_dir
+            ),
+        )
+
+    def _pack_chunked_data(self) -> RollingFileWriter:
+        # every chunk goes through the one writer, so only the file being filled is
+        # open and nothing already written is read back in
+        latest_frames, append = [], False
+        if self.output_store._should_append_data():
+            latest_frames, append = self._add_latest_file([])
+        output_store, append = self._get_write_store(self.output_store, append)
+        if self.use_staging and not self._get_sort_keys():
+            chunks = self._read_from_checkpoint(latest_frames)
+        else:
+            chunks = chain(latest_frames, self._get_frames())
+            if self._get_sort_keys():
+                chunks = self._sort_frames(chunks)
+            if self.use_staging:
+                # the rows already in files staged by an interrupted run. Sorted
+                # rows are only in order once they've all been read
+                chunks = _skip_rows(chunks, self._commit.rows_staged)
+        on_close = self._stage_file if self.use_staging else None
+        with self._get_rolling_writer(append, output_store, on_close) as w:
+            for df in chunks:
+                w.write(df)
+        self.output_store._reset()
+        return w
+
+    def _read_from_checkpoint(
+        self, latest_frames: Iterable[Union[DataFrame, pa.Table]]
+    ) -> Iterable[Union[DataFrame, pa.Table]]:
+        # the rows of each source (the latest file, if it's being rewritten, then
+        # each input) are counted as they're read, and kept in the commit. A pack
+        # carrying on from staged files starts from the source and row after them
+        commit = self._commit
+        source, row = _get_checkpoint(commit.source_rows, commit.rows_staged)
+        commit.source_rows = commit.source_rows[:source] + [row]
+        sources = [latest_frames] + [e.path for e in self._get_input_entries()]
+        for i in range(source, len(sources)):
+            if i >= len(commit.source_rows):
+                commit.source_rows.append(0)
+            skip_rows = row if i == source else 0
+            if i == 0:
+                frames = _skip_rows(latest_frames, skip_rows)
+            else:
+                frames = self._read_input(sources[i], skip_rows)
+            for frame in frames:
+                commit.source_rows[i] += frame.shape[0]
+                yield frame
+
+    def _get_output_meta(self) -> Union[Metadata, None]:
+        # when partitioning by a column, it's in the path of the files, not in them
+        if self.partition_by is None or self.metadata is None:
+            return self.metadata
+        if self.partition_by not in self.metadata.column_names:
+            return self.metadata
+        # made once, so the same metadata (and its cast plan) is used for every file
+        if self._output_meta is None or self._output_meta[0] is not self.metadata:
+            meta = Metadata.from_dict(self.metadata.to_dict())
+            meta.remove_column(self.partition_by)
+            self._output_meta = (self.metadata, meta)
+        return self._output_meta[1]
+
+    def _get_partition_store(self, partition_value: str) -> S3OutputStore:
+        # a store of its own for each partition, so each is numbered and filled
+        # separately. They all share the table's (cached) listing
+        output_store = S3OutputStore(
+            self.output_store.basepath,
+            table_name=self.table_name,
+            table_suffix=self.output_store.table_suffix,
+            partition={self.partition_by: partition_value},
+            file_limit_gigabytes=self.output_store.file_limit_gigabytes,
+        )
+        output_store.table_extension = self.output_store.table_extension
+        output_store._reset()
+        return output_store
+
+    def _get_partition_writer(self, partition_value: str) -> RollingFileWriter:
+        output_store = self._get_partition_store(partition_value)
+        frames, append = [], False
+        if output_store._should_append_data():
+            frames, append = self._add_latest_file([], output_store)
+        output_store, append = self._get_write_store(output_store, append)
+        on_close = self._stage_file if self.use_staging else None
+        rolling_writer = self._get_rolling_writer(append, output_store, on_close)
+        for frame in frames:
+            rolling_writer.write(frame)
+        return rolling_writer
+
+    def _pack_partitioned_data(self) -> List[RollingFileWriter]:
+        # the input is read once, and each chunk split between a writer per partition
+        if self._is_streaming():
+            chunks = self._get_dataframes()
+        else:
+            chunks = [self._concat(self._get_input_files())]
+        if self._get_sort_keys():
+            # sorted as a whole, so each partition's rows come out in order too
+            chunks = self._sort_frames(chunks)
+        rolling_writers = {}
+        try:
+            for df in chunks:
+                partitions = _split_by_column(df, self.partition_by)
+                for partition_value in partitions:
+                    if partition_value not in rolling_writers:
+                        rolling_writers[partition_value] = self._get_partition_writer(
+                            partition_value
+                        )
+                # each partition has its own writer, so they can be written at once
+                list(
+                    _map_in_order(
+                        lambda item: rolling_writers[item[0]].write(item[1]),
+                        partitions.items(),
+                        max_workers=self.max_workers,
+                    )
+                )
+        finally:
+            for rolling_writer in rolling_writers.values():
+                rolling_writer.close()
+        self.output_store._reset()
+        return list(rolling_writers.values())
 
     @property
     def table_name(self):
@@ -247,3 +1095,115 @@ class S3DataPacker:
     @cast_parquet.setter
     def cast_parquet(self, new_cast_parquet: bool):
         self._cast_parquet = new_cast_parquet
+
+
+def _split_by_column(
+    data: Union[DataFrame, pa.Table], column: str
+) -> Dict[str, Union[DataFrame, pa.Table]]:
+    # the rows for each value of the column, without the column, keeping their order
+    if isinstance(data, pa.Table):
+        return _split_table_by_column(data, column)
+    keys = data[column].reset_index(drop=True)
+    rest = data.drop(columns=[column])
+    groups = keys.groupby(keys, sort=True, dropna=False).indices
+    split = {}
+    for value, positions in groups.items():
+        partition_value = _hive_null_value if isna(value) else str(value)
+        split[partition_value] = rest.iloc[positions]
+    return split
+
+
+def _split_table_by_column(table: pa.Table, column: str) -> Dict[str, pa.Table]:
+    # as _split_by_column, grouped in arrow so the values keep their type (ints with
+    # nulls aren't made floats on the way through pandas)
+    encoded = pc.dictionary_encode(
+        table[column].combine_chunks(), null_encoding="encode"
+    )
+    codes = encoded.indices.to_numpy()
+    # the positions of each value's rows, one after another in their order
+    positions = np.argsort(codes, kind="stable")
+    ends = np.cumsum(np.bincount(codes, minlength=len(encoded.dictionary)))
+    rest = table.drop([column])
+    split = {}
+    order = pc.sort_indices(encoded.dictionary, null_placement="at_end")
+    for code in order.to_pylist():
+        value = encoded.dictionary[code].as_py()
+        partition_value = _hive_null_value if value is None else str(value)
+        start = ends[code - 1] if code else 0
+        split[partition_value] = rest.take(positions[start : ends[code]])
+    return split
+
+
+def _check_output_file_ext(found_output_file_ext: str, output_file_ext: str):
+    # if the output source contains files already, they must be of the same format
+    if found_output_file_ext and output_file_ext:
+        if not found_output_file_ext.endswith(output_file_ext):
+            raise TypeError(
+                "output table path cotains files with different file extensions. "
+                f"found: '{found_output_file_ext}' specified: '{output_file_ext}'"
+            )
+
+
+def _check_columns(columns: Union[List[str], None], needed: List[str]):
+    # the columns the output is partitioned or sorted by have to be read
+    missing = [c for c in needed if c is not None and c not in (columns or needed)]
+    if missing:
+        raise ValueError(f"columns must include: {', '.join(missing)}")
+
+
+def _select_metadata_columns(meta: Metadata, columns: List[str]) -> Metadata:
+    # the metadata of only the columns read, in their order
+    meta_dict = meta.to_dict()
+    by_name = {c["name"]: c for c in meta_dict["columns"]}
+    missing = [c for c in columns if c not in by_name]
+    if missing:
+        raise ValueError(f"columns not in the metadata: {', '.join(missing)}")
+    meta_dict["columns"] = [by_name[c] for c in columns]
+    partitions = meta_dict.get("partitions") or []
+    meta_dict["partitions"] = [c for c in partitions if c in columns]
+    return Metadata.from_dict(meta_dict)
+
+
+def _select_columns(df: DataFrame, columns: Union[List[str], None]) -> DataFrame:
+    # the columns asked for, in their order (jsonl can't be read with only some)
+    if columns is None or list(df.columns) == columns:
+        return df
+    return df[[c for c in columns if c in df.columns]]
+
+
+def _filter_frame(df: DataFrame, expression: pc.Expression) -> DataFrame:
+    # the rows the expression is true for, worked out with arrow
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    keep = ds.dataset(table).to_table(columns={"keep": expression})["keep"]
+    return df[keep.fill_null(False).to_numpy(zero_copy_only=False)]
+
+
+def _get_checkpoint(source_rows: List[int], rows: int) -> Tuple[int, int]:
+    # the source, and row in it, that rows into all the sources is at. The last
+    # source counted may only have been read part way
+    for source, num_rows in enumerate(source_rows[:-1]):
+        if rows < num_rows:
+            return source, rows
+        rows -= num_rows
+    return max(len(source_rows) - 1, 0), rows
+
+
+def _skip_rows(
+    frames: Iterable[Union[DataFrame, pa.Table]], rows: int
+) -> Iterable[Union[DataFrame, pa.Table]]:
+    for frame in frames:
+        if rows >= frame.shape[0]:
+            rows -= frame.shape[0]
+            continue
+        if rows and isinstance(frame, pa.Table):
+            frame = frame.slice(rows)
+        elif rows:
+            frame = frame.iloc[rows:]
+        rows = 0
+        yield frame
+
+
+def _get_frame_bytes(frame: Union[DataFrame, pa.Table]) -> int:
+    if isinstance(frame, pa.Table):
+        return frame.nbytes
+    return int(frame.memory_usage(deep=True).sum())
@@ -0,0 +1,179 @@
+import io
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
+from dataengineeringutils3 import s3
+from s3_data_packer.constants import default_upload_part_size_bytes
+from s3_data_packer.instrumentation import submit_in_context
+from s3_data_packer.s3_client import get_s3_client
+
+# s3 won't accept parts, other than the last, smaller than this
+_min_part_size_bytes = 5 * 2**20
+# or any part bigger than this
+_max_part_size_bytes = 5 * 2**30
+
+
+class S3MultipartWriter(io.RawIOBase):
+    """
+    A writable file object for an s3 path that uploads its contents with a multipart
+    upload. Bytes are collected into parts of part_size_bytes, and each part is
+    uploaded on a thread pool of max_workers while the caller carries on writing. At
+    most max_queued_parts parts are held in memory waiting to upload; past that,
+    write blocks until one has finished. The object only appears once close has
+    completed the upload.
+
+    If existing_size is given, the object already at path (of that size) is kept and
+    written to the end of. Its bytes are copied into the upload on s3's side with
+    upload_part_copy, in parts of up to 5GiB. Any bytes too few to be a part of their
+    own (all of a small object, or what's left after the last 5GiB) are downloaded
+    and written again with the new ones.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_workers: int = 4,
+        part_size_bytes: int = default_upload_part_size_bytes,
+        max_queued_parts: int = None,
+        existing_size: int = 0,
+    ):
+        if part_size_bytes < _min_part_size_bytes:
+            raise ValueError(
+                f"part_size_bytes must be at least {_min_part_size_bytes}, "
+                f"got: {part_size_bytes}"
+            )
+        self.path = path
+        self.bucket, self.key = s3.s3_path_to_bucket_key(path)
+        self.part_size_bytes = part_size_bytes
+
+        self._client = get_s3_client()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._slots = threading.BoundedSemaphore(max_queued_parts or max_workers * 2)
+        self._buffer = bytearray()
+        self._position = 0
+        self._upload_id = None
+        self._futures = []
+        # set once the object has been written
+        self.etag = None
+
+        if existing_size:
+            self._start_from_existing(existing_size)
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def write(self, b) -> int:
+        b = bytes(b)
+        self._buffer += b
+        self._position += len(b)
+        while len(self._buffer) >= self.part_size_bytes:
+            part = bytes(self._buffer[: self.part_size_bytes])
+            del self._buffer[: self.part_size_bytes]
+            self._submit_part(part)
+        return len(b)
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self._upload_id is None:
+                # too small for a multipart upload, just put it
+                resp = self._client.put_object(
+                    Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer)
+                )
+                self.etag = resp["ETag"]
+            else:
+                if self._buffer:
+                    self._submit_part(bytes(self._buffer))
+                self._complete()
+        except Exception:
+            self.abort()
+            raise
+        finally:
+            self._buffer = bytearray()
+            self._executor.shutdown()
+            super().close()
+
+    def abort(self):
+        if self._upload_id is not None:
+            self._client.abort_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self._upload_id
+            )
+            self._upload_id = None
+
+    def _start_from_existing(self, existing_size: int):
+        self._position = existing_size
+        # only parts of at least the minimum can be followed by more parts
+        copy_size = existing_size
+        if existing_size % _max_part_size_bytes < _min_part_size_bytes:
+            copy_size -= existing_size % _max_part_size_bytes
+        if copy_size < existing_size:
+            resp = self._client.get_object(
+                Bucket=self.bucket,
+                Key=self.key,
+                Range=f"bytes={copy_size}-{existing_size - 1}",
+            )
+            self._buffer += resp["Body"].read()
+        if not copy_size:
+            return
+        self._create_upload()
+        for start in range(0, copy_size, _max_part_size_bytes):
+            end = min(start + _max_part_size_bytes, copy_size) - 1
+            byte_range = f"bytes={start}-{end}"
+            part_number = len(self._futures) + 1
+            self._futures.append(
+                submit_in_context(
+                    self._executor, self._copy_part, byte_range, part_number
+                )
+            )
+
+    def _create_upload(self):
+        resp = self._client.create_multipart_upload(Bucket=self.bucket, Key=self.key)
+        self._upload_id = resp["UploadId"]
+
+    def _submit_part(self, part: bytes):
+        if self._upload_id is None:
+            self._create_upload()
+        part_number = len(self._futures) + 1
+        # wait here, rather than queue up more parts than allowed
+        self._slots.acquire()
+        future = submit_in_context(
+            self._executor, self._upload_part, part, part_number
+        )
+        future.add_done_callback(lambda f: self._slots.release())
+        self._futures.append(future)
+
+    def _upload_part(self, part: bytes, part_number: int) -> dict:
+        resp = self._client.upload_part(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            Body=part,
+        )
+        return {"ETag": resp["ETag"], "PartNumber": part_number}
+
+    def _copy_part(self, byte_range: str, part_number: int) -> dict:
+        resp = self._client.upload_part_copy(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            PartNumber=part_number,
+            CopySource={"Bucket": self.bucket, "Key": self.key},
+            CopySourceRange=byte_range,
+        )
+        return {"ETag": resp["CopyPartResult"]["ETag"], "PartNumber": part_number}
+
+    def _complete(self):
+        parts = [f.result() for f in self._futures]
+        resp = self._client.complete_multipart_upload(
+            Bucket=self.bucket,
+            Key=self.key,
+            UploadId=self._upload_id,
+            MultipartUpload={"Parts": parts},
+        )
+        self.etag = resp["ETag"]
+        self._upload_id = None
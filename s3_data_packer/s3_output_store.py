@@ -115,6 +115,23 @@ class S3OutputStore(S3TableStore):
             ret_pth = os.path.join(self._get_table_basepath(), ret_pth)
         return ret_pth
 
+    def _get_manifest_path(self) -> str:
+        # kept next to the table's folder, so it isn't read as one of its files
+        return os.path.join(self.basepath, f"{self._get_suffixed_name()}.manifest.json")
+
+    def _get_commit_path(self) -> str:
+        # only there while staged files are being moved into the table
+        return os.path.join(self.basepath, f"{self._get_suffixed_name()}.commit.json")
+
+    def _get_staging_basepath(self) -> str:
+        # a hidden folder beside the tables, so staged files aren't read as any table's
+        return os.path.join(self.basepath, "_staging/")
+
+    def _get_suffixed_name(self) -> str:
+        if self.table_suffix:
+            return f"{self.table_name}_{self.table_suffix}"
+        return self.table_name
+
     def _reset(self):
         reset = True
         for attr_name in self._attrs_needed_for_reset:
@@ -2,7 +2,13 @@ import os
 import re
 
 from dataengineeringutils3 import s3
-from s3_data_packer.helpers import _list_files_in_path
+from s3_data_packer.helpers import (
+    FileEntry,
+    _get_file_entry,
+    _list_files_in_path,
+    _list_tables_in_path,
+)
+from typing import List
 
 
 class S3TableStore:
@@ -15,11 +21,13 @@ class S3TableStore:
         table_name: str = None,
         table_extension: str = None,
         partition_name: str = None,
+        table_names: List[str] = None,
     ):
 
         # set all properties to None
         self._table_name = None
         self._basepath = None
+        self.table_names = table_names
 
         # self._attrs_needed_for_reset = ["table_name", "basepath"]
         self.partition_name = partition_name
@@ -33,7 +41,17 @@ class S3TableStore:
 
         self.table_log = {}
 
-        files = _list_files_in_path(self.basepath, self.table_extension)
+        if self.table_name is not None:
+            files = _list_files_in_path(
+                self._get_table_basepath(), self.table_extension
+            )
+        else:
+            # no table given, so log every table (in table_names) from one scan
+            table_files = _list_tables_in_path(
+                self.basepath, self.table_names, self.table_extension
+            )
+            files = [f for fs in table_files.values() for f in fs]
+
         for f in files:
             try:
                 table_name, filename = f.replace(self.basepath, "", 1).split("/", 1)
@@ -54,6 +72,15 @@ class S3TableStore:
                 self.table_log[table_name] = []
             self.table_log[table_name].append(filename)
 
+    def refresh(self):
+        """relists the table rather than using the shared listing cache"""
+        if self.basepath is not None and self.table_name is not None:
+            _list_files_in_path(self._get_table_basepath(), refresh=True)
+            self._reset()
+        elif self.basepath is not None:
+            _list_files_in_path(self.basepath, refresh=True)
+            self._init_table_log()
+
     def _get_table_basepath(self):
         """joins the basepath and the table name together"""
         out = os.path.join(
@@ -72,6 +99,15 @@ class S3TableStore:
                 files = [os.path.join(self._get_table_basepath(), f) for f in files]
         return files
 
+    def get_file_entries_from_table_log(self) -> List[FileEntry]:
+        """
+        returns the listed details (size, etag, last modified) of the files given by
+        get_files_from_table_log
+        """
+        return [
+            _get_file_entry(f) for f in self.get_files_from_table_log(full_path=True)
+        ]
+
     def _reset(self):
         reset = True
         for attr_name in self._attrs_needed_for_reset:
@@ -0,0 +1,27 @@
+import boto3
+import pytest
+
+from moto import mock_s3
+from s3_data_packer.constants import aws_region
+from s3_data_packer.helpers import _clear_listing_cache
+from s3_data_packer.s3_client import configure_s3_client
+
+test_bucket = "s3-data-packer-test"
+
+
+@pytest.fixture
+def s3_bucket(monkeypatch):
+    """a mocked s3 bucket, yields the s3 path of the bucket"""
+    # listings cached from previous mocked buckets are no longer valid
+    _clear_listing_cache()
+    # and the shared client needs making again, with the mocked credentials
+    monkeypatch.setenv("AWS_ACCESS_KEY_ID", "testing")
+    monkeypatch.setenv("AWS_SECRET_ACCESS_KEY", "testing")
+    monkeypatch.setenv("AWS_DEFAULT_REGION", aws_region)
+    configure_s3_client()
+    with mock_s3():
+        boto3.client("s3").create_bucket(
+            Bucket=test_bucket,
+            CreateBucketConfiguration={"LocationConstraint": aws_region},
+        )
+        yield f"s3://{test_bucket}"
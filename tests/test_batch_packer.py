@@ -0,0 +1,102 @@
+import os
+import pytest
+
+from arrow_pd_parser import reader
+from s3_data_packer.batch_packer import BatchPacker
+from tests.helpers import write_file_map
+
+table_names = ["table_a", "table_b", "other_table"]
+
+
+def setup_tables(tmp_path):
+    # table_a has twice the input of the others. _staging is hidden, so isn't a table
+    write_file_map(
+        tmp_path,
+        {
+            "tests/data/all_types.csv": [
+                "land/table_a/table_a_0.csv",
+                "land/table_a/table_a_1.csv",
+                "land/table_b/table_b_0.csv",
+                "land/other_table/other_table_0.csv",
+                "land/_staging/table_c/table_c_0.csv",
+            ]
+        },
+    )
+    return os.path.join(tmp_path, "land/"), os.path.join(tmp_path, "db/")
+
+
+@pytest.mark.parametrize("max_workers", [1, 3])
+@pytest.mark.parametrize("max_bytes_in_flight", [None, 1])
+@pytest.mark.parametrize("use_processes", [False, True])
+def test_batch_packer(tmp_path, max_workers, max_bytes_in_flight, use_processes):
+    input_basepath, output_basepath = setup_tables(tmp_path)
+    batch_packer = BatchPacker(
+        input_basepath,
+        output_basepath,
+        max_workers=max_workers,
+        max_bytes_in_flight=max_bytes_in_flight,
+        use_processes=use_processes,
+        output_file_ext="csv",
+    )
+    results = batch_packer.pack()
+
+    assert list(results) == sorted(table_names)
+    for table_name, result in results.items():
+        assert result.error is None
+        assert result.table_name == table_name
+        expected_rows = 20 if table_name == "table_a" else 10
+        assert result.rows_written == expected_rows
+        out_path = os.path.join(output_basepath, table_name, f"{table_name}_0.csv")
+        assert result.files_written == [out_path]
+        assert result.bytes_written == os.path.getsize(out_path)
+        assert reader.read(out_path).shape[0] == expected_rows
+        assert result.duration_seconds > 0
+        assert result.pack_result.rows_written == expected_rows
+
+
+def test_batch_packer_runs_list_afresh(tmp_path):
+    input_basepath, output_basepath = setup_tables(tmp_path)
+    kwargs = {"output_file_ext": "csv", "use_manifest": True, "tables": ["table_b"]}
+    BatchPacker(input_basepath, output_basepath, **kwargs).pack()
+    write_file_map(
+        tmp_path, {"tests/data/all_types.csv": ["land/table_b/table_b_1.csv"]}
+    )
+    results = BatchPacker(input_basepath, output_basepath, **kwargs).pack()
+    assert results["table_b"].rows_written == 10
+
+
+def test_batch_packer_table_patterns(tmp_path):
+    input_basepath, output_basepath = setup_tables(tmp_path)
+    batch_packer = BatchPacker(
+        input_basepath, output_basepath, ["table_*"], output_file_ext="csv"
+    )
+    input_bytes = os.path.getsize(os.path.join(input_basepath, "table_b/table_b_0.csv"))
+    assert batch_packer.get_table_input_bytes() == {
+        "table_a": 2 * input_bytes,
+        "table_b": input_bytes,
+    }
+    assert list(batch_packer.pack()) == ["table_a", "table_b"]
+    assert sorted(os.listdir(output_basepath)) == ["table_a", "table_b"]
+
+
+def test_batch_packer_table_error(tmp_path):
+    input_basepath, output_basepath = setup_tables(tmp_path)
+    # mixed formats in one output table fail that table, but not the others
+    write_file_map(
+        tmp_path, {"tests/data/all_types.csv": ["db/table_b/table_b_0.parquet"]}
+    )
+    results = BatchPacker(
+        input_basepath, output_basepath, max_workers=2, output_file_ext="csv"
+    ).pack()
+    assert isinstance(results["table_b"].error, TypeError)
+    assert results["table_b"].files_written == []
+    assert results["table_a"].error is None
+    assert results["other_table"].error is None
+
+
+def test_batch_packer_spawns_processes(tmp_path):
+    input_basepath, output_basepath = setup_tables(tmp_path)
+    batch_packer = BatchPacker(input_basepath, output_basepath, use_processes=True)
+    # not forked, as the parent's s3 client and its threads already exist
+    with batch_packer._get_executor() as executor:
+        assert executor._mp_context.get_start_method() == "spawn"
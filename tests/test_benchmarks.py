@@ -0,0 +1,60 @@
+from benchmarks.run import BenchmarkCase, compare, get_cases, main
+
+
+def test_get_cases():
+    cases = get_cases()
+    assert len({c.name for c in cases}) == len(cases)
+    s3_cases = [c for c in cases if c.target == "s3"]
+    assert s3_cases
+    assert all(c.engine == "pandas" and c.input_format != "parquet" for c in s3_cases)
+
+
+def test_benchmark_run(tmp_path):
+    output = tmp_path / "results.json"
+    results = main(
+        [
+            "--filter",
+            "local-arrow-narrow-few_large-csv",
+            "--scale",
+            "0.001",
+            "--in-process",
+            "--work-dir",
+            str(tmp_path),
+            "--output",
+            str(output),
+        ]
+    )
+    assert len(results) == 1
+    result = results[0]
+    assert result["rows_written"] == 200
+    assert result["files_written"] == 1
+    assert {"pack", "listing", "read", "cast", "size_probe", "write"} <= set(
+        result["phase_seconds"]
+    )
+    assert result["s3_requests"] == {}
+
+    # compared with itself
+    compared = main(
+        [
+            "--filter",
+            "local-arrow-narrow-few_large-csv",
+            "--scale",
+            "0.001",
+            "--in-process",
+            "--compare",
+            str(output),
+            "--threshold",
+            "1000",
+        ]
+    )
+    assert len(compared) == 1
+
+
+def test_compare():
+    case = BenchmarkCase("local", "pandas", "narrow", "few_large", "csv", 10)
+    baseline = [{"name": case.name, "seconds": 1.0, "peak_rss_bytes": 100}]
+    slower = [{"name": case.name, "seconds": 1.5, "peak_rss_bytes": 100}]
+    assert compare(slower, baseline, 0.1)[0].endswith("REGRESSION")
+    assert not compare(slower, baseline, 0.6)[0].endswith("REGRESSION")
+    other = [{"name": "other", "seconds": 1.0, "peak_rss_bytes": 100}]
+    assert compare(other, baseline, 0.1) == ["other: no baseline"]
@@ -0,0 +1,114 @@
+import pytest
+
+import pyarrow as pa
+
+from arrow_pd_parser import reader
+from arrow_pd_parser._arrow_parsers import cast_arrow_table_to_schema
+from arrow_pd_parser.caster import cast_pandas_table_to_schema
+from arrow_pd_parser.utils import validate_and_enrich_metadata
+from helpers import setup_packer
+from mojap_metadata.converters.arrow_converter import ArrowConverter
+from mojap_metadata.metadata.metadata import Metadata
+from pandas.testing import assert_frame_equal
+from pyarrow import csv as pa_csv
+from s3_data_packer.cast_plan import CastPlan
+
+meta_path = "tests/data/all_types.json"
+
+
+def test_cast_df():
+    meta = Metadata.from_json(meta_path)
+    df = reader.read("tests/data/all_types.csv")
+    plan = CastPlan(meta)
+    expected = cast_pandas_table_to_schema(df, meta, ignore_columns=meta.partitions)
+    out = plan.cast_df(df)
+    assert_frame_equal(out, expected)
+    # cast again, the columns already cast are left alone
+    assert_frame_equal(plan.cast_df(out), expected)
+
+
+def test_cast_df_already_cast():
+    meta = Metadata.from_json(meta_path)
+    for col in ["my_date", "my_datetime"]:
+        meta.remove_column(col)
+    df = reader.read("tests/data/all_types.csv")[meta.column_names]
+    plan = CastPlan(meta)
+    out = plan.cast_df(df)
+    # nothing to do, so not copied
+    assert plan.cast_df(out) is out
+    # columns are put in the metadata's order
+    reordered = out[list(reversed(meta.column_names))]
+    assert_frame_equal(plan.cast_df(reordered), out)
+
+
+def test_cast_df_partitions():
+    meta = Metadata.from_json(meta_path)
+    meta.partitions = ["my_string"]
+    df = reader.read("tests/data/all_types.csv")
+    df["my_string"] = df["my_string"].astype(object)
+    out = CastPlan(meta).cast_df(df)
+    # the partition column isn't cast
+    assert out["my_string"].dtype == object
+    expected = cast_pandas_table_to_schema(df, meta, ignore_columns=meta.partitions)
+    assert_frame_equal(out, expected)
+
+
+def test_cast_df_missing_column():
+    df = reader.read("tests/data/all_types.csv").drop(columns="my_int")
+    with pytest.raises(ValueError, match="my_int"):
+        CastPlan(Metadata.from_json(meta_path)).cast_df(df)
+
+
+def test_cast_table():
+    meta = Metadata.from_json(meta_path)
+    table = pa_csv.read_csv("tests/data/all_types.csv")
+    schema = ArrowConverter().generate_from_meta(validate_and_enrich_metadata(meta))
+    expected = cast_arrow_table_to_schema(table, schema, expect_full_schema=False)
+    plan = CastPlan(meta)
+    chunks = [plan.cast_table(t) for t in [table.slice(0, 5), table.slice(5)]]
+    assert pa.concat_tables(chunks).equals(expected)
+    # one target schema is worked out for both chunks, as they share a schema
+    assert len(plan._arrow_schemas) == 1
+    # and a table already cast is returned as it is
+    assert plan.cast_table(expected) is expected
+
+
+@pytest.mark.parametrize("engine", ["pandas", "arrow"])
+def test_pack_data_compiles_cast_plan_once(tmp_path, engine):
+    pp = setup_packer(
+        tmp_path,
+        {
+            "tests/data/all_types.csv": [
+                "land/all_types/all_types_a.csv",
+                "land/all_types/all_types_b.csv",
+            ]
+        },
+        metadata=meta_path,
+        output_file_ext="csv",
+        read_chunksize=3,
+        engine=engine,
+    )
+    pp.pack_data()
+    assert pp.rows_written == 20
+    assert list(pp._cast_plans.values())[0].meta is pp.metadata
+    assert len(pp._cast_plans) == 1
+
+
+def test_cast_table_read_schema():
+    meta = Metadata.from_json(meta_path)
+    meta.update_column({"name": "my_date", "type": "date64"})
+    meta.update_column(
+        {"name": "my_datetime", "type": "timestamp(s)", "datetime_format": "%d/%m/%Y"}
+    )
+    plan = CastPlan(meta)
+    # dates and timestamps are read as strings, the rest as the metadata says
+    assert plan.read_schema.field("my_date").type == pa.string()
+    assert plan.read_schema.field("my_int").type == pa.int64()
+    table = pa.table(
+        {"my_date": ["2013-06-13", None], "my_datetime": ["13/06/2013", None]}
+    )
+    out = plan.cast_table(table)
+    assert out.schema.field("my_datetime").type == pa.timestamp("s")
+    assert out["my_datetime"].to_pylist()[1] is None
+    assert str(out["my_datetime"][0]) == "2013-06-13 00:00:00"
+    assert str(out["my_date"][0]) == "2013-06-13"
@@ -0,0 +1,71 @@
+import os
+import pytest
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from s3_data_packer.external_sort import _read_run, _spill_run, external_sort
+
+
+def make_frames() -> list:
+    # 10 frames of 100 rows, with many repeated keys and some nulls
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        {
+            "a": rng.integers(0, 20, 1000),
+            "b": pd.array(rng.integers(0, 50, 1000), dtype="Int64"),
+            "c": np.arange(1000),
+        }
+    )
+    df.loc[df["b"] % 5 == 0, "b"] = None
+    return [df.iloc[n * 100 : (n + 1) * 100] for n in range(10)]
+
+
+@pytest.mark.parametrize("as_arrow", [False, True])
+@pytest.mark.parametrize("max_run_bytes", [1, 5000, 10**9])
+def test_external_sort(tmp_path, as_arrow, max_run_bytes):
+    frames = make_frames()
+    if as_arrow:
+        frames = [pa.Table.from_pandas(f, preserve_index=False) for f in frames]
+    tables = list(external_sort(frames, ["a", "b"], max_run_bytes, str(tmp_path)))
+    assert all(isinstance(t, pa.Table) for t in tables)
+    out = pa.concat_tables(tables).to_pandas()
+
+    expected = pd.concat(make_frames()).sort_values(
+        ["a", "b"], na_position="last", kind="stable"
+    )
+    assert out["a"].tolist() == expected["a"].tolist()
+    assert out["b"].fillna(-1).tolist() == expected["b"].fillna(-1).tolist()
+    # rows with equal keys keep their order
+    assert out["c"].tolist() == expected["c"].tolist()
+    # the spilled runs are removed once they're merged
+    assert os.listdir(tmp_path) == []
+
+
+def test_external_sort_spills(tmp_path):
+    sorted_tables = external_sort(make_frames(), ["a"], 5000, str(tmp_path))
+    next(sorted_tables)
+    run_dir = os.path.join(tmp_path, os.listdir(tmp_path)[0])
+    assert len(os.listdir(run_dir)) > 1
+    sorted_tables.close()
+
+
+def test_external_sort_empty(tmp_path):
+    assert list(external_sort([], ["a"], 1, str(tmp_path))) == []
+
+
+def test_external_sort_sorted_runs(tmp_path):
+    # runs that don't overlap are merged a run after another
+    frames = [pd.DataFrame({"a": np.arange(n * 100, (n + 1) * 100)}) for n in range(10)]
+    tables = list(external_sort(reversed(frames), ["a"], 1000, str(tmp_path)))
+    assert pa.concat_tables(tables)["a"].to_pylist() == list(range(1000))
+
+
+def test_read_run_slices(tmp_path):
+    table = pa.table({"a": np.arange(1000, dtype=np.int64)})
+    path = _spill_run(table, str(tmp_path))
+    # runs are read in slices of about the bytes asked for
+    slices = list(_read_run(path, 800))
+    assert [t.num_rows for t in slices] == [100] * 10
+    assert pa.concat_tables(slices).equals(table)
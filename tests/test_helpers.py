@@ -0,0 +1,111 @@
+import os
+import pytest
+import random
+import threading
+import time
+
+from s3_data_packer.helpers import (
+    _add_file_to_listing_cache,
+    _forget_cached_listings,
+    _list_files_in_path,
+    _map_in_order,
+    _remove_file_from_listing_cache,
+)
+
+
+@pytest.mark.parametrize("max_workers", [1, 2, 8])
+@pytest.mark.parametrize("max_bytes_in_flight", [None, 1, 100])
+def test_map_in_order(max_workers, max_bytes_in_flight):
+    lock = threading.Lock()
+    running = []
+    max_running = []
+
+    def slow_square(x):
+        with lock:
+            running.append(x)
+            max_running.append(len(running))
+        time.sleep(random.random() / 100)
+        with lock:
+            running.remove(x)
+        return x**2
+
+    results = _map_in_order(
+        slow_square,
+        range(30),
+        max_workers=max_workers,
+        max_bytes_in_flight=max_bytes_in_flight,
+        get_bytes=lambda x: 1,
+    )
+    assert list(results) == [x**2 for x in range(30)]
+    assert max(max_running) <= max_workers
+
+
+def test_map_in_order_reserves_bytes():
+    lock = threading.Lock()
+    running = []
+    max_running = []
+
+    def slow_identity(x):
+        with lock:
+            running.append(x)
+            max_running.append(len(running))
+        time.sleep(0.01)
+        with lock:
+            running.remove(x)
+        return x
+
+    # each item holds 10 bytes from when it's started, so only two fit at once,
+    # however many workers are free and however slowly the results are taken
+    results = []
+    for result in _map_in_order(
+        slow_identity,
+        range(10),
+        max_workers=8,
+        max_bytes_in_flight=25,
+        get_bytes=lambda x: 10,
+        get_item_bytes=lambda x: 10,
+    ):
+        time.sleep(0.01)
+        results.append(result)
+    assert results == list(range(10))
+    assert max(max_running) <= 2
+
+
+def test_map_in_order_raises():
+    def fail_on_three(x):
+        if x == 3:
+            raise ValueError("three")
+        return x
+
+    with pytest.raises(ValueError):
+        list(_map_in_order(fail_on_three, range(10), max_workers=4))
+
+
+def test_list_files_in_path_cached(tmp_path):
+    basepath = os.path.join(tmp_path, "land/")
+    table_path = os.path.join(basepath, "all_types")
+    os.makedirs(table_path)
+    for fn in ["b.csv", "a.csv", "c.parquet"]:
+        open(os.path.join(table_path, fn), "w").write("i\n1\n")
+
+    expected = [os.path.join(table_path, fn) for fn in ["a.csv", "b.csv"]]
+    assert _list_files_in_path(basepath, "csv") == expected
+    # files added by someone else aren't seen until the path is refreshed
+    open(os.path.join(table_path, "d.csv"), "w").write("i\n1\n")
+    assert _list_files_in_path(table_path, "csv") == expected
+    expected.append(os.path.join(table_path, "d.csv"))
+    assert _list_files_in_path(table_path, "csv", refresh=True) == expected
+    # the refreshed listing is kept by the covering prefix
+    assert _list_files_in_path(basepath, "csv") == expected
+
+    # files written by the packer are added in place
+    new_file = os.path.join(table_path, "0.csv")
+    _add_file_to_listing_cache(new_file, 4)
+    assert _list_files_in_path(basepath, "csv") == [new_file, *expected]
+    _remove_file_from_listing_cache(new_file)
+    assert _list_files_in_path(basepath, "csv") == expected
+    # forgetting the table drops the covering listing, so it's all listed again
+    open(os.path.join(table_path, "e.csv"), "w").write("i\n1\n")
+    _forget_cached_listings(table_path)
+    expected.append(os.path.join(table_path, "e.csv"))
+    assert _list_files_in_path(basepath, "csv") == expected
@@ -0,0 +1,57 @@
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from s3_data_packer.instrumentation import (
+    PackRecorder,
+    count_request,
+    recording,
+    span,
+    span_iter,
+    submit_in_context,
+)
+
+
+def slow_items():
+    for i in range(3):
+        time.sleep(0.01)
+        yield i
+
+
+def test_recorder_spans():
+    spans = []
+    recorder = PackRecorder(spans.append)
+    with recording(recorder):
+        with span("outer", path="a"):
+            time.sleep(0.01)
+            with span("inner"):
+                time.sleep(0.02)
+        assert list(span_iter("items", slow_items())) == [0, 1, 2]
+    # the inner span's time isn't counted in the outer one
+    assert 0.01 <= recorder.phase_seconds["outer"] < 0.02
+    assert recorder.phase_seconds["inner"] >= 0.02
+    assert recorder.phase_seconds["items"] >= 0.03
+    # an items span for each item, and one finding there are no more
+    assert recorder.phase_calls == {"outer": 1, "inner": 1, "items": 4}
+    # but the spans passed on include those inside them
+    assert [s.name for s in spans[:2]] == ["inner", "outer"]
+    assert spans[1].seconds >= 0.03
+    assert spans[1].attributes == {"path": "a"}
+
+
+def test_no_recorder():
+    # nothing's recorded, and nothing fails, outside of recording
+    with span("outer"):
+        count_request("GetObject")
+    assert list(span_iter("items", [1, 2])) == [1, 2]
+
+
+def test_submit_in_context():
+    recorder = PackRecorder()
+    with recording(recorder), ThreadPoolExecutor(2) as executor:
+        futures = [
+            submit_in_context(executor, count_request, "PutObject") for _ in range(4)
+        ]
+        # submitted as usual, the threads don't record to it
+        futures.append(executor.submit(count_request, "GetObject"))
+        [f.result() for f in futures]
+    assert recorder.s3_requests == {"PutObject": 4}
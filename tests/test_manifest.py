@@ -0,0 +1,81 @@
+import os
+
+from arrow_pd_parser import reader, writer
+from datetime import datetime, timezone
+from s3_data_packer.helpers import FileEntry
+from s3_data_packer.manifest import PackManifest
+from tests.helpers import setup_packer, data_maker
+
+
+def read_output(tmp_path) -> list:
+    output_path = os.path.join(tmp_path, "db/all_types")
+    return [
+        i
+        for f in sorted(os.listdir(output_path))
+        for i in reader.read(os.path.join(output_path, f))["i"].tolist()
+    ]
+
+
+def test_manifest_skips_packed_inputs(tmp_path):
+    input_map = {"tests/data/all_types.csv": ["land/all_types/all_types_a.csv"]}
+    pp = setup_packer(tmp_path, input_map, output_file_ext="csv", use_manifest=True)
+    pp.pack_data()
+
+    manifest_path = os.path.join(tmp_path, "db/all_types.manifest.json")
+    input_path = os.path.join(tmp_path, "land/all_types/all_types_a.csv")
+    manifest = PackManifest.read(manifest_path)
+    assert list(manifest.inputs) == [input_path]
+    assert manifest.inputs[input_path]["output_files"] == [
+        os.path.join(tmp_path, "db/all_types/all_types_0.csv")
+    ]
+    # the bytes per row measured is kept for the next run to start from
+    output_size = os.path.getsize(manifest.inputs[input_path]["output_files"][0])
+    assert manifest.bytes_per_row == output_size / 10
+
+    # a second run with nothing new adds nothing
+    pp = setup_packer(tmp_path, output_file_ext="csv", use_manifest=True)
+    assert pp._get_input_entries() == []
+    pp.pack_data()
+    assert read_output(tmp_path) == list(range(10))
+
+    # only the new input is packed on the next
+    input_map = {"tests/data/all_types.csv": ["land/all_types/all_types_b.csv"]}
+    pp = setup_packer(tmp_path, input_map, output_file_ext="csv", use_manifest=True)
+    pp.input_store.refresh()
+    pp.pack_data()
+    assert read_output(tmp_path) == list(range(10)) * 2
+    assert len(PackManifest.read(manifest_path).inputs) == 2
+
+
+def test_manifest_repacks_changed_inputs(tmp_path):
+    input_map = {"tests/data/all_types.csv": ["land/all_types/all_types_a.csv"]}
+    pp = setup_packer(tmp_path, input_map, output_file_ext="csv", use_manifest=True)
+    pp.pack_data()
+
+    input_path = os.path.join(tmp_path, "land/all_types/all_types_a.csv")
+    writer.write(data_maker(5), input_path)
+    pp = setup_packer(tmp_path, output_file_ext="csv", use_manifest=True)
+    pp.input_store.refresh()
+    assert [e.path for e in pp._get_input_entries()] == [input_path]
+
+
+def test_manifest_s3(s3_bucket):
+    path = f"{s3_bucket}/db/all_types.manifest.json"
+    assert PackManifest.read(path).inputs == {}
+
+    manifest = PackManifest(path)
+    entries = [
+        FileEntry(f"{s3_bucket}/land/all_types/all_types_a.csv", 10, '"abc"'),
+        FileEntry(
+            f"{s3_bucket}/land/all_types/all_types_b.csv",
+            20,
+            last_modified=datetime(2021, 1, 1, tzinfo=timezone.utc),
+        ),
+    ]
+    manifest.add(entries, [f"{s3_bucket}/db/all_types/all_types_0.csv"])
+    manifest.write()
+
+    manifest = PackManifest.read(path)
+    assert all(manifest.is_packed(e) for e in entries)
+    assert not manifest.is_packed(entries[0]._replace(etag='"def"'))
+    assert not manifest.is_packed(entries[1]._replace(size=21))
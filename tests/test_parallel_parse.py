@@ -0,0 +1,99 @@
+import os
+import pytest
+
+import pandas as pd
+
+from arrow_pd_parser import reader, writer
+from arrow_pd_parser.utils import FileFormat
+from concurrent.futures import ThreadPoolExecutor
+from mojap_metadata import Metadata
+from pandas.testing import assert_frame_equal
+from s3_data_packer import parallel_parse
+from s3_data_packer.cast_plan import CastPlan
+from s3_data_packer.helpers import _get_file_size
+from s3_data_packer.parallel_parse import (
+    get_num_splits,
+    get_split_ranges,
+    parse_in_splits,
+)
+
+
+def _get_cast_plan(columns: list = None) -> CastPlan:
+    meta = Metadata.from_json("tests/data/all_types.json")
+    if columns is not None:
+        meta.columns = [c for c in meta.columns if c["name"] in columns]
+    meta.set_col_type_category_from_types()
+    return CastPlan(meta)
+
+
+def _write_big_file(path: str, copies: int = 30) -> int:
+    df = reader.read("tests/data/all_types.csv")
+    writer.write(pd.concat([df] * copies, ignore_index=True), path)
+    return os.path.getsize(path)
+
+
+def test_get_num_splits(monkeypatch):
+    monkeypatch.setattr(parallel_parse, "_min_split_bytes", 100)
+    assert get_num_splits(50, 8) == 1
+    assert get_num_splits(350, 8) == 3
+    assert get_num_splits(10**6, 8) == 8
+
+
+@pytest.mark.parametrize("num_splits", [1, 2, 7, 1000])
+def test_get_split_ranges(tmp_path, monkeypatch, num_splits):
+    # lines longer than a probe are looked through in more than one read
+    monkeypatch.setattr(parallel_parse, "_line_probe_bytes", 4)
+    lines = [b"a" * n + b"\n" for n in [0, 3, 20, 1, 50, 7, 0, 12]]
+    path = os.path.join(tmp_path, "lines.csv")
+    with open(path, "wb") as f:
+        f.write(b"".join(lines))
+    size = os.path.getsize(path)
+    ranges = get_split_ranges(path, size, num_splits)
+    assert ranges[0][0] == 0
+    assert ranges[-1][1] == size
+    assert len(ranges) <= num_splits
+    with open(path, "rb") as f:
+        data = f.read()
+    for (start, end), (next_start, _) in zip(ranges, ranges[1:]):
+        assert end == next_start
+        assert data[end - 1 : end] == b"\n"
+
+
+@pytest.mark.parametrize("ff", ["csv", "jsonl"])
+def test_parse_in_splits(tmp_path, ff):
+    path = os.path.join(tmp_path, f"all_types.{ff}")
+    size = _write_big_file(path)
+    file_format = FileFormat.from_string(ff)
+    cast_plan = _get_cast_plan()
+    with ThreadPoolExecutor(4) as executor:
+        df = parse_in_splits(path, size, file_format, executor, 4, cast_plan)
+    # as the whole file would be read and cast
+    assert_frame_equal(df, cast_plan.cast_df(reader.read(path)))
+
+
+def test_parse_in_splits_columns(tmp_path):
+    path = os.path.join(tmp_path, "all_types.csv")
+    size = _write_big_file(path)
+    columns = ["i", "my_int"]
+    cast_plan = _get_cast_plan(columns)
+    with ThreadPoolExecutor(3) as executor:
+        df = parse_in_splits(
+            path, size, FileFormat.CSV, executor, 3, cast_plan, columns
+        )
+    assert list(df.columns) == columns
+    assert df["i"].tolist() == list(range(10)) * 30
+
+
+def test_parse_in_splits_s3(s3_bucket, tmp_path):
+    path = os.path.join(tmp_path, "all_types.csv")
+    _write_big_file(path)
+    s3_path = f"{s3_bucket}/land/all_types.csv"
+    writer.write(reader.read(path), s3_path)
+    size = _get_file_size(s3_path)
+    # each part is read with a ranged GET
+    with ThreadPoolExecutor(2) as executor:
+        df = parse_in_splits(
+            s3_path, size, FileFormat.CSV, executor, 4, _get_cast_plan()
+        )
+    assert df.shape == (300, 8)
+    assert df["i"].tolist() == list(range(10)) * 30
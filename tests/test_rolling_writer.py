@@ -0,0 +1,332 @@
+import os
+import pytest
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from arrow_pd_parser import reader
+from mojap_metadata import Metadata
+from pandas.testing import assert_frame_equal
+from s3_data_packer import rolling_writer as rolling_writer_module
+from s3_data_packer.rolling_writer import ParquetWriteOptions, RollingFileWriter
+from tests.helpers import setup_output_store, data_maker
+
+
+@pytest.mark.parametrize("ff", ["csv", "jsonl", "parquet", "snappy.parquet"])
+@pytest.mark.parametrize(
+    "file_limit_gigabytes,initial_batch_rows", [(1, 10), (20 * 10**-6, 50)]
+)
+def test_rolling_writer_bytes_written(
+    tmp_path, ff, file_limit_gigabytes, initial_batch_rows
+):
+    output_store = setup_output_store(
+        tmp_path, file_limit_gigabytes=file_limit_gigabytes
+    )
+    output_store.table_extension = ff
+    with RollingFileWriter(
+        output_store, initial_batch_rows=initial_batch_rows
+    ) as rolling_writer:
+        rolling_writer.write(data_maker(500))
+
+    sizes = [os.path.getsize(f) for f in rolling_writer.files_written]
+    assert rolling_writer.rows_written == 500
+    assert rolling_writer.bytes_written == sum(sizes)
+    assert output_store.filenum == len(rolling_writer.files_written)
+
+
+@pytest.mark.parametrize(
+    "ff,file_limit_gigabytes", [("csv", 20 * 10**-6), ("parquet", 3 * 10**-6)]
+)
+def test_rolling_writer_rolls_over(tmp_path, ff, file_limit_gigabytes):
+    output_store = setup_output_store(
+        tmp_path, file_limit_gigabytes=file_limit_gigabytes
+    )
+    output_store.table_extension = ff
+    df = data_maker(1000)
+    with RollingFileWriter(output_store, initial_batch_rows=50) as rolling_writer:
+        rolling_writer.write(df)
+
+    # files are numbered in order from the store's filenum
+    expected_files = [
+        os.path.join(tmp_path, "db/all_types", f"all_types_{i}.{ff}")
+        for i in range(len(rolling_writer.files_written))
+    ]
+    assert len(expected_files) > 1
+    assert rolling_writer.files_written == expected_files
+
+    # every file but the last was only closed once it was near the limit
+    for f in rolling_writer.files_written[:-1]:
+        assert os.path.getsize(f) >= rolling_writer.file_limit_bytes / 2
+
+    # and every row ends up written exactly once, in order
+    out_df = pd.concat([reader.read(f) for f in rolling_writer.files_written])
+    assert_frame_equal(out_df.reset_index(drop=True), df.reset_index(drop=True))
+
+
+@pytest.mark.parametrize("ff", ["csv", "jsonl"])
+def test_rolling_writer_append(tmp_path, ff):
+    output_store = setup_output_store(
+        tmp_path, {"tests/data/all_types.csv": [f"db/all_types/all_types_0.{ff}"]}
+    )
+    output_store.table_extension = ff
+    existing_path = os.path.join(tmp_path, f"db/all_types/all_types_0.{ff}")
+    existing_size = os.path.getsize(existing_path)
+    with RollingFileWriter(output_store, append=True) as rolling_writer:
+        rolling_writer.write(data_maker(10))
+
+    # the rows are added to the end of the existing file, under its header
+    assert rolling_writer.files_written == [existing_path]
+    new_bytes = os.path.getsize(existing_path) - existing_size
+    assert rolling_writer.bytes_written == new_bytes
+    assert reader.read(existing_path)["i"].tolist() == list(range(10)) * 2
+
+
+def test_rolling_writer_append_parquet(tmp_path):
+    output_store = setup_output_store(tmp_path)
+    output_store.table_extension = "parquet"
+    with pytest.raises(ValueError):
+        RollingFileWriter(output_store, append=True)
+
+
+def test_rolling_writer_parquet_pandas_dtypes(tmp_path):
+    # the schema from metadata keeps the pandas dtypes of the data written
+    output_store = setup_output_store(tmp_path)
+    output_store.table_extension = "parquet"
+    df = data_maker(50, metadata="tests/data/all_types.json")
+    metadata = Metadata.from_json("tests/data/all_types.json")
+    with RollingFileWriter(output_store, metadata=metadata) as rolling_writer:
+        rolling_writer.write(df)
+
+    out = pd.read_parquet(rolling_writer.files_written[0])
+    cols = ["i", "my_bool", "my_nullable_bool", "my_int", "my_string"]
+    assert_frame_equal(out[cols], df[cols].reset_index(drop=True))
+    assert str(out["my_int"].dtype) == "Int64"
+
+
+@pytest.mark.parametrize("ff", ["csv", "jsonl"])
+@pytest.mark.parametrize("num_rows", [10, 100, 1000])
+def test_sample_bytes_per_row(tmp_path, ff, num_rows):
+    output_store = setup_output_store(tmp_path)
+    output_store.table_extension = ff
+    df = data_maker(num_rows)
+    with RollingFileWriter(output_store) as rolling_writer:
+        estimate = rolling_writer._sample_bytes_per_row(df)
+        rolling_writer.write(df)
+    # headers aside, text rows sample close to what they're written as
+    assert estimate == pytest.approx(rolling_writer.bytes_per_row, rel=0.2)
+
+
+@pytest.mark.parametrize("ff", ["csv", "jsonl"])
+@pytest.mark.parametrize("size_tolerance", [0.01, 0.05, 0.2])
+def test_rolling_writer_size_tolerance(tmp_path, ff, size_tolerance):
+    output_store = setup_output_store(tmp_path, file_limit_gigabytes=20 * 10**-6)
+    output_store.table_extension = ff
+    with RollingFileWriter(
+        output_store, initial_batch_rows=50, size_tolerance=size_tolerance
+    ) as rolling_writer:
+        rolling_writer.write(data_maker(2000))
+
+    # every file but the last lands within the tolerance of the limit
+    for f in rolling_writer.files_written[:-1]:
+        assert os.path.getsize(f) == pytest.approx(
+            rolling_writer.file_limit_bytes, rel=size_tolerance
+        )
+
+
+@pytest.mark.parametrize("ff", ["csv", "jsonl", "parquet"])
+def test_rolling_writer_skewed_rows(tmp_path, ff):
+    output_store = setup_output_store(tmp_path, file_limit_gigabytes=10**-3)
+    output_store.table_extension = ff
+    # narrow rows, then rows hundreds of times wider that don't compress
+    wide = [os.urandom(250).hex() for _ in range(4000)]
+    df = pd.DataFrame({"s": ["a"] * 200000 + wide})
+    with RollingFileWriter(output_store) as rolling_writer:
+        rolling_writer.write(df)
+
+    # the wide rows are measured as they come, so no file goes far over the limit
+    for f in rolling_writer.files_written:
+        assert os.path.getsize(f) <= rolling_writer.file_limit_bytes * 1.05
+    rows = [reader.read(f).shape[0] for f in rolling_writer.files_written]
+    assert sum(rows) == rolling_writer.rows_written == df.shape[0]
+
+
+@pytest.mark.parametrize("widths", ["narrow", "skewed"])
+def test_rolling_writer_fills_parquet_files(tmp_path, widths):
+    output_store = setup_output_store(tmp_path, file_limit_gigabytes=2 * 10**-4)
+    output_store.table_extension = "parquet"
+    if widths == "narrow":
+        df = pd.DataFrame({"i": range(100000), "x": [i % 97 for i in range(100000)]})
+    else:
+        wide = [os.urandom(20).hex() for _ in range(5000)]
+        df = pd.DataFrame({"s": ["a"] * 20000 + wide})
+    with RollingFileWriter(output_store) as rolling_writer:
+        for start in range(0, df.shape[0], 5000):
+            rolling_writer.write(df.iloc[start : start + 5000])
+
+    # the rows held back for a row group are measured before a file's rolled, so
+    # they land within the tolerance of the limit, rather than either side of it
+    sizes = [os.path.getsize(f) for f in rolling_writer.files_written]
+    assert len(sizes) > 1
+    assert max(sizes) <= rolling_writer.file_limit_bytes
+    for size in sizes[:-1]:
+        assert size >= rolling_writer.file_limit_bytes * 0.95
+
+
+def test_rolling_writer_fills_first_parquet_file(tmp_path):
+    output_store = setup_output_store(tmp_path, file_limit_gigabytes=20 * 10**-6)
+    output_store.table_extension = "parquet"
+    with RollingFileWriter(output_store) as rolling_writer:
+        rolling_writer.write(data_maker(6000))
+
+    # the first estimate, from small samples, is well over what the rows take up,
+    # but they're measured before the file's taken to be full
+    assert len(rolling_writer.files_written) == 1
+    assert rolling_writer.bytes_written <= rolling_writer.file_limit_bytes
+
+
+def test_rolling_writer_given_bytes_per_row(tmp_path, monkeypatch):
+    output_store = setup_output_store(tmp_path)
+    output_store.table_extension = "csv"
+    rolling_writer = RollingFileWriter(output_store, bytes_per_row=60.0)
+    # a known estimate is used rather than sampling the data again
+    monkeypatch.setattr(rolling_writer, "_sample_bytes_per_row", None)
+    assert rolling_writer.bytes_per_row == 60.0
+    with rolling_writer:
+        rolling_writer.write(data_maker(100))
+    assert rolling_writer.bytes_per_row == (
+        rolling_writer.bytes_written / rolling_writer.rows_written
+    )
+
+
+@pytest.mark.parametrize(
+    "parquet_options,expected_row_group_rows",
+    [
+        (ParquetWriteOptions(), [300]),
+        (ParquetWriteOptions(row_group_rows=120), [120, 120, 60]),
+        (ParquetWriteOptions(row_group_rows=1000), [300]),
+    ],
+)
+def test_rolling_writer_row_groups(tmp_path, parquet_options, expected_row_group_rows):
+    output_store = setup_output_store(tmp_path)
+    output_store.table_extension = "parquet"
+    with RollingFileWriter(
+        output_store, parquet_options=parquet_options
+    ) as rolling_writer:
+        # written in small pieces, as chunks would be
+        for _ in range(6):
+            rolling_writer.write(data_maker(50))
+
+    parquet_file = pq.ParquetFile(rolling_writer.files_written[0])
+    row_group_rows = [
+        parquet_file.metadata.row_group(i).num_rows
+        for i in range(parquet_file.num_row_groups)
+    ]
+    assert row_group_rows == expected_row_group_rows
+    assert rolling_writer.bytes_written == os.path.getsize(
+        rolling_writer.files_written[0]
+    )
+
+
+def test_rolling_writer_default_row_groups(tmp_path, monkeypatch):
+    monkeypatch.setattr(rolling_writer_module, "_default_row_group_rows", 120)
+    output_store = setup_output_store(tmp_path)
+    output_store.table_extension = "parquet"
+    with RollingFileWriter(output_store, initial_batch_rows=70) as rolling_writer:
+        for _ in range(6):
+            rolling_writer.write(data_maker(50))
+
+    # the pieces are put together into row groups of the default size, not one each
+    metadata = pq.ParquetFile(rolling_writer.files_written[0]).metadata
+    row_group_rows = [
+        metadata.row_group(i).num_rows for i in range(metadata.num_row_groups)
+    ]
+    assert row_group_rows == [120, 120, 60]
+
+
+def test_rolling_writer_max_buffer_bytes(tmp_path):
+    output_store = setup_output_store(tmp_path)
+    output_store.table_extension = "parquet"
+    with RollingFileWriter(output_store, max_buffer_bytes=4000) as rolling_writer:
+        rolling_writer.write(data_maker(300))
+
+    # row groups are written once the rows held take up the buffer's bytes, not
+    # only at the default rows
+    parquet_file = pq.ParquetFile(rolling_writer.files_written[0])
+    row_groups = [
+        parquet_file.read_row_group(i) for i in range(parquet_file.num_row_groups)
+    ]
+    assert len(row_groups) > 1
+    assert sum(t.num_rows for t in row_groups) == 300
+    assert all(t.nbytes <= 4000 * 1.1 for t in row_groups)
+
+
+def test_rolling_writer_row_group_bytes(tmp_path):
+    output_store = setup_output_store(tmp_path)
+    output_store.table_extension = "parquet"
+    parquet_options = ParquetWriteOptions(row_group_bytes=2000)
+    with RollingFileWriter(
+        output_store, parquet_options=parquet_options, bytes_per_row=20.0
+    ) as rolling_writer:
+        for _ in range(10):
+            rolling_writer.write(data_maker(30))
+
+    parquet_file = pq.ParquetFile(rolling_writer.files_written[0])
+    # row groups are sized from the bytes per row, rather than each write
+    assert parquet_file.num_row_groups < 10
+    assert parquet_file.metadata.num_rows == 300
+
+
+def test_rolling_writer_parquet_options(tmp_path):
+    output_store = setup_output_store(tmp_path)
+    output_store.table_extension = "parquet"
+    parquet_options = ParquetWriteOptions(
+        compression="zstd",
+        compression_level=9,
+        use_dictionary=["my_string"],
+        write_statistics=["i"],
+        data_page_size=2**16,
+        sort_row_groups_by=["my_float", "i"],
+    )
+    df = data_maker(100)
+    with RollingFileWriter(
+        output_store, parquet_options=parquet_options
+    ) as rolling_writer:
+        rolling_writer.write(df)
+
+    parquet_file = pq.ParquetFile(rolling_writer.files_written[0])
+    row_group = parquet_file.metadata.row_group(0)
+    columns = {
+        row_group.column(i).path_in_schema: row_group.column(i)
+        for i in range(row_group.num_columns)
+    }
+    assert columns["i"].compression == "ZSTD"
+    assert columns["i"].is_stats_set
+    assert not columns["my_float"].is_stats_set
+    assert "RLE_DICTIONARY" in columns["my_string"].encodings
+    assert "RLE_DICTIONARY" not in columns["i"].encodings
+
+    # and the rows are sorted within the row group
+    out_df = reader.read(rolling_writer.files_written[0])
+    expected_df = df.sort_values(["my_float", "i"], kind="stable")
+    assert out_df["i"].tolist() == expected_df["i"].tolist()
+
+
+@pytest.mark.parametrize("ff", ["csv", "parquet"])
+@pytest.mark.parametrize("pieces", [1, 30])
+def test_rolling_writer_cluster_by(tmp_path, ff, pieces):
+    output_store = setup_output_store(tmp_path, file_limit_gigabytes=2 * 10**-6)
+    output_store.table_extension = ff
+    df = data_maker(300).sort_values("i", kind="stable").reset_index(drop=True)
+    with RollingFileWriter(
+        output_store, bytes_per_row=30.0, cluster_by=["i"]
+    ) as rolling_writer:
+        for piece in range(pieces):
+            rows = len(df) // pieces
+            rolling_writer.write(df.iloc[piece * rows : (piece + 1) * rows])
+
+    files = [reader.read(f)["i"].tolist() for f in rolling_writer.files_written]
+    assert len(files) > 1
+    assert [i for f in files for i in f] == df["i"].tolist()
+    # each value of i is in only one file
+    for f, next_f in zip(files, files[1:]):
+        assert max(f) < min(next_f)
@@ -0,0 +1,45 @@
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from s3_data_packer.constants import aws_region
+from s3_data_packer.s3_client import configure_s3_client, get_s3_client
+
+
+@pytest.fixture(autouse=True)
+def reset_s3_client():
+    configure_s3_client()
+    yield
+    configure_s3_client()
+
+
+def test_s3_client_shared():
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        clients = list(executor.map(lambda _: get_s3_client(), range(32)))
+    assert all(c is clients[0] for c in clients)
+    assert clients[0].meta.region_name == aws_region
+
+
+@pytest.mark.parametrize(
+    "max_pool_connections,retry_mode,max_attempts",
+    [(10, "standard", 3), (100, "adaptive", 8)],
+)
+def test_configure_s3_client(max_pool_connections, retry_mode, max_attempts):
+    first_client = get_s3_client()
+    configure_s3_client(max_pool_connections, retry_mode, max_attempts)
+    client = get_s3_client()
+    assert client is not first_client
+    assert client.meta.config.max_pool_connections == max_pool_connections
+    assert client.meta.config.retries["mode"] == retry_mode
+    assert client.meta.config.retries["total_max_attempts"] == max_attempts
+
+
+def test_s3_client_factory():
+    made = []
+
+    def factory():
+        made.append(object())
+        return made[-1]
+
+    configure_s3_client(client_factory=factory)
+    assert get_s3_client() is get_s3_client() is made[0]
+    assert len(made) == 1
@@ -1,14 +1,22 @@
+import datetime
 import os
 import pytest
-import tempfile
 
 import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
 
-from arrow_pd_parser import writer, reader
+from arrow_pd_parser import reader, writer
 from pandas.testing import assert_frame_equal
 from mojap_metadata.metadata.metadata import Metadata
 from arrow_pd_parser.caster import cast_pandas_table_to_schema
-from helpers import setup_packer, data_maker
+from helpers import setup_packer, data_maker, write_file_map
+from s3_data_packer import parallel_parse, s3_data_packer
+from s3_data_packer.manifest import PackManifest
+from s3_data_packer.output_commit import OutputCommit
+from s3_data_packer.rolling_writer import ParquetWriteOptions
+from s3_data_packer.s3_data_packer import S3DataPacker, _get_frame_bytes
 
 
 @pytest.mark.parametrize(
@@ -115,49 +123,6 @@ def test_append_files(
     assert_frame_equal(pp._append_files(), expected_output_df)
 
 
-@pytest.mark.parametrize("data_size", [1, 3, 10, 100, 1000, 10000])
-# No jsonl as there are issues with pandas and jsonl
-@pytest.mark.parametrize("data_format", ["csv", "parquet", "snappy.parquet"])
-@pytest.mark.parametrize("metadata", [True, False])
-def test_set_file_size_on_disk(tmp_path, data_size, data_format, metadata):
-    # get metadata if required
-    metadata = "tests/data/all_types.json" if metadata else None
-    # setup packer
-    pp = setup_packer(tmp_path, metadata=metadata)
-    pp.output_store.table_extension = data_format
-    # get the dataframe
-    df = data_maker(data_size, metadata=metadata)
-    # write to disk and get size from os.path.getsize
-    with tempfile.NamedTemporaryFile(suffix=f".{data_format}") as f:
-        writer.write(df, f.name)
-        expected_file_size = round(os.path.getsize(f.name) * 10**-9, 9)
-    # get the file size on disk according to s3_data_packer
-    pp._set_file_size_on_disk(df)
-    # asssert!
-    assert round(pp.file_size_on_disk, 9) == expected_file_size
-
-
-@pytest.mark.parametrize(
-    "file_limit_gigabytes, df, expected_chunk_increments",
-    [  # input scenario 1: large (ish) input file, small file size limit
-        (5 * 10**-6, data_maker(120), ([0, 82], [82, 120])),
-        # input scenario 2: large file, large file limit
-        (1, data_maker(120), ([0], [120])),
-        # input scenario 3: one line file
-        (1, data_maker(1), ([0], [1])),
-    ],
-)
-def test_get_chunk_increments(
-    tmp_path,
-    file_limit_gigabytes,
-    df,
-    expected_chunk_increments,
-):
-    pp = setup_packer(tmp_path, file_limit_gigabytes=file_limit_gigabytes)
-    pp._set_file_size_on_disk(df)
-    assert pp._get_chunk_increments() == expected_chunk_increments
-
-
 @pytest.mark.parametrize(
     """
     input_filemap,output_filemap,total_lines
@@ -253,3 +218,957 @@ def test_packed_data(
         df.sort_values("i").reset_index(drop=True),
         data_maker(total_lines).sort_values("i").reset_index(drop=True),
     )
+
+
+@pytest.mark.parametrize(
+    """
+    input_filemap,output_filemap,total_lines
+    """,
+    [
+        # scenario 1: multiple data in, no existing output
+        (
+            {
+                "tests/data/all_types.csv": [
+                    "land/all_types/all_types_a.snappy.parquet",
+                    "land/all_types/all_types_b.snappy.parquet",
+                ]
+            },
+            {},
+            20,
+        ),
+        # scenario 2: multi in, existing output
+        (
+            {
+                "tests/data/all_types.csv": [
+                    "land/all_types/all_types_a.snappy.parquet",
+                    "land/all_types/all_types_b.snappy.parquet",
+                ]
+            },
+            {"tests/data/all_types.csv": ["db/all_types/all_types_0.snappy.parquet"]},
+            30,
+        ),
+    ],
+)
+@pytest.mark.parametrize("file_limit_gigabytes", [1, 6 * 10**-6])
+@pytest.mark.parametrize("chunksize", [5, "1MB", None])
+def test_packed_data_arrow_engine(
+    tmp_path,
+    input_filemap,
+    output_filemap,
+    total_lines,
+    file_limit_gigabytes,
+    chunksize,
+):
+    pp = setup_packer(
+        tmp_path,
+        input_filemap,
+        output_filemap,
+        file_limit_gigabytes=file_limit_gigabytes,
+        read_chunksize=chunksize,
+        engine="arrow",
+    )
+    pp.pack_data()
+    output_basepath = os.path.join(tmp_path, "db/all_types/")
+    out_files = [os.path.join(output_basepath, f) for f in os.listdir(output_basepath)]
+    df = pd.concat([reader.read(f) for f in out_files])
+
+    assert_frame_equal(
+        df.sort_values("i").reset_index(drop=True),
+        data_maker(total_lines).sort_values("i").reset_index(drop=True),
+    )
+
+
+def test_append_files_arrow_engine(tmp_path):
+    pp = setup_packer(
+        tmp_path,
+        {"tests/data/all_types.csv": ["land/all_types/all_types.parquet"]},
+        metadata="tests/data/all_types.json",
+        engine="arrow",
+        input_file_ext="parquet",
+        cast_parquet=True,
+    )
+    total_table = pp._append_files()
+    assert isinstance(total_table, pa.Table)
+    assert total_table.num_rows == 10
+    assert total_table.schema.field("my_datetime").type == pa.timestamp("s")
+
+
+@pytest.mark.parametrize(
+    "ff,append_strategy", [("csv", None), ("parquet", None), ("parquet", "append")]
+)
+def test_pack_data_append_strategy(tmp_path, ff, append_strategy):
+    pp = setup_packer(
+        tmp_path,
+        {"tests/data/all_types.csv": [f"land/all_types/all_types.{ff}"]},
+        {"tests/data/all_types.csv": [f"db/all_types/all_types_0.{ff}"]},
+        output_file_ext=ff,
+        append_strategy=append_strategy,
+    )
+    existing_path = os.path.join(tmp_path, f"db/all_types/all_types_0.{ff}")
+    existing_mtime = os.path.getmtime(existing_path)
+    pp.pack_data()
+    out_files = sorted(os.listdir(os.path.join(tmp_path, "db/all_types")))
+    if append_strategy == "append":
+        # the latest parquet file is left alone and the next one started
+        assert out_files == ["all_types_0.parquet", "all_types_1.parquet"]
+        assert os.path.getmtime(existing_path) == existing_mtime
+    else:
+        # by default csv rows are added to the end of the latest file, and parquet
+        # files are rewritten with them
+        assert out_files == [f"all_types_0.{ff}"]
+        assert reader.read(existing_path)["i"].tolist() == list(range(10)) * 2
+
+
+@pytest.mark.parametrize("engine", ["pandas", "arrow"])
+def test_pack_data_result(tmp_path, engine):
+    spans = []
+    pp = setup_packer(
+        tmp_path,
+        {"tests/data/all_types.csv": ["land/all_types/all_types.csv"]},
+        {"tests/data/all_types.csv": ["db/all_types/all_types_0.csv"]},
+        output_file_ext="csv",
+        engine=engine,
+        metadata="tests/data/all_types.json",
+        append_strategy="rewrite",
+        use_manifest=True,
+        on_span=spans.append,
+    )
+    result = pp.pack_data()
+    assert result.table_name == "all_types"
+    assert result.rows_written == 20
+    assert result.bytes_written == pp.bytes_written
+    # the latest file is rewritten with the new rows added
+    assert result.files_overwritten == [
+        os.path.join(tmp_path, "db/all_types/all_types_0.csv")
+    ]
+    assert result.files_created == []
+    assert set(result.phase_seconds) == {
+        "pack",
+        "read",
+        "cast",
+        "concat",
+        "size_probe",
+        "write",
+        "manifest",
+    }
+    # the input and the file being rewritten
+    assert result.phase_calls["read"] == 2
+    assert result.s3_requests == {}
+    assert sum(result.phase_seconds.values()) <= result.duration_seconds
+    # the pack's span ends last, and covers the others
+    assert spans[-1].name == "pack"
+    assert spans[-1].attributes == {"table": "all_types"}
+    assert len(spans) == sum(result.phase_calls.values())
+
+
+@pytest.mark.parametrize("ff", ["csv", "parquet"])
+@pytest.mark.parametrize("engine", ["pandas", "arrow"])
+def test_pack_chunked_data_one_writer(tmp_path, ff, engine):
+    pp = setup_packer(
+        tmp_path,
+        {
+            "tests/data/all_types.csv": [
+                f"land/all_types/all_types_a.{ff}",
+                f"land/all_types/all_types_b.{ff}",
+            ]
+        },
+        output_file_ext=ff,
+        read_chunksize=3,
+        engine=engine,
+    )
+    pp.pack_data()
+    # all the chunks are written into the first file, without reading it back in
+    out_files = os.listdir(os.path.join(tmp_path, "db/all_types"))
+    assert out_files == [f"all_types_0.{ff}"]
+    out_df = reader.read(os.path.join(tmp_path, "db/all_types", out_files[0]))
+    assert out_df["i"].tolist() == list(range(10)) * 2
+    assert pp.output_store.latest_file.endswith(f"all_types_0.{ff}")
+
+
+def read_partitions(tmp_path) -> dict:
+    # the rows of each partition's files, by partition folder and file name
+    output_path = os.path.join(tmp_path, "db/all_types")
+    return {
+        (partition, f): reader.read(os.path.join(output_path, partition, f))
+        for partition in sorted(os.listdir(output_path))
+        for f in sorted(os.listdir(os.path.join(output_path, partition)))
+    }
+
+
+@pytest.mark.parametrize("ff", ["csv", "parquet"])
+@pytest.mark.parametrize("engine", ["pandas", "arrow"])
+@pytest.mark.parametrize("chunksize", [3, None])
+@pytest.mark.parametrize("max_workers", [1, 2])
+def test_pack_partitioned_data(tmp_path, ff, engine, chunksize, max_workers):
+    input_map = {
+        "tests/data/all_types.csv": [
+            f"land/all_types/all_types_a.{ff}",
+            f"land/all_types/all_types_b.{ff}",
+        ]
+    }
+    pp = setup_packer(
+        tmp_path,
+        input_map,
+        output_file_ext=ff,
+        metadata="tests/data/all_types.json",
+        cast_parquet=True,
+        partition_by="my_bool",
+        engine=engine,
+        read_chunksize=chunksize,
+        max_workers=max_workers,
+    )
+    pp.pack_data()
+    partitions = read_partitions(tmp_path)
+    assert list(partitions) == [
+        ("my_bool=False", f"all_types_0.{ff}"),
+        ("my_bool=True", f"all_types_0.{ff}"),
+    ]
+    expected = data_maker(10)
+    for (partition, _), df in partitions.items():
+        # the partition column is in the path rather than the files
+        assert "my_bool" not in df.columns
+        is_true = partition == "my_bool=True"
+        expected_i = expected[expected["my_bool"] == is_true]["i"].tolist()
+        assert df["i"].tolist() == expected_i * 2
+
+
+def test_pack_partitioned_data_numbered_by_partition(tmp_path):
+    input_map = {"tests/data/all_types.csv": ["land/all_types/all_types_a.csv"]}
+    pp = setup_packer(
+        tmp_path,
+        input_map,
+        output_file_ext="csv",
+        partition_by="my_bool",
+        file_limit_gigabytes=300 * 10**-9,
+    )
+    pp.pack_data()
+    # each partition's files are numbered, and rolled over, on their own
+    files = list(read_partitions(tmp_path))
+    false_files = [f for p, f in files if p == "my_bool=False"]
+    true_files = [f for p, f in files if p == "my_bool=True"]
+    assert false_files == [f"all_types_{i}.csv" for i in range(len(false_files))]
+    assert true_files == [f"all_types_{i}.csv" for i in range(len(true_files))]
+    assert len(true_files) > len(false_files)
+
+    # and a later run adds to each partition's latest file
+    pp = setup_packer(
+        tmp_path,
+        input_map,
+        output_file_ext="csv",
+        partition_by="my_bool",
+        file_limit_gigabytes=1,
+    )
+    pp.input_store.refresh()
+    pp.pack_data()
+    assert list(read_partitions(tmp_path)) == files
+    rows = sum(df.shape[0] for df in read_partitions(tmp_path).values())
+    assert rows == 20
+
+
+def test_partition_by_and_output_partition(tmp_path):
+    with pytest.raises(ValueError):
+        setup_packer(tmp_path, partition_by="my_bool", output_partition={"a": "b"})
+
+
+@pytest.mark.parametrize("input_ff", ["csv", "jsonl", "parquet"])
+@pytest.mark.parametrize("engine", ["pandas", "arrow"])
+def test_pack_data_max_memory_bytes(tmp_path, input_ff, engine):
+    input_path = os.path.join(tmp_path, f"land/all_types/all_types.{input_ff}")
+    os.makedirs(os.path.dirname(input_path))
+    writer.write(data_maker(2000), input_path)
+    pp = setup_packer(
+        tmp_path, output_file_ext="parquet", engine=engine, max_memory_bytes=8 * 10**4
+    )
+    # the input is split into chunks sized by bytes, whatever its format, and read
+    # as the engine reads without a memory limit
+    chunks = list(pp._get_dataframes())
+    frame_type = pa.Table if engine == "arrow" else pd.DataFrame
+    assert all(isinstance(c, frame_type) for c in chunks)
+    assert len(chunks) > 1
+    assert max(_get_frame_bytes(c) for c in chunks) <= 1.25 * pp.max_memory_bytes / 8
+
+    pp.pack_data()
+    out_path = os.path.join(tmp_path, "db/all_types/all_types_0.parquet")
+    assert reader.read(out_path)["i"].tolist() == list(range(10)) * 200
+    # and row groups are written as the rows held for them reach the same share of
+    # the budget, rather than all at close
+    parquet_file = pq.ParquetFile(out_path)
+    assert parquet_file.num_row_groups > 1
+    for i in range(parquet_file.num_row_groups):
+        row_group = parquet_file.read_row_group(i)
+        assert row_group.nbytes <= 1.25 * pp.max_memory_bytes / 8
+
+
+@pytest.mark.parametrize("chunksize", [3, None])
+def test_pack_data_parquet_options(tmp_path, chunksize):
+    pp = setup_packer(
+        tmp_path,
+        {"tests/data/all_types.csv": ["land/all_types/all_types.csv"]},
+        output_file_ext="parquet",
+        metadata="tests/data/all_types.json",
+        read_chunksize=chunksize,
+        parquet_options=ParquetWriteOptions(compression="zstd", row_group_rows=4),
+    )
+    pp.pack_data()
+    parquet_file = pq.ParquetFile(pp.files_written[0])
+    assert parquet_file.metadata.row_group(0).column(0).compression == "ZSTD"
+    row_group_rows = [
+        parquet_file.metadata.row_group(i).num_rows
+        for i in range(parquet_file.num_row_groups)
+    ]
+    assert row_group_rows == [4, 4, 2]
+
+
+def test_invalid_append_strategy(tmp_path):
+    with pytest.raises(ValueError):
+        setup_packer(tmp_path, append_strategy="merge")
+
+
+def test_invalid_engine(tmp_path):
+    with pytest.raises(ValueError):
+        setup_packer(tmp_path, engine="polars")
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+@pytest.mark.parametrize("max_bytes_in_flight", [None, 1])
+@pytest.mark.parametrize("engine", ["pandas", "arrow"])
+def test_get_input_files_concurrent(tmp_path, max_workers, max_bytes_in_flight, engine):
+    input_files = [f"land/all_types/all_types_{i}.parquet" for i in range(12)]
+    pp = setup_packer(
+        tmp_path,
+        {"tests/data/all_types.csv": input_files},
+        max_workers=max_workers,
+        max_bytes_in_flight=max_bytes_in_flight,
+        engine=engine,
+    )
+    serial_pp = setup_packer(tmp_path, engine=engine)
+    tables = pp._get_input_files()
+    serial_tables = serial_pp._get_input_files()
+    assert len(tables) == len(input_files)
+    for table, serial_table in zip(tables, serial_tables):
+        assert table.equals(serial_table)
+
+
+@pytest.mark.parametrize("sort_option", ["sort_by", "cluster_by"])
+@pytest.mark.parametrize("max_memory_bytes", [None, 10**4])
+@pytest.mark.parametrize("output_ff", ["csv", "jsonl"])
+def test_pack_data_sorted(tmp_path, sort_option, max_memory_bytes, output_ff):
+    input_map = {
+        "tests/data/all_types.csv": [
+            f"land/all_types/all_types_{n}.csv" for n in range(20)
+        ]
+    }
+    output_map = {"tests/data/all_types.csv": [f"db/all_types/all_types_0.{output_ff}"]}
+    pp = setup_packer(
+        tmp_path,
+        input_map,
+        output_map,
+        output_file_ext=output_ff,
+        metadata="tests/data/all_types.json",
+        file_limit_gigabytes=3 * 10**-6,
+        max_memory_bytes=max_memory_bytes,
+        sort_spill_dir=str(tmp_path),
+        **{sort_option: ["i", "my_int"]},
+    )
+    pp.pack_data()
+
+    # the existing file is left as it is
+    assert pp.files_written[0].endswith(f"all_types_1.{output_ff}")
+    files = [reader.read(f) for f in pp.files_written]
+    assert len(files) > 1
+    out = pd.concat(files)
+    assert out["i"].tolist() == sorted([i for i in range(10)] * 20)
+    for df in files:
+        assert df["i"].is_monotonic_increasing
+    for df, next_df in zip(files, files[1:]):
+        if sort_option == "sort_by":
+            assert df["i"].max() <= next_df["i"].min()
+        else:
+            assert df["i"].max() < next_df["i"].min()
+
+
+def test_sort_by_and_cluster_by(tmp_path):
+    with pytest.raises(ValueError):
+        setup_packer(tmp_path, sort_by=["i"], cluster_by=["i"])
+
+
+@pytest.mark.parametrize("input_ff", ["csv", "jsonl", "parquet"])
+@pytest.mark.parametrize("engine", ["pandas", "arrow"])
+@pytest.mark.parametrize("chunksize", [3, None])
+@pytest.mark.parametrize("metadata", ["tests/data/all_types.json", None])
+def test_pack_data_columns_and_filter(tmp_path, input_ff, engine, chunksize, metadata):
+    pp = setup_packer(
+        tmp_path,
+        {
+            "tests/data/all_types.csv": [
+                f"land/all_types/all_types_a.{input_ff}",
+                f"land/all_types/all_types_b.{input_ff}",
+            ]
+        },
+        output_file_ext="csv",
+        engine=engine,
+        read_chunksize=chunksize,
+        metadata=metadata,
+        cast_parquet=True,
+        columns=["my_string", "i"],
+        filter=pc.field("i") >= 5,
+    )
+    pp.pack_data()
+    out = reader.read(os.path.join(tmp_path, "db/all_types/all_types_0.csv"))
+    assert list(out.columns) == ["my_string", "i"]
+    assert out["i"].tolist() == [5, 6, 7, 8, 9] * 2
+
+
+@pytest.mark.parametrize("input_ff", ["csv", "jsonl", "parquet"])
+@pytest.mark.parametrize("engine", ["pandas", "arrow"])
+@pytest.mark.parametrize("chunksize", [3, None])
+@pytest.mark.parametrize("metadata", ["tests/data/all_types.json", None])
+def test_pack_data_filter_on_other_columns(
+    tmp_path, input_ff, engine, chunksize, metadata
+):
+    # the filter can use columns that aren't kept
+    pp = setup_packer(
+        tmp_path,
+        {"tests/data/all_types.csv": [f"land/all_types/all_types.{input_ff}"]},
+        output_file_ext="csv",
+        engine=engine,
+        read_chunksize=chunksize,
+        metadata=metadata,
+        cast_parquet=True,
+        columns=["i"],
+        filter=pc.field("my_int").is_null(),
+    )
+    pp.pack_data()
+    out = reader.read(os.path.join(tmp_path, "db/all_types/all_types_0.csv"))
+    assert list(out.columns) == ["i"]
+    assert out["i"].tolist() == [0, 5]
+
+
+@pytest.mark.parametrize("chunksize", [3, None])
+def test_read_file_pushdown(tmp_path, chunksize):
+    pp = setup_packer(
+        tmp_path,
+        {"tests/data/all_types.csv": ["land/all_types/all_types.parquet"]},
+        read_chunksize=chunksize,
+        columns=["i"],
+        filter=pc.field("my_int").is_null(),
+    )
+    fp = os.path.join(tmp_path, "land/all_types/all_types.parquet")
+    if chunksize is None:
+        frames = [pp._read_file(fp, "parquet", pushdown=True)]
+    else:
+        frames = list(pp._read_chunked_file(fp, pushdown=True))
+    df = pd.concat(frames)
+    # the filter can use columns that aren't read
+    assert list(df.columns) == ["i"]
+    assert df["i"].tolist() == [0, 5]
+    # files that aren't inputs are read whole
+    assert pp._read_file(fp, "parquet").shape == (10, 8)
+
+
+def test_pack_data_columns_only_read_metadata_columns(tmp_path, monkeypatch):
+    pp = setup_packer(
+        tmp_path,
+        {"tests/data/all_types.csv": ["land/all_types/all_types.csv"]},
+        output_file_ext="csv",
+        metadata="tests/data/all_types.json",
+    )
+    read_kwargs = []
+    read = reader.read
+
+    def read_recorded(*args, **kwargs):
+        read_kwargs.append(kwargs)
+        return read(*args, **kwargs)
+
+    monkeypatch.setattr(reader, "read", read_recorded)
+    pp.pack_data()
+    # only the metadata's columns are kept once cast, so no others are parsed
+    assert read_kwargs[0]["usecols"] == pp.metadata.column_names
+
+
+def test_columns_missing_partition_and_sort_columns(tmp_path):
+    with pytest.raises(ValueError, match="my_bool, i"):
+        setup_packer(
+            tmp_path, columns=["my_int"], partition_by="my_bool", sort_by=["i"]
+        )
+    with pytest.raises(ValueError, match="not in the metadata"):
+        setup_packer(
+            tmp_path, columns=["nope"], metadata="tests/data/all_types.json"
+        )
+
+
+@pytest.mark.parametrize("input_ff", ["csv", "jsonl"])
+def test_pack_data_parse_workers(tmp_path, monkeypatch, input_ff):
+    monkeypatch.setattr(parallel_parse, "_min_split_bytes", 200)
+    parsed = []
+    parse = s3_data_packer.parse_in_splits
+
+    def parse_recorded(*args):
+        parsed.append(args[4])
+        return parse(*args)
+
+    monkeypatch.setattr(s3_data_packer, "parse_in_splits", parse_recorded)
+    input_map = {
+        "tests/data/all_types.csv": [
+            f"land/all_types/all_types_{n}.{input_ff}" for n in range(3)
+        ]
+    }
+    kwargs = {"output_file_ext": "csv", "metadata": "tests/data/all_types.json"}
+    pp = setup_packer(tmp_path, input_map, parse_workers=2, **kwargs)
+    pp.pack_data()
+    assert parsed == [2, 2, 2]
+    serial = setup_packer(tmp_path / "serial", input_map, **kwargs)
+    serial.pack_data()
+    # the same rows, in the same order
+    assert_frame_equal(
+        reader.read(pp.files_written[0]), reader.read(serial.files_written[0])
+    )
+
+
+def test_pack_data_new_packer_finds_new_inputs(tmp_path):
+    input_map = {"tests/data/all_types.csv": ["land/all_types/a.csv"]}
+    setup_packer(tmp_path, input_map, output_file_ext="csv").pack_data()
+    # landed after the first packer listed the table
+    input_map = {"tests/data/all_types.csv": ["land/all_types/b.csv"]}
+    pp = setup_packer(tmp_path, input_map, output_file_ext="csv")
+    assert [os.path.basename(e.path) for e in pp._get_input_entries()] == [
+        "a.csv",
+        "b.csv",
+    ]
+
+
+def _write_land_csv(tmp_path, file_name: str, df: pd.DataFrame) -> str:
+    path = os.path.join(tmp_path, "land/all_types", file_name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_csv(path, index=False)
+    return path
+
+
+@pytest.mark.parametrize("engine", ["pandas", "arrow"])
+@pytest.mark.parametrize("max_memory_bytes", [None, 10**7])
+def test_pack_data_metadata_types(tmp_path, engine, max_memory_bytes):
+    # my_int is empty for more than arrow's first block of the csv, and my_date is
+    # in a format of its own
+    num_rows = 100_000
+    _write_land_csv(
+        tmp_path,
+        "a.csv",
+        pd.DataFrame(
+            {
+                "i": range(num_rows),
+                "my_int": pd.array([None] * (num_rows - 1) + [12], dtype="Int64"),
+                "my_date": ["13/06/2013"] * num_rows,
+            }
+        ),
+    )
+    metadata = {
+        "name": "all_types",
+        "columns": [
+            {"name": "i", "type": "int64"},
+            {"name": "my_int", "type": "int64"},
+            {"name": "my_date", "type": "date64", "datetime_format": "%d/%m/%Y"},
+        ],
+    }
+    pp = setup_packer(
+        tmp_path,
+        metadata=metadata,
+        engine=engine,
+        max_memory_bytes=max_memory_bytes,
+    )
+    pp.pack_data()
+    out = pq.read_table(pp.files_written[0])
+    assert out["my_int"].null_count == num_rows - 1
+    assert out["my_int"][-1].as_py() == 12
+    assert out["my_date"][0].as_py() == datetime.date(2013, 6, 13)
+
+
+@pytest.mark.parametrize("engine", ["pandas", "arrow"])
+def test_pack_data_different_inferred_types(tmp_path, engine):
+    # without metadata, my_string is all null in one file and strings in the other
+    _write_land_csv(tmp_path, "a.csv", pd.DataFrame({"i": [1], "my_string": [None]}))
+    _write_land_csv(tmp_path, "b.csv", pd.DataFrame({"i": [2], "my_string": ["x"]}))
+    pp = setup_packer(tmp_path, output_file_ext="csv", engine=engine)
+    pp.pack_data()
+    out = reader.read(pp.files_written[0])
+    assert out["my_string"].tolist() == [pd.NA, "x"]
+
+
+@pytest.mark.parametrize(
+    "metadata",
+    [
+        None,
+        {
+            "name": "all_types",
+            "columns": [
+                {"name": "i", "type": "int64"},
+                {"name": "my_string", "type": "string"},
+            ],
+        },
+    ],
+)
+def test_pack_data_csv_null_values(tmp_path, metadata):
+    # both engines read the same strings as null
+    outs = []
+    for engine in ["pandas", "arrow"]:
+        engine_path = os.path.join(tmp_path, engine)
+        _write_land_csv(
+            engine_path,
+            "a.csv",
+            pd.DataFrame({"i": range(4), "my_string": ["None", "<NA>", "NA", "x"]}),
+        )
+        pp = setup_packer(engine_path, metadata=metadata, engine=engine)
+        pp.pack_data()
+        outs.append(pq.read_table(pp.files_written[0])["my_string"].to_pylist())
+    assert outs[0] == outs[1] == [None, None, None, "x"]
+
+
+@pytest.mark.parametrize("engine", ["pandas", "arrow"])
+@pytest.mark.parametrize("chunksize", [2, None])
+def test_pack_partitioned_data_null_ints(tmp_path, engine, chunksize):
+    _write_land_csv(
+        tmp_path,
+        "a.csv",
+        pd.DataFrame(
+            {"i": range(5), "p": pd.array([1, None, 2, 1, None], dtype="Int64")}
+        ),
+    )
+    metadata = {
+        "name": "all_types",
+        "columns": [
+            {"name": "i", "type": "int64"},
+            {"name": "p", "type": "int64"},
+        ],
+    }
+    pp = setup_packer(
+        tmp_path,
+        output_file_ext="csv",
+        metadata=metadata,
+        partition_by="p",
+        engine=engine,
+        read_chunksize=chunksize,
+    )
+    pp.pack_data()
+    # both engines name the partitions by the ints, with nulls in the default one
+    partitions = read_partitions(tmp_path)
+    assert {p: df["i"].tolist() for (p, _), df in partitions.items()} == {
+        "p=1": [0, 3],
+        "p=2": [2],
+        "p=__HIVE_DEFAULT_PARTITION__": [1, 4],
+    }
+
+
+def test_compact(tmp_path):
+    # five small files, of which about two fill a file
+    output_map = {
+        "tests/data/all_types.csv": [
+            f"db/all_types/all_types_{n}.csv" for n in range(5)
+        ]
+    }
+    pp = setup_packer(
+        tmp_path,
+        output_file_map=output_map,
+        output_file_ext="csv",
+        file_limit_gigabytes=1500 * 10**-9,
+    )
+    pp.compact()
+
+    output_path = os.path.join(tmp_path, "db/all_types")
+    # the new files are numbered on from the old, which are gone
+    assert pp.files_written == [
+        os.path.join(output_path, f"all_types_{n}.csv") for n in range(5, 8)
+    ]
+    assert sorted(os.listdir(output_path)) == [
+        f"all_types_{n}.csv" for n in range(5, 8)
+    ]
+    out = pd.concat(reader.read(f) for f in pp.files_written)
+    assert out["i"].tolist() == list(range(10)) * 5
+    assert pp.rows_written == 50
+    # nothing is left staged, or waiting to be committed
+    assert os.listdir(os.path.join(tmp_path, "db/_staging/all_types")) == []
+    assert not os.path.exists(os.path.join(tmp_path, "db/all_types.commit.json"))
+    assert pp.output_store.filenum == 7
+
+    # the files are as full as they'll get, so there's nothing more to do
+    pp.compact()
+    assert pp.files_written == []
+
+
+def test_compact_resort(tmp_path):
+    output_map = {
+        "tests/data/all_types.csv": [
+            f"db/all_types/all_types_{n}.csv" for n in range(5)
+        ]
+    }
+    pp = setup_packer(
+        tmp_path,
+        output_file_map=output_map,
+        output_file_ext="csv",
+        file_limit_gigabytes=1500 * 10**-9,
+        cluster_by=["i"],
+    )
+    pp.compact(resort=True)
+    files = [reader.read(f)["i"] for f in pp.files_written]
+    assert pd.concat(files).tolist() == sorted(list(range(10)) * 5)
+    for i, next_i in zip(files, files[1:]):
+        assert i.max() < next_i.min()
+
+    with pytest.raises(ValueError):
+        setup_packer(tmp_path, output_file_ext="csv").compact(resort=True)
+
+
+@pytest.mark.parametrize("engine", ["pandas", "arrow"])
+def test_compact_partitioned(tmp_path, engine):
+    output_map = {
+        "tests/data/all_types.csv": [
+            f"db/all_types/my_bool={b}/all_types_{n}.csv"
+            for b in ["False", "True"]
+            for n in range(3)
+        ]
+    }
+    write_file_map(tmp_path, output_map)
+    # the files have every column, but are cast without the partition column
+    pp = setup_packer(
+        tmp_path,
+        output_file_ext="csv",
+        metadata="tests/data/all_types.json",
+        partition_by="my_bool",
+        engine=engine,
+    )
+    pp.compact()
+    assert list(read_partitions(tmp_path)) == [
+        ("my_bool=False", "all_types_3.csv"),
+        ("my_bool=True", "all_types_3.csv"),
+    ]
+    assert pp.rows_written == 60
+
+
+def test_compact_finishes_interrupted_commit(tmp_path):
+    output_map = {
+        "tests/data/all_types.csv": [
+            "db/all_types/all_types_0.csv",
+            "db/all_types/all_types_1.csv",
+            # staged, and committed, but not moved into the table yet
+            "db/_staging/all_types/all_types_2.csv",
+            # staged by a run that never committed
+            "db/_staging/all_types/all_types_3.csv",
+        ]
+    }
+    # the files are all full, so there's nothing to compact once it's finished
+    pp = setup_packer(
+        tmp_path,
+        output_file_map=output_map,
+        output_file_ext="csv",
+        file_limit_gigabytes=500 * 10**-9,
+    )
+    output_path = os.path.join(tmp_path, "db/all_types")
+    staging_path = os.path.join(tmp_path, "db/_staging/all_types")
+    OutputCommit(
+        pp.output_store._get_commit_path(),
+        {
+            os.path.join(staging_path, "all_types_2.csv"): os.path.join(
+                output_path, "all_types_2.csv"
+            )
+        },
+        [os.path.join(output_path, "all_types_0.csv")],
+    ).write()
+
+    pp.compact()
+    assert os.listdir(staging_path) == []
+    assert sorted(os.listdir(output_path)) == ["all_types_1.csv", "all_types_2.csv"]
+
+
+def test_compact_s3(s3_bucket):
+    for n in range(3):
+        writer.write(data_maker(10), f"{s3_bucket}/db/all_types/all_types_{n}.csv")
+    pp = S3DataPacker(
+        f"{s3_bucket}/land/",
+        f"{s3_bucket}/db/",
+        "all_types",
+        output_file_ext="csv",
+        upload_max_workers=1,
+    )
+    pp.compact()
+    assert pp.files_written == [f"{s3_bucket}/db/all_types/all_types_3.csv"]
+    pp.output_store.refresh()
+    assert pp.output_store.get_files_from_table_log() == ["all_types_3.csv"]
+    assert reader.read(pp.files_written[0])["i"].tolist() == list(range(10)) * 3
+
+
+@pytest.mark.parametrize("append_strategy", ["append", "rewrite"])
+@pytest.mark.parametrize("partition_by", [None, "my_bool"])
+def test_pack_data_staged(tmp_path, append_strategy, partition_by):
+    input_map = {"tests/data/all_types.csv": ["land/all_types/all_types_a.csv"]}
+    pp = setup_packer(tmp_path, input_map, output_file_ext="csv")
+    if partition_by:
+        pp = setup_packer(tmp_path, output_file_ext="csv", partition_by=partition_by)
+    pp.pack_data()
+
+    input_map = {"tests/data/all_types.csv": ["land/all_types/all_types_b.csv"]}
+    pp = setup_packer(
+        tmp_path,
+        input_map,
+        output_file_ext="csv",
+        use_staging=True,
+        use_manifest=True,
+        append_strategy=append_strategy,
+        partition_by=partition_by,
+    )
+    pp.input_store.refresh()
+    pp.pack_data()
+
+    # the latest file is replaced by its staged copy, with the new rows added
+    output_files = [
+        f
+        for f in pp.output_store.get_files_from_table_log(full_path=True)
+        if f.endswith(".csv")
+    ]
+    assert sorted(pp.files_written) == sorted(output_files)
+    out = pd.concat(reader.read(f) for f in output_files)
+    assert sorted(out["i"].tolist()) == sorted(list(range(10)) * 3)
+    staging_path = os.path.join(tmp_path, "db/_staging")
+    assert [f for _, _, files in os.walk(staging_path) for f in files] == []
+    assert not os.path.exists(os.path.join(tmp_path, "db/all_types.commit.json"))
+    # the manifest is committed with the files
+    manifest = PackManifest.read(os.path.join(tmp_path, "db/all_types.manifest.json"))
+    assert len(manifest.inputs) == 2
+
+
+@pytest.mark.parametrize("input_ff", ["csv", "parquet"])
+@pytest.mark.parametrize("chunksize", [7, None])
+def test_pack_data_staged_resume(tmp_path, monkeypatch, input_ff, chunksize):
+    input_map = {
+        "tests/data/all_types.csv": [
+            f"land/all_types/all_types_{n}.{input_ff}" for n in range(6)
+        ]
+    }
+    kwargs = dict(
+        output_file_ext="csv",
+        metadata="tests/data/all_types.json",
+        cast_parquet=True,
+        use_staging=True,
+        read_chunksize=chunksize,
+        file_limit_gigabytes=500 * 10**-9,
+    )
+    pp = setup_packer(tmp_path, input_map, **kwargs)
+    read_input = pp._read_input
+
+    def fail_part_way(fp, skip_rows=0):
+        # after the first chunk of the fifth input, if it's read in chunks
+        for n, frame in enumerate(read_input(fp, skip_rows)):
+            if fp.endswith(f"all_types_4.{input_ff}") and n == int(bool(chunksize)):
+                raise ConnectionError("lost the connection")
+            yield frame
+
+    monkeypatch.setattr(pp, "_read_input", fail_part_way)
+    with pytest.raises(ConnectionError):
+        pp.pack_data()
+    # nothing is in the table, but the files finished are staged
+    output_path = os.path.join(tmp_path, "db/all_types")
+    assert not os.path.exists(output_path) or os.listdir(output_path) == []
+    commit = OutputCommit.read(pp.output_store._get_commit_path())
+    assert not commit.complete
+    assert commit.rows_staged == (47 if chunksize else 40)
+    staged_times = {
+        table_file: os.stat(staged_file).st_mtime_ns
+        for staged_file, table_file in commit.staged_files.items()
+    }
+
+    pp = setup_packer(tmp_path, **kwargs)
+    reads = []
+    read_input = pp._read_input
+
+    def record_reads(fp, skip_rows=0):
+        reads.append((os.path.basename(fp), skip_rows))
+        return read_input(fp, skip_rows)
+
+    monkeypatch.setattr(pp, "_read_input", record_reads)
+    pp.pack_data()
+    # it carries on from the input and row the staged files end at
+    checkpoint = divmod(commit.rows_staged, 10)
+    assert reads[0] == (f"all_types_{checkpoint[0]}.{input_ff}", checkpoint[1])
+    assert len(reads) == 6 - checkpoint[0]
+    # the files staged before are kept, rather than written again
+    for table_file, staged_time in staged_times.items():
+        assert os.stat(table_file).st_mtime_ns == staged_time
+    assert pp.rows_written == 60
+    assert pp.files_written == [
+        os.path.join(output_path, f"all_types_{n}.csv")
+        for n in range(len(pp.files_written))
+    ]
+    out = pd.concat(reader.read(f) for f in pp.files_written)
+    assert out["i"].tolist() == list(range(10)) * 6
+    assert not os.path.exists(pp.output_store._get_commit_path())
+
+
+@pytest.mark.parametrize("chunksize", [7, None])
+def test_read_input_skip_rows(tmp_path, chunksize):
+    input_path = os.path.join(tmp_path, "land/all_types/all_types.parquet")
+    os.makedirs(os.path.dirname(input_path))
+    pq.write_table(
+        pa.Table.from_pandas(data_maker(100), preserve_index=False),
+        input_path,
+        row_group_size=30,
+    )
+    pp = setup_packer(tmp_path, read_chunksize=chunksize)
+    # the first row group is skipped without being read
+    frames, skipped_rows = pp._read_row_groups_after(input_path, 35)
+    assert skipped_rows == 30
+    assert sum(f.shape[0] for f in frames) == 70
+
+    frames = list(pp._read_input(input_path, 35))
+    assert pd.concat(pa.Table.to_pandas(f) for f in frames)["i"].tolist() == (
+        list(range(5, 10)) + list(range(10)) * 6
+    )
+
+
+def test_pack_data_staged_other_inputs(tmp_path):
+    # a pack interrupted with other inputs isn't carried on from
+    staged_map = {"tests/data/all_types.csv": ["db/_staging/all_types/all_types_0.csv"]}
+    pp = setup_packer(
+        tmp_path,
+        {"tests/data/all_types.csv": ["land/all_types/all_types_a.csv"]},
+        staged_map,
+        output_file_ext="csv",
+        use_staging=True,
+    )
+    staged_path = os.path.join(tmp_path, "db/_staging/all_types/all_types_0.csv")
+    OutputCommit(
+        pp.output_store._get_commit_path(),
+        {staged_path: os.path.join(tmp_path, "db/all_types/all_types_0.csv")},
+        complete=False,
+        inputs=[["other.csv", 10]],
+        rows_staged=10,
+    ).write()
+    pp.pack_data()
+    assert pp.rows_written == 10
+    assert reader.read(pp.files_written[0])["i"].tolist() == list(range(10))
+
+
+def test_pack_data_staged_s3(s3_bucket):
+    writer.write(data_maker(10), f"{s3_bucket}/land/all_types/all_types_a.csv")
+    writer.write(data_maker(10), f"{s3_bucket}/db/all_types/all_types_0.csv")
+    pp = S3DataPacker(
+        f"{s3_bucket}/land/",
+        f"{s3_bucket}/db/",
+        "all_types",
+        output_file_ext="csv",
+        upload_max_workers=1,
+        use_staging=True,
+    )
+    result = pp.pack_data()
+    assert pp.files_written == [f"{s3_bucket}/db/all_types/all_types_0.csv"]
+    assert result.files_overwritten == pp.files_written
+    # arrow_pd_parser reads the input with a client of its own, so it isn't counted
+    assert result.s3_requests == {
+        # the commit, not found, and the table's file appended to
+        "GetObject": 2,
+        "ListObjectsV2": 2,
+        # the table's file into staging, and back
+        "CopyObject": 2,
+        # the commit, as staged and complete, and the staged file
+        "PutObject": 3,
+        "DeleteObject": 2,
+    }
+    assert reader.read(pp.files_written[0])["i"].tolist() == list(range(10)) * 2
+    pp.output_store.refresh()
+    assert pp.output_store.get_files_from_table_log() == ["all_types_0.csv"]
@@ -0,0 +1,101 @@
+import io
+import os
+import pytest
+
+import boto3
+import pandas as pd
+
+from dataengineeringutils3 import s3
+from s3_data_packer import s3_multipart
+from s3_data_packer.rolling_writer import RollingFileWriter
+from s3_data_packer.s3_multipart import S3MultipartWriter
+from s3_data_packer.s3_output_store import S3OutputStore
+from tests.helpers import data_maker
+
+
+def get_object_bytes(path: str) -> bytes:
+    bk, ky = s3.s3_path_to_bucket_key(path)
+    return boto3.client("s3").get_object(Bucket=bk, Key=ky)["Body"].read()
+
+
+@pytest.mark.parametrize("num_bytes", [10, 5 * 2**20, 12 * 2**20 + 7])
+@pytest.mark.parametrize("max_workers", [1, 3])
+def test_multipart_writer(s3_bucket, num_bytes, max_workers):
+    path = f"{s3_bucket}/db/all_types/all_types_0.csv"
+    data = os.urandom(num_bytes)
+    with S3MultipartWriter(
+        path, max_workers=max_workers, part_size_bytes=5 * 2**20, max_queued_parts=1
+    ) as w:
+        # write in uneven pieces, as a serialiser would
+        for i in range(0, num_bytes, 1000003):
+            w.write(data[i : i + 1000003])
+        assert w.tell() == num_bytes
+    assert get_object_bytes(path) == data
+
+
+def test_multipart_writer_part_size(s3_bucket):
+    with pytest.raises(ValueError):
+        S3MultipartWriter(f"{s3_bucket}/a.csv", part_size_bytes=2**20)
+
+
+def test_rolling_writer_concurrent_upload(s3_bucket):
+    output_store = S3OutputStore(
+        f"{s3_bucket}/db", "all_types", file_limit_gigabytes=20 * 10**-6
+    )
+    output_store.table_extension = "csv"
+    df = data_maker(1000)
+    with RollingFileWriter(
+        output_store, initial_batch_rows=50, upload_max_workers=2
+    ) as rolling_writer:
+        rolling_writer.write(df)
+
+    assert len(rolling_writer.files_written) > 1
+    # the written files are in the store's listing, with their details
+    for entry in output_store.get_file_entries_from_table_log():
+        bk, ky = s3.s3_path_to_bucket_key(entry.path)
+        head = boto3.client("s3").head_object(Bucket=bk, Key=ky)
+        assert (entry.size, entry.etag) == (head["ContentLength"], head["ETag"])
+    assert rolling_writer.files_written == [
+        f"{s3_bucket}/db/all_types/all_types_{i}.csv"
+        for i in range(len(rolling_writer.files_written))
+    ]
+    out_df = pd.concat(
+        [
+            pd.read_csv(io.BytesIO(get_object_bytes(f)))
+            for f in rolling_writer.files_written
+        ]
+    )
+    assert out_df.shape[0] == df.shape[0]
+    assert out_df["i"].tolist() == df["i"].tolist()
+
+
+@pytest.mark.parametrize("existing_bytes", [10, 6 * 2**20])
+def test_multipart_writer_existing(s3_bucket, existing_bytes):
+    path = f"{s3_bucket}/db/all_types/all_types_0.csv"
+    existing = os.urandom(existing_bytes)
+    bk, ky = s3.s3_path_to_bucket_key(path)
+    boto3.client("s3").put_object(Bucket=bk, Key=ky, Body=existing)
+
+    data = os.urandom(100)
+    with S3MultipartWriter(path, existing_size=existing_bytes) as w:
+        assert w.tell() == existing_bytes
+        w.write(data)
+    assert get_object_bytes(path) == existing + data
+
+
+@pytest.mark.parametrize("existing_bytes", [12 * 2**20, 13 * 2**20])
+def test_multipart_writer_existing_small_tail(s3_bucket, monkeypatch, existing_bytes):
+    # copied in 6MiB parts, so the last 0 or 1MiB of the object is too small to be a
+    # part followed by the uploaded ones
+    monkeypatch.setattr(s3_multipart, "_max_part_size_bytes", 6 * 2**20)
+    path = f"{s3_bucket}/db/all_types/all_types_0.csv"
+    existing = os.urandom(existing_bytes)
+    bk, ky = s3.s3_path_to_bucket_key(path)
+    boto3.client("s3").put_object(Bucket=bk, Key=ky, Body=existing)
+
+    data = os.urandom(6 * 2**20)
+    with S3MultipartWriter(
+        path, part_size_bytes=5 * 2**20, existing_size=existing_bytes
+    ) as w:
+        w.write(data)
+    assert get_object_bytes(path) == existing + data
@@ -1,6 +1,14 @@
 import os
 import pytest
 
+import boto3
+
+from dataengineeringutils3 import s3
+from s3_data_packer import helpers
+from s3_data_packer.s3_data_packer import S3DataPacker
+from s3_data_packer.s3_output_store import S3OutputStore
+from s3_data_packer.s3_table_store import S3TableStore
+from tests.conftest import test_bucket
 from tests.helpers import setup_output_store, setup_input_store
 
 
@@ -291,3 +299,103 @@ def test_latest_file_with_partition(
 ):
     output_store = setup_output_store(tmp_path, output_file_map, partition=partition)
     assert output_store._get_filename() == expected_latest_file
+
+
+def test_table_log_listed_once(s3_bucket, monkeypatch):
+    s3_client = boto3.client("s3")
+    for key in [
+        "land/all_types/a.csv",
+        "land/other_table/a.csv",
+        "db/all_types/all_types_0.csv",
+    ]:
+        s3_client.put_object(Bucket=test_bucket, Key=key, Body=b"i\n1\n")
+
+    # count the listings made
+    listed = []
+    list_s3_files = helpers._list_s3_files
+
+    def counting_list_s3_files(prefix):
+        listed.append(prefix)
+        return list_s3_files(prefix)
+
+    monkeypatch.setattr(helpers, "_list_s3_files", counting_list_s3_files)
+    packer = S3DataPacker(
+        f"{s3_bucket}/land", f"{s3_bucket}/db", "all_types", output_file_ext="csv"
+    )
+    packer.output_store._reset()
+    packer.input_store.table_name = "all_types"
+    # only the table's own prefix is listed
+    assert sorted(listed) == [
+        f"{s3_bucket}/db/all_types/",
+        f"{s3_bucket}/land/all_types/",
+    ]
+    assert packer.input_store.get_files_from_table_log() == ["a.csv"]
+
+    # a new landing file is only seen once the store is refreshed
+    s3_client.put_object(Bucket=test_bucket, Key="land/all_types/b.csv", Body=b"i\n")
+    assert packer.input_store.get_files_from_table_log() == ["a.csv"]
+    packer.input_store.refresh()
+    assert packer.input_store.get_files_from_table_log() == ["a.csv", "b.csv"]
+    assert len(listed) == 3
+
+
+@pytest.mark.parametrize(
+    "table_names,expected_tables",
+    [
+        (None, ["table_a", "table_b", "other"]),
+        (["table_a", "other"], ["table_a", "other"]),
+        (["table_*"], ["table_a", "table_b"]),
+        (["missing"], []),
+    ],
+)
+def test_multi_table_log(s3_bucket, monkeypatch, table_names, expected_tables):
+    s3_client = boto3.client("s3")
+    for table in ["table_a", "table_b", "other"]:
+        for fn in ["0.csv", "1.csv", "p=1/2.csv"]:
+            s3_client.put_object(
+                Bucket=test_bucket, Key=f"land/{table}/{fn}", Body=b"i\n1\n"
+            )
+
+    listed = []
+    list_s3_files = helpers._list_s3_files
+
+    def counting_list_s3_files(prefix):
+        listed.append(prefix)
+        return list_s3_files(prefix)
+
+    monkeypatch.setattr(helpers, "_list_s3_files", counting_list_s3_files)
+    store = S3TableStore(f"{s3_bucket}/land", table_names=table_names)
+    assert sorted(store.table_log) == sorted(expected_tables)
+    for table in expected_tables:
+        assert store.table_log[table] == ["0.csv", "1.csv", "p=1/2.csv"]
+    assert sorted(listed) == sorted(f"{s3_bucket}/land/{t}/" for t in expected_tables)
+
+    # moving onto one of the tables uses the listing already made
+    for table in expected_tables:
+        store.table_name = table
+        assert store.get_files_from_table_log() == ["0.csv", "1.csv", "p=1/2.csv"]
+    assert len(listed) == len(expected_tables)
+
+
+@pytest.mark.parametrize("file_limit_gigabytes", [1, 1 * 10**-9])
+def test_file_entries_from_listing(s3_bucket, monkeypatch, file_limit_gigabytes):
+    s3_client = boto3.client("s3")
+    for key in ["db/all_types/all_types_0.csv", "db/all_types/all_types_1.csv"]:
+        s3_client.put_object(Bucket=test_bucket, Key=key, Body=b"i\n1\n")
+    output_store = S3OutputStore(
+        f"{s3_bucket}/db", "all_types", file_limit_gigabytes=file_limit_gigabytes
+    )
+
+    def no_head(f):
+        raise AssertionError(f"head_object called for {f}")
+
+    monkeypatch.setattr(helpers, "_get_s3_file_head", no_head)
+    # size checks come from the listing
+    assert output_store._should_append_data() == (file_limit_gigabytes == 1)
+
+    for entry in output_store.get_file_entries_from_table_log():
+        bk, ky = s3.s3_path_to_bucket_key(entry.path)
+        head = s3_client.head_object(Bucket=bk, Key=ky)
+        assert entry.size == head["ContentLength"]
+        assert entry.etag == head["ETag"]
+        assert entry.last_modified == head["LastModified"]